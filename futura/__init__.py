@@ -14,6 +14,15 @@ wurst.relink_technosphere_exchanges = wmp.relink_technosphere_exchanges
 wurst.transformations.relink_technosphere_exchanges = wmp.relink_technosphere_exchanges
 wurst.transformations.geo.relink_technosphere_exchanges = wmp.relink_technosphere_exchanges
 wurst.transformations.geo.allocate_inputs = wmp.allocate_inputs
+wurst.copy_to_new_location = wmp.copy_to_new_location
+wurst.transformations.copy_to_new_location = wmp.copy_to_new_location
+wurst.transformations.geo.copy_to_new_location = wmp.copy_to_new_location
+
+# equals filters carry a description and get_many uses the WurstDatabase index to answer them
+wurst.equals = wmp.equals
+wurst.searching.equals = wmp.equals
+wurst.get_many = wmp.get_many
+wurst.searching.get_many = wmp.get_many
 
 @wrapt.decorator
 def return_WurstProcess(wrapped, instance, args, kwargs):
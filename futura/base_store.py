@@ -0,0 +1,218 @@
+from .storage import storage
+from .container import ContainerReader, write_container, BASE_LOCATORS
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+
+# Increase if the way base databases are extracted or fixed changes, so old snapshots aren't used
+STORE_VERSION = 1
+
+
+def brightway_state(project_name, database_names):
+    """
+    The Brightway modification state of ``database_names`` in ``project_name``: the ``modified`` time and ``number``
+    Brightway records for each database, which change whenever the database is written
+
+    :return: list of ``[database name, modified, number]``, or None if a database doesn't exist
+    """
+    from bw2data import projects, databases
+
+    if project_name not in projects:
+        return None
+
+    previous = projects.current
+    if previous != project_name:
+        projects.set_current(project_name)
+
+    try:
+        state = []
+        for name in database_names:
+            if name not in databases:
+                return None
+            metadata = databases[name]
+            state.append([name, metadata.get('modified'), metadata.get('number')])
+        return state
+    finally:
+        if previous != project_name:
+            projects.set_current(previous)
+
+
+class BaseStore:
+
+    """
+    Local store of the base databases extracted from Brightway (usually ecoinvent), so they're only extracted once.
+
+    Each snapshot holds the datasets as :func:`~futura.wrappers.FuturaDatabase.extract_bw2_database` leaves them,
+    saved as a container file (see :mod:`futura.container`) named after a hash of the project, the database names and
+    their Brightway modification state, so writing to the database in Brightway means it's extracted again next time.
+    Old snapshots stay until they're removed with :func:`invalidate` (or ``futura-store invalidate``).
+
+    Snapshots can also be used as the base of delta ``.fl`` files (see :func:`~futura.loader.FuturaLoader.save`),
+    and delta files find them here by their content hash.
+
+    :param directory: default is ``bases`` in ``storage.data_dir``, created when the first snapshot is stored
+    :type directory: str, optional
+    :param state: function giving the modification state of a project's databases, default is :func:`brightway_state`
+    :type state: callable, optional
+    """
+
+    def __init__(self, directory=None, state=brightway_state):
+
+        self.directory = directory or os.path.join(storage.data_dir, 'bases')
+        self.state = state
+
+    def __repr__(self):
+        return "BaseStore in {} ({} snapshots)".format(self.directory, len(self.entries()))
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, 'manifest.json')
+
+    def entries(self):
+        """
+        ``{key: entry}`` for every snapshot, where each entry has the ``project``, ``databases``, Brightway ``state``,
+        ``content_hash`` and ``created`` time of the snapshot
+        """
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, 'r') as f:
+            entries = json.load(f)
+        return {key: entry for key, entry in entries.items() if os.path.exists(self.path(key))}
+
+    def _write_entries(self, entries):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(entries, f, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+    def path(self, key):
+        return os.path.join(self.directory, "{}.fdb".format(key))
+
+    def key(self, project_name, database_names):
+        """
+        Key of the snapshot of ``database_names`` in ``project_name`` in their current state, None if they don't exist
+        """
+        state = self.state(project_name, list(database_names))
+        if state is None:
+            return None
+        description = json.dumps([STORE_VERSION, project_name, list(database_names), state], default=str)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def load(self, project_name, database_names):
+        """
+        The datasets of the snapshot of ``database_names`` in their current state, or None if there isn't one
+        """
+        key = self.key(project_name, database_names)
+        if key is None or not os.path.exists(self.path(key)):
+            return None
+
+        with ContainerReader(self.path(key)) as reader:
+            return list(reader)
+
+    def store(self, project_name, database_names, datasets):
+        """
+        Save a snapshot of ``datasets``, extracted from ``database_names`` in ``project_name``
+
+        :return: path of the snapshot
+        """
+        key = self.key(project_name, database_names)
+        assert key is not None, "{} aren't in the project {}".format(", ".join(database_names), project_name)
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        path = self.path(key)
+        write_container(path, datasets, header={'kind': 'base', 'project': project_name,
+                                                'databases': list(database_names)})
+
+        with ContainerReader(path) as reader:
+            content_hash = reader.content_hash
+
+        entries = self.entries()
+        entries[key] = {'project': project_name, 'databases': list(database_names),
+                        'state': self.state(project_name, list(database_names)), 'content_hash': content_hash,
+                        'created': datetime.datetime.now().isoformat()}
+        self._write_entries(entries)
+
+        return path
+
+    def get(self, project_name, database_names, extract):
+        """
+        The datasets of ``database_names``, from the snapshot if there is one, otherwise from ``extract()``, which are
+        then stored for next time
+
+        :param extract: function returning the extracted datasets
+        :return: ``(datasets, path of the snapshot)``
+        """
+        datasets = self.load(project_name, database_names)
+        if datasets is None:
+            datasets = extract()
+            path = self.store(project_name, database_names, datasets)
+        else:
+            path = self.path(self.key(project_name, database_names))
+        return datasets, path
+
+    def locate(self, content_hash):
+        """
+        Path of the snapshot with this content hash, or None
+        """
+        for key, entry in self.entries().items():
+            if entry.get('content_hash') == content_hash:
+                return self.path(key)
+        return None
+
+    def invalidate(self, project_name=None, database_name=None):
+        """
+        Remove snapshots, of every database by default
+
+        :param project_name: only remove snapshots from this project
+        :param database_name: only remove snapshots including this database
+        :return: number of snapshots removed
+        """
+        entries = self.entries()
+        removed = [key for key, entry in entries.items()
+                   if project_name in (None, entry['project']) and database_name in [None] + entry['databases']]
+
+        for key in removed:
+            os.remove(self.path(key))
+            del entries[key]
+        self._write_entries(entries)
+
+        return len(removed)
+
+
+base_store = BaseStore()
+
+# delta files saved against a snapshot can find it here
+BASE_LOCATORS.append(base_store.locate)
+
+
+def main(argv=None):
+    """
+    Entry point of the ``futura-store`` console script, to list or invalidate stored base databases
+    """
+    parser = argparse.ArgumentParser(prog='futura-store', description="Manage futura's stored base databases")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('list', help="list the stored base databases")
+
+    invalidate_parser = subparsers.add_parser('invalidate', help="remove stored base databases, so they're "
+                                                                 "extracted from Brightway again")
+    invalidate_parser.add_argument('--project', help="only those from this project")
+    invalidate_parser.add_argument('--database', help="only those including this database")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        for key, entry in base_store.entries().items():
+            print("{}  {}  {}  {}".format(key[:12], entry['project'], ", ".join(entry['databases']), entry['created']))
+    else:
+        count = base_store.invalidate(args.project, args.database)
+        print("Removed {} stored base database{}".format(count, '' if count == 1 else 's'))
+
+    return 0
@@ -0,0 +1,192 @@
+from collections import OrderedDict, namedtuple
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'invalidations', 'maxsize', 'currsize'])
+
+
+def _canonical(obj):
+    if isinstance(obj, dict):
+        return tuple(sorted((k, _canonical(v)) for k, v in obj.items()))
+    elif isinstance(obj, list):
+        return ('__list__',) + tuple(_canonical(x) for x in obj)
+    elif isinstance(obj, tuple):
+        return ('__tuple__',) + tuple(_canonical(x) for x in obj)
+    return obj
+
+
+def canonical_key(funcs):
+    """
+    Build a hashable cache key from the descriptions of a set of filters
+
+    :param funcs: filter functions, usually the :class:`~futura.proxy.WurstFilter` objects made by
+        :func:`~futura.utils.create_filter_from_description`
+    :return: key, or ``None`` if any of the filters has no description (and so can't be cached)
+    """
+    descriptions = [getattr(f, 'description', None) for f in funcs]
+
+    if not descriptions or any(d is None for d in descriptions):
+        return None
+
+    key = tuple(_canonical(d) for d in descriptions)
+
+    try:
+        hash(key)
+    except TypeError:
+        return None
+
+    return key
+
+
+def _fields(description):
+    # the dataset fields a described filter reads, or None if that isn't known
+    if not isinstance(description, dict):
+        return None
+
+    kind = description.get('filter')
+    args = description.get('args', [])
+
+    if kind in ('equals', 'contains', 'startswith', 'doesnt_contain_any') and args:
+        return {args[0]}
+    elif kind in ('either', 'exclude'):
+        fields = set()
+        for x in args:
+            found = _fields(x)
+            if found is None:
+                return None
+            fields |= found
+        return fields
+
+    return None
+
+
+class _CacheEntry:
+
+    def __init__(self, funcs, result, version, length):
+        self.funcs = list(funcs)
+        self.fields = set()
+        for f in self.funcs:
+            found = _fields(getattr(f, 'description', None))
+            if found is None:
+                self.fields = None
+                break
+            self.fields |= found
+        self.result = list(result)
+        self.ids = {id(x) for x in self.result}
+        self.version = version
+        self.length = length
+
+    def matches(self, ds):
+        return all(f(ds) for f in self.funcs)
+
+    def reads(self, keys):
+        return self.fields is None or keys is None or any(key in self.fields for key in keys)
+
+    def add(self, ds):
+        self.result.append(ds)
+        self.ids.add(id(ds))
+
+
+class FilterCache:
+
+    """
+    LRU cache of filter results for a :class:`~futura.proxy.WurstDatabase`, keyed by the canonicalised filter
+    descriptions and the version of the database.
+
+    The database increases its version every time it's changed. Entries made before datasets were appended are caught
+    up by checking only the new datasets, entries affected by a dataset changed in place (see :func:`changed`) are
+    dropped, and any other change to the database clears the cache.
+
+    :param maxsize: maximum number of filter results to keep
+    :type maxsize: int, optional
+    """
+
+    def __init__(self, maxsize=128):
+
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __repr__(self):
+        return "FilterCache with {} items ({} hits, {} misses)".format(len(self.entries), self.hits, self.misses)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def info(self):
+        """
+        Cache statistics
+
+        :rtype: :class:`CacheInfo`
+        """
+        return CacheInfo(self.hits, self.misses, self.invalidations, self.maxsize, len(self.entries))
+
+    def get(self, key, data):
+        """
+        Get the cached result for ``key``, if it's still valid for the current version of ``data``
+
+        :param key: key from :func:`canonical_key`
+        :param data: the :class:`~futura.proxy.WurstDatabase` the result came from
+        :return: list of datasets, or ``None`` on a miss
+        """
+        entry = self.entries.get(key)
+
+        if entry is not None and entry.version != data.version:
+            if entry.version < data.rebased or not self._catch_up(entry, data):
+                self._drop(key)
+                entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry.result
+
+    def _catch_up(self, entry, data):
+        # Only appends have happened since the entry was made, so check the new datasets at the end of the database
+        try:
+            for ds in data[entry.length:]:
+                if entry.matches(ds):
+                    entry.add(ds)
+        except Exception:
+            return False
+
+        entry.version = data.version
+        entry.length = len(data)
+        return True
+
+    def put(self, key, data, funcs, result):
+        self.entries[key] = _CacheEntry(funcs, result, data.version, len(data))
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def changed(self, ds, keys=None):
+        """
+        Drop the entries whose result would change now that ``ds`` has been changed in place
+
+        :param keys: the fields of ``ds`` which were changed, default is any field. Only the entries whose filters read
+            one of them are checked
+        """
+        for key, entry in list(self.entries.items()):
+            if not entry.reads(keys):
+                continue
+            try:
+                still_valid = (id(ds) in entry.ids) == entry.matches(ds)
+            except Exception:
+                still_valid = False
+
+            if not still_valid:
+                self._drop(key)
+
+    def _drop(self, key):
+        del self.entries[key]
+        self.invalidations += 1
+
+    def clear(self):
+        self.invalidations += len(self.entries)
+        self.entries.clear()
@@ -0,0 +1,165 @@
+from .storage import storage
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import shutil
+
+try:
+    import _pickle as pickle
+except ImportError:
+    import pickle
+
+import zlib
+
+
+class RecipeCheckpoint:
+
+    """
+    Snapshots of the database after each action of a recipe run, so a run that dies partway through can be resumed
+    from the last completed action.
+
+    Each run gets its own directory, named after the fingerprint of the recipe and its starting database (see
+    :func:`~futura.recipe_cache.recipe_fingerprints`), holding the latest snapshot and a ``state.json`` file saying
+    which snapshot that is and how many actions it covers. Each snapshot gets a new file, written before the state file
+    is switched over to it, and the previous snapshot is only removed after that, so a run killed at any point leaves a
+    state file pointing at a complete snapshot of the actions it says.
+
+    The database is pickled by :func:`save` itself, on the thread running the recipe, as the next action changes the
+    database and the snapshot has to be taken before it does. Only compressing and writing the snapshot happen on a
+    background thread while the recipe carries on. At most one snapshot is written at a time, and the thread is stopped
+    by :func:`close` (or :func:`finish`) and started again by the next :func:`save`.
+
+    :param directory: directory for the checkpoints, default is ``checkpoints`` in ``storage.cache_dir``
+    :type directory: str, optional
+    """
+
+    def __init__(self, directory=None):
+
+        self.directory = directory or os.path.join(storage.cache_dir, 'checkpoints')
+        self.fingerprints = None
+        self.path = None
+
+        self._writer = None
+        self._pending = None
+
+    def __repr__(self):
+        return "RecipeCheckpoint in {}".format(self.path or self.directory)
+
+    def attach(self, fingerprints):
+        """
+        Use the checkpoint for the run identified by ``fingerprints`` (from
+        :func:`~futura.recipe_cache.recipe_fingerprints`)
+        """
+        self.fingerprints = list(fingerprints)
+        self.path = os.path.join(self.directory, self.fingerprints[-1])
+
+    @property
+    def state_file(self):
+        return os.path.join(self.path, 'state.json')
+
+    def database_file(self, completed):
+        return os.path.join(self.path, 'database_{}.fdb'.format(completed))
+
+    def save(self, completed, database):
+        """
+        Snapshot ``database`` after the first ``completed`` actions. The database is pickled before this returns, and
+        written to disk in the background
+
+        :param completed: number of completed actions
+        :param database: :class:`~futura.wrappers.FuturaDatabase` to save
+        """
+        data = pickle.dumps(database)
+        self.wait()
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1)
+        self._pending = self._writer.submit(self._write, completed, data)
+
+    def _write(self, completed, data):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        database_file = self.database_file(completed)
+        temp_path = database_file + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(zlib.compress(data))
+        os.replace(temp_path, database_file)
+
+        state = {'completed': completed, 'fingerprint': self.fingerprints[completed],
+                 'database': os.path.basename(database_file)}
+        temp_path = self.state_file + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.state_file)
+
+        # only now the state file points at the new snapshot can the older ones go
+        for name in os.listdir(self.path):
+            if name.startswith('database_') and name != state['database']:
+                os.remove(os.path.join(self.path, name))
+
+    def wait(self):
+        """
+        Wait for the snapshot being written, raising any error from writing it
+        """
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+    def close(self):
+        """
+        Wait for the snapshot being written and stop the writer thread, raising any error from writing the snapshot
+        """
+        try:
+            self.wait()
+        finally:
+            if self._writer is not None:
+                writer, self._writer = self._writer, None
+                writer.shutdown(wait=True)
+
+    def _state(self):
+        # the state of the latest complete snapshot, None if there isn't one
+        self.wait()
+
+        if not os.path.exists(self.state_file):
+            return None
+
+        with open(self.state_file, 'r') as f:
+            state = json.load(f)
+
+        completed = state.get('completed', 0)
+        if not 0 < completed < len(self.fingerprints) or state.get('fingerprint') != self.fingerprints[completed]:
+            return None
+        if not state.get('database') or not os.path.exists(os.path.join(self.path, state['database'])):
+            return None
+
+        return state
+
+    def completed(self):
+        """
+        Number of actions covered by the latest snapshot of this run, 0 if there isn't one
+        """
+        state = self._state()
+        return state['completed'] if state else 0
+
+    def load(self):
+        """
+        Load the latest snapshot of this run
+
+        :return: ``(number of completed actions, database)``, or ``(0, None)`` if there is no snapshot
+        """
+        state = self._state()
+        if not state:
+            return 0, None
+
+        with open(os.path.join(self.path, state['database']), 'rb') as f:
+            database = pickle.loads(zlib.decompress(f.read()))
+
+        return state['completed'], database
+
+    def finish(self):
+        """
+        Remove the checkpoint of this run once it has finished
+        """
+        self.close()
+        if self.path and os.path.isdir(self.path):
+            shutil.rmtree(self.path)
@@ -0,0 +1,175 @@
+"""
+Headless command line runner for futura recipes
+
+Runs one or more recipe files without the user interface (so without importing PySide2) and writes progress to
+stdout as JSON lines, one object per event, for batch schedulers and scripts to follow::
+
+    futura-batch recipe.yml other_recipe.yml --fdb-dir results --step-cache
+
+Anything the recipe functions print goes to stderr, so stdout only has the progress events.
+"""
+
+from .loader import FuturaLoader
+from .recipe import FuturaRecipeExecutor
+
+import argparse
+from contextlib import redirect_stdout
+import json
+import os
+import sys
+import time
+import traceback
+
+
+class ProgressWriter:
+
+    """
+    Writes progress events as JSON lines
+
+    Every event has the ``event`` name, the ``recipe`` it's about and a unix ``time``.
+
+    :param stream: file to write to, default is ``sys.stdout``
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def __call__(self, event, recipe, **fields):
+        record = {'event': event, 'recipe': recipe, 'time': time.time()}
+        record.update(fields)
+        self.stream.write(json.dumps(record, default=str) + "\n")
+        self.stream.flush()
+
+
+def output_path(recipe_path, fdb=None, fdb_dir=None):
+    """
+    Where to save the database of ``recipe_path``, if anywhere: ``fdb`` itself, or a file named after the recipe in
+    ``fdb_dir``
+    """
+    if fdb:
+        return fdb
+    if fdb_dir:
+        name, _ = os.path.splitext(os.path.basename(recipe_path))
+        return os.path.join(fdb_dir, "{}.fdb".format(name))
+    return None
+
+
+def run_recipe(recipe_path, progress, step_cache=None, checkpoint=None, resume=False, fdb=None, project=None,
+               database=None, brightway=False, base_store=False):
+    """
+    Run a single recipe file, reporting progress
+
+    :param recipe_path: path of the recipe file
+    :param progress: :class:`ProgressWriter` (or any callable with the same signature)
+    :param step_cache: passed on to :class:`~futura.recipe.FuturaRecipeExecutor`
+    :param checkpoint: passed on to :class:`~futura.recipe.FuturaRecipeExecutor`
+    :param resume: resume from the recipe's checkpoint
+    :param fdb: path to save the final database to as an ``.fdb`` file
+    :param project: Brightway project to write to, default is the recipe's ``base_project``
+    :param database: Brightway database name to write, default is the recipe's ``output_database``
+    :param brightway: write the final database to Brightway
+    :param base_store: passed on to :class:`~futura.recipe.FuturaRecipeExecutor`
+    :return: the loader holding the final database
+    :rtype: :class:`~futura.loader.FuturaLoader`
+    """
+
+    def task_finished(action, task, seconds):
+        progress('task_finished', recipe_path, action=action['action'], function=task['function'], seconds=seconds)
+
+    started = time.time()
+
+    loader = FuturaLoader(recipe_path, autocreate=False)
+    executor = FuturaRecipeExecutor(loader, step_cache=step_cache, checkpoint=checkpoint, task_callback=task_finished,
+                                    base_store=base_store)
+
+    progress('recipe_started', recipe_path, actions=len(loader.recipe.get('actions', [])))
+
+    for item in executor.recipe_generator(resume=resume):
+        event = "action_{}".format(item['status'])
+        fields = {k: v for k, v in item.items() if k not in ('message', 'status')}
+        progress(event, recipe_path, **fields)
+
+    if fdb:
+        directory, filename = os.path.split(os.path.abspath(fdb))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        loader.database.save(directory, filename)
+        progress('saved', recipe_path, path=fdb)
+
+    if brightway:
+        loader.write_database(project, database)
+        progress('written', recipe_path, project=project or loader.recipe['metadata'].get('base_project'),
+                 database=database or loader.recipe['metadata'].get('output_database'))
+
+    progress('recipe_finished', recipe_path, seconds=time.time() - started, datasets=len(loader.database.db))
+
+    return loader
+
+
+def build_parser():
+
+    parser = argparse.ArgumentParser(prog='futura-batch',
+                                     description="Run futura recipes without the user interface, writing progress to "
+                                                 "stdout as JSON lines")
+    parser.add_argument('recipes', nargs='+', help="recipe files to run, in order")
+
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('--fdb', help="save the final database to this .fdb file (only with a single recipe)")
+    output.add_argument('--fdb-dir', help="save the final database of each recipe to <recipe name>.fdb in this "
+                                          "directory")
+
+    parser.add_argument('--brightway', action='store_true', help="write the final database to Brightway")
+    parser.add_argument('--project', help="Brightway project, default is the recipe's base_project")
+    parser.add_argument('--database', help="Brightway database name, default is the recipe's output_database")
+
+    parser.add_argument('--step-cache', action='store_true', help="reuse and store cached database states")
+    parser.add_argument('--base-store', action='store_true', help="keep the databases extracted from Brightway in the "
+                                                                  "local base store and load them from there")
+    parser.add_argument('--checkpoint', action='store_true', help="snapshot the database after each action")
+    parser.add_argument('--resume', action='store_true', help="resume each recipe from its checkpoint "
+                                                              "(implies --checkpoint)")
+    parser.add_argument('--keep-going', action='store_true', help="run the rest of the recipes if one fails")
+
+    return parser
+
+
+def main(argv=None):
+    """
+    Entry point of the ``futura-batch`` console script
+
+    :return: exit code, 0 if every recipe ran, 1 otherwise
+    """
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.fdb and len(args.recipes) > 1:
+        parser.error("--fdb can only be used with a single recipe, use --fdb-dir instead")
+
+    progress = ProgressWriter(sys.stdout)
+    failed = 0
+
+    for recipe_path in args.recipes:
+        try:
+            with redirect_stdout(sys.stderr):
+                run_recipe(recipe_path, progress,
+                           step_cache=args.step_cache or None,
+                           checkpoint=args.checkpoint or args.resume or None,
+                           resume=args.resume,
+                           fdb=output_path(recipe_path, args.fdb, args.fdb_dir),
+                           project=args.project,
+                           database=args.database,
+                           brightway=args.brightway,
+                           base_store=args.base_store)
+        except Exception as e:
+            failed += 1
+            traceback.print_exc(file=sys.stderr)
+            progress('recipe_failed', recipe_path, error="{}: {}".format(type(e).__name__, e))
+            if not args.keep_going:
+                break
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+from . import warn
+
+import time
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# codec used when saving, unless another one is asked for. zlib is always available, so files saved with it can be
+# opened anywhere
+DEFAULT_CODEC = 'zlib'
+
+
+class Codec:
+
+    """
+    A compression codec for the chunks of saved databases
+
+    :param name: name stored in the header of files saved with the codec
+    :param compress: function compressing bytes
+    :param decompress: function decompressing bytes
+    """
+
+    def __init__(self, name, compress, decompress):
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+    def __repr__(self):
+        return "Codec {}".format(self.name)
+
+
+def _zstd_compress(data):
+    # compressor objects aren't thread safe, so each call gets its own
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+def _zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+CODECS = {'zlib': Codec('zlib', zlib.compress, zlib.decompress)}
+
+if lz4 is not None:
+    CODECS['lz4'] = Codec('lz4', lz4.frame.compress, lz4.frame.decompress)
+
+if zstandard is not None:
+    CODECS['zstd'] = Codec('zstd', _zstd_compress, _zstd_decompress)
+
+# the package to install for each optional codec
+OPTIONAL_CODECS = {'lz4': 'lz4', 'zstd': 'zstandard'}
+
+
+def register_codec(codec):
+    """
+    Add a :class:`Codec`, or replace one with the same name
+    """
+    CODECS[codec.name] = codec
+    return codec
+
+
+def get_codec(name=None):
+    """
+    The :class:`Codec` called ``name``, default is :data:`DEFAULT_CODEC`
+    """
+    name = name or DEFAULT_CODEC
+    if name not in CODECS:
+        if name in OPTIONAL_CODECS:
+            raise ValueError("The {} codec needs the {} package, install it with pip install {}".format(
+                name, OPTIONAL_CODECS[name], OPTIONAL_CODECS[name]))
+        raise ValueError("Unknown codec {}, the available codecs are {}".format(name, ", ".join(sorted(CODECS))))
+    return CODECS[name]
+
+
+def benchmark_codecs(database, codecs=None, threads=None, directory=None):
+    """
+    Compare saving and loading ``database`` with each codec
+
+    e.g. to compare the codecs on a full ecoinvent database::
+
+        database = FuturaDatabase()
+        database.load('ecoinvent.fdb')
+        for row in benchmark_codecs(database):
+            print(row)
+
+    :param database: :class:`~futura.wrappers.FuturaDatabase` to save
+    :param codecs: names of the codecs to compare, default is every available codec
+    :param threads: number of compression threads, see :class:`~futura.container.ContainerWriter`
+    :param directory: where to save the test files, default is a temporary directory
+    :return: list of ``{'codec', 'size', 'save_seconds', 'load_seconds'}``, one for each codec
+    :rtype: list
+    """
+    from .container import ContainerReader, write_container
+    import os
+    import tempfile
+
+    results = []
+
+    with tempfile.TemporaryDirectory(dir=directory) as temp_dir:
+        for name in codecs or sorted(CODECS):
+            path = os.path.join(temp_dir, "benchmark_{}.fdb".format(name))
+
+            started = time.perf_counter()
+            write_container(path, database.db, state=database.without_datasets(), codec=name, threads=threads)
+            saved = time.perf_counter()
+            with ContainerReader(path, threads=threads) as reader:
+                count = sum(1 for _ in reader)
+            loaded = time.perf_counter()
+
+            assert count == len(database.db)
+
+            results.append({'codec': name, 'size': os.path.getsize(path), 'save_seconds': saved - started,
+                            'load_seconds': loaded - saved})
+
+    return results
+
+
+if __name__ == '__main__':
+    import sys
+    from .wrappers import FuturaDatabase
+
+    if len(sys.argv) < 2:
+        warn("Usage: python -m futura.compression database.fdb [codec ...]")
+        sys.exit(1)
+
+    benchmark_database = FuturaDatabase()
+    benchmark_database.load(sys.argv[1])
+
+    print("{:<8}{:>14}{:>10}{:>10}".format('codec', 'size (MB)', 'save (s)', 'load (s)'))
+    for row in benchmark_codecs(benchmark_database, sys.argv[2:] or None):
+        print("{codec:<8}{size_mb:>14.1f}{save_seconds:>10.2f}{load_seconds:>10.2f}".format(
+            size_mb=row['size'] / 1e6, **row))
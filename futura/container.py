@@ -0,0 +1,516 @@
+from .compression import get_codec
+
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import getpass
+import hashlib
+import io
+import json
+import os
+import struct
+
+try:
+    import _pickle as pickle
+except ImportError:
+    import pickle
+
+# File layout:
+#
+#   MAGIC | header length | header (JSON)
+#   chunk 0 | chunk 1 | ... | state | index (compressed JSON)
+#   index offset | index length | END_MAGIC
+#
+# Each chunk is the compressed concatenation of the pickles of up to CHUNK_SIZE datasets, and the index holds the
+# offset of every chunk and the position of every dataset's pickle within its chunk, so a single dataset can be read
+# without touching the rest of the file. The state is the pickled object the datasets belong to (a FuturaDatabase or
+# a FuturaSaver), saved with an empty list of datasets. Everything after the header is compressed with the codec
+# named in the header (see futura.compression).
+#
+# The index also holds a digest of each dataset's pickle and a content hash of the whole file, which delta files
+# (saved with only the datasets that differ from a base file) use to refer to their base.
+
+MAGIC = b'FUTURA\x00\x01'
+END_MAGIC = b'FUTURAIX'
+FORMAT_VERSION = 1
+CHUNK_SIZE = 1000
+# number of threads compressing or decompressing chunks, the codecs release the GIL
+THREADS = 4
+
+# functions called as f(content_hash) to find the base of a delta file when it isn't where it was when the delta was
+# saved, each returning a path or None
+BASE_LOCATORS = []
+
+_LENGTH = struct.Struct('<Q')
+_FOOTER = struct.Struct('<QQ8s')
+
+
+def pickle_dataset(ds):
+    """
+    Pickle a dataset as a plain dict, so it has the same pickle (and digest) whether or not it's held in a
+    :class:`~futura.proxy.WurstDatabase`
+    """
+    return pickle.dumps(ds if type(ds) is dict else dict(ds))
+
+
+def dataset_digest(data):
+    """
+    Digest of the pickle of a dataset, used to tell whether it has changed
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _hash_entry(database, code, digest):
+    return "{}\x1f{}\x1f{}\x1e".format(database, code, digest).encode('utf-8')
+
+
+def _user():
+    try:
+        return getpass.getuser()
+    except Exception:
+        return None
+
+
+def is_container(path):
+    """
+    Whether ``path`` is a chunked container file, rather than a whole-object zlib pickle from older versions of futura
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def peek(path):
+    """
+    Read just the header of a saved file, without reading any datasets
+
+    The header of ``.fl`` and ``.fdb`` files has the ``database_names``, the number of ``datasets`` in each database,
+    the ``dataset_count`` and when and by whom the file was ``created``; ``.fl`` files also have the ``recipe``.
+    Files saved by older versions of futura don't have a header, and give ``{'format': 0, 'kind': 'legacy'}``.
+
+    :param path: path of the file
+    :rtype: dict
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return {'format': 0, 'kind': 'legacy'}
+        header_length, = _LENGTH.unpack(f.read(_LENGTH.size))
+        return json.loads(f.read(header_length).decode('utf-8'))
+
+
+class ContainerWriter:
+
+    """
+    Writes datasets to a chunked container file, one chunk at a time, so only a chunk's worth of pickled data is held
+    in memory at once
+
+    The file is written to a temporary path and moved into place by :func:`close`.
+
+    :param path: path of the file to write
+    :param header: extra information to store in the header
+    :type header: dict, optional
+    :param chunk_size: number of datasets in each chunk
+    :type chunk_size: int, optional
+    :param codec: name of the compression codec, default is :data:`futura.compression.DEFAULT_CODEC`
+    :type codec: str, optional
+    :param threads: number of threads compressing chunks while the next ones are pickled, default is :data:`THREADS`
+    :type threads: int, optional
+    """
+
+    def __init__(self, path, header=None, chunk_size=CHUNK_SIZE, codec=None, threads=None):
+
+        self.path = path
+        self.chunk_size = chunk_size
+        self.codec = get_codec(codec)
+        self.threads = threads or THREADS
+
+        self.header = {'format': FORMAT_VERSION, 'codec': self.codec.name,
+                       'created': datetime.datetime.now().isoformat(), 'created_by': _user()}
+        self.header.update(header or {})
+
+        self.index = {'chunks': [], 'datasets': [], 'state': None}
+        self._content_hash = hashlib.sha256()
+
+        self._pending = []
+        self._compressing = deque()
+        self._pool = ThreadPoolExecutor(max_workers=self.threads)
+        self.closed = False
+        self._temp_path = path + '.tmp'
+        self._file = open(self._temp_path, 'wb')
+
+        header_data = json.dumps(self.header, default=str).encode('utf-8')
+        self._file.write(MAGIC + _LENGTH.pack(len(header_data)) + header_data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        elif not self.closed:
+            self.close()
+
+    def add(self, ds, data=None):
+        """
+        Add a dataset
+
+        :param data: the pickle of ``ds``, if it's already been pickled
+        :return: the digest of the dataset, see :func:`dataset_digest`
+        """
+        if data is None:
+            data = pickle_dataset(ds)
+        digest = dataset_digest(data)
+
+        self._content_hash.update(_hash_entry(ds.get('database'), ds.get('code'), digest))
+        self._pending.append((ds.get('database'), ds.get('code'), data, digest))
+        if len(self._pending) >= self.chunk_size:
+            self._write_chunk()
+
+        return digest
+
+    def extend(self, datasets):
+        for ds in datasets:
+            self.add(ds)
+
+    def _write_chunk(self):
+        # chunks still being compressed aren't in the index yet
+        chunk_number = len(self.index['chunks']) + len(self._compressing)
+
+        start = 0
+        for database, code, data, digest in self._pending:
+            self.index['datasets'].append([database, code, chunk_number, start, len(data), digest])
+            start += len(data)
+
+        chunk = b''.join(data for _, _, data, _ in self._pending)
+        self._compressing.append((self._pool.submit(self.codec.compress, chunk), len(self._pending)))
+        self._pending = []
+
+        # chunks are written in order, holding at most two per thread in memory
+        while len(self._compressing) > 2 * self.threads:
+            self._write_compressed()
+
+    def _write_compressed(self):
+        future, count = self._compressing.popleft()
+        data = future.result()
+        self.index['chunks'].append([self._file.tell(), len(data), count])
+        self._file.write(data)
+
+    def close(self, state=None):
+        """
+        Write the remaining datasets, the ``state`` object and the index, and move the file into place
+        """
+        if self._pending:
+            self._write_chunk()
+        while self._compressing:
+            self._write_compressed()
+        self._pool.shutdown()
+
+        if state is not None:
+            data = self.codec.compress(pickle.dumps(state))
+            self.index['state'] = [self._file.tell(), len(data)]
+            self._file.write(data)
+
+        self.index['content_hash'] = self._content_hash.hexdigest()
+
+        data = self.codec.compress(json.dumps(self.index, default=str).encode('utf-8'))
+        offset = self._file.tell()
+        self._file.write(data)
+        self._file.write(_FOOTER.pack(offset, len(data), END_MAGIC))
+
+        self._file.close()
+        os.replace(self._temp_path, self.path)
+        self.closed = True
+
+    def abort(self):
+        self._pool.shutdown(cancel_futures=True)
+        self._file.close()
+        self.closed = True
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+
+class ContainerReader:
+
+    """
+    Reads a chunked container file written by :class:`ContainerWriter`
+
+    The header and index are read when the file is opened; chunks are only read when their datasets are needed.
+
+    :param path: path of the file to read
+    :param threads: number of threads decompressing chunks ahead of the one being read, default is :data:`THREADS`
+    :type threads: int, optional
+    """
+
+    def __init__(self, path, threads=None):
+
+        self.path = path
+        self.threads = threads or THREADS
+        self._file = open(path, 'rb')
+
+        try:
+            assert self._file.read(len(MAGIC)) == MAGIC, "{} is not a futura container file".format(path)
+            header_length, = _LENGTH.unpack(self._file.read(_LENGTH.size))
+            self.header = json.loads(self._file.read(header_length).decode('utf-8'))
+            assert self.header['format'] <= FORMAT_VERSION, \
+                "{} was saved by a newer version of futura".format(path)
+            self.codec = get_codec(self.header.get('codec', 'zlib'))
+
+            self._file.seek(-_FOOTER.size, os.SEEK_END)
+            offset, length, end_magic = _FOOTER.unpack(self._file.read(_FOOTER.size))
+            assert end_magic == END_MAGIC, "{} is incomplete".format(path)
+            self.index = json.loads(self._read(offset, length).decode('utf-8'))
+        except Exception:
+            self._file.close()
+            raise
+
+        self._positions = None
+        self._unchanged = None
+        self._base_path = None
+
+    def __repr__(self):
+        return "ContainerReader for {} ({} datasets)".format(self.path, len(self))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.index['datasets'])
+
+    def close(self):
+        self._file.close()
+
+    def _read_raw(self, offset, length):
+        self._file.seek(offset)
+        return self._file.read(length)
+
+    def _read(self, offset, length):
+        return self.codec.decompress(self._read_raw(offset, length))
+
+    @staticmethod
+    def _unpickle_chunk(data, count):
+        buffer = io.BytesIO(data)
+        return [pickle.load(buffer) for _ in range(count)]
+
+    def chunk(self, n):
+        """
+        The datasets in chunk ``n``
+        """
+        offset, length, count = self.index['chunks'][n]
+        return self._unpickle_chunk(self._read(offset, length), count)
+
+    def __iter__(self):
+        # the file is read here, the chunks are decompressed by the pool ahead of being unpickled
+        chunks = self.index['chunks']
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            decompressing = deque()
+            for offset, length, count in chunks:
+                decompressing.append((pool.submit(self.codec.decompress, self._read_raw(offset, length)), count))
+                if len(decompressing) > 2 * self.threads:
+                    future, count = decompressing.popleft()
+                    yield from self._unpickle_chunk(future.result(), count)
+            while decompressing:
+                future, count = decompressing.popleft()
+                yield from self._unpickle_chunk(future.result(), count)
+
+    def state(self):
+        """
+        The object the datasets belong to, saved without its datasets
+        """
+        if self.index['state'] is None:
+            return None
+        return pickle.loads(self._read(*self.index['state']))
+
+    @property
+    def positions(self):
+        """
+        ``{(database, code): (chunk, start, length)}`` for every dataset in the file
+        """
+        if self._positions is None:
+            self._positions = {(database, code): (chunk, start, length)
+                               for database, code, chunk, start, length, *_ in self.index['datasets']}
+        return self._positions
+
+    def codes(self):
+        return [(database, code) for database, code, *_ in self.index['datasets']]
+
+    @property
+    def content_hash(self):
+        """
+        Hash of the datasets in the file, None for files saved before it was recorded
+        """
+        return self.index.get('content_hash')
+
+    @property
+    def delta(self):
+        """
+        ``{'base': content hash, 'path': path, 'name': file name}`` of the base of a delta file, None for a full file
+        """
+        return self.header.get('delta')
+
+    def find_base(self, base_path=None):
+        """
+        Find the base of a delta file: ``base_path``, where the base was when the delta was saved, a file with the same
+        name next to the delta, or wherever a function in :data:`BASE_LOCATORS` finds it
+
+        :return: path of the base
+        """
+        delta = self.delta
+        assert delta, "{} is not a delta file".format(self.path)
+
+        candidates = [base_path, delta['path'], os.path.join(os.path.dirname(os.path.abspath(self.path)), delta['name'])]
+        candidates.extend(locator(delta['base']) for locator in BASE_LOCATORS)
+
+        for candidate in candidates:
+            if candidate and os.path.isfile(candidate) and is_container(candidate):
+                with ContainerReader(candidate) as base:
+                    if base.content_hash == delta['base']:
+                        return candidate
+
+        raise FileNotFoundError("Can't find the base database of {} (originally {})".format(self.path, delta['path']))
+
+    def datasets(self, base_path=None):
+        """
+        Every dataset in the database saved in the file, combined with its base for a delta file
+
+        The datasets of a delta file are read in their saved order, those from the base one chunk of the base at a
+        time, so neither file is held in memory. A chunk is decompressed again if the datasets taken from it aren't
+        next to each other, which only happens when the database was reordered after it was loaded from its base.
+
+        :param base_path: path of the base of a delta file, if it's not in any of the places :func:`find_base` looks
+        """
+        if not self.delta:
+            yield from self
+            return
+
+        changed = iter(self)
+        with ContainerReader(self.find_base(base_path), threads=self.threads) as base:
+            entries = base.index['datasets']
+            current, data = None, None
+
+            for n in self.index['order']:
+                if n >= 0:
+                    yield next(changed)
+                    continue
+
+                _, _, chunk, start, length, *_ = entries[-n - 1]
+                if chunk != current:
+                    offset, chunk_length, _ = base.index['chunks'][chunk]
+                    current, data = chunk, base._read(offset, chunk_length)
+                yield pickle.loads(data[start:start + length])
+
+    def fetch(self, code, database=None):
+        """
+        Read a single dataset
+
+        :param code: code of the dataset
+        :param database: name of its database, only needed if the code is in several databases
+        :return: the dataset
+        :rtype: dict
+        """
+        if self.delta and not any(key[1] == code and database in (None, key[0]) for key in self.positions):
+            return self._fetch_unchanged(code, database)
+
+        if database is None:
+            matches = [key for key in self.positions if key[1] == code]
+            assert matches, "{} is not in {}".format(code, self.path)
+            assert len(matches) == 1, "{} is in several databases ({}), pass the database name".format(
+                code, ", ".join(str(x[0]) for x in matches))
+            database = matches[0][0]
+
+        chunk, start, length = self.positions[(database, code)]
+        offset, chunk_length, _ = self.index['chunks'][chunk]
+        data = self._read(offset, chunk_length)
+
+        return pickle.loads(data[start:start + length])
+
+    def _fetch_unchanged(self, code, database):
+        # datasets a delta file doesn't hold are read from its base, unless they were removed
+        if self._unchanged is None:
+            self._base_path = self.find_base()
+            with ContainerReader(self._base_path) as base:
+                entries = base.index['datasets']
+            # {code: [database, ...]} of the datasets kept from the base
+            self._unchanged = {}
+            for n in self.index['order']:
+                if n < 0:
+                    base_database, base_code, *_ = entries[-n - 1]
+                    self._unchanged.setdefault(base_code, []).append(base_database)
+
+        matches = [x for x in self._unchanged.get(code, []) if database in (None, x)]
+        assert matches, "{} is not in {}".format(code, self.path)
+        assert len(matches) == 1, "{} is in several databases ({}), pass the database name".format(
+            code, ", ".join(str(x) for x in matches))
+
+        with ContainerReader(self._base_path, threads=self.threads) as base:
+            return base.fetch(code, matches[0])
+
+
+def write_container(path, datasets, state=None, header=None, chunk_size=CHUNK_SIZE, codec=None, threads=None):
+    """
+    Write ``datasets`` and the ``state`` object they belong to to a chunked container file
+
+    :param path: path of the file
+    :param datasets: iterable of datasets
+    :param state: object to save with the datasets, without the datasets themselves
+    :param header: extra information to store in the header
+    :param codec: name of the compression codec, see :mod:`futura.compression`
+    :param threads: number of compression threads
+    """
+    with ContainerWriter(path, header=header, chunk_size=chunk_size, codec=codec, threads=threads) as writer:
+        writer.extend(datasets)
+        writer.close(state)
+
+
+def fetch_dataset(path, code, database=None):
+    """
+    Read a single dataset from a container file, without loading the others
+
+    See :func:`ContainerReader.fetch`
+    """
+    with ContainerReader(path) as reader:
+        return reader.fetch(code, database)
+
+
+def write_delta_container(path, datasets, base_path, state=None, header=None, chunk_size=CHUNK_SIZE, codec=None,
+                          threads=None):
+    """
+    Write a delta file, holding only the datasets which are new or different from those in the file ``base_path``,
+    and the order of all the datasets, so loading it gives back every dataset in ``datasets``
+
+    :param path: path of the file
+    :param datasets: iterable of datasets
+    :param base_path: path of a full (not delta) container file
+    """
+    with ContainerReader(base_path) as base:
+        assert not base.delta, "The base of a delta file can't be a delta file itself"
+        assert base.content_hash, "{} was saved before delta files were supported, save it again to use it as a " \
+                                  "base".format(base_path)
+        base_entries = base.index['datasets']
+        content_hash = base.content_hash
+
+    # datasets whose (database, code) isn't unique in the base are always saved in full
+    counts = Counter((database, code) for database, code, *_ in base_entries)
+    unchanged = {(entry[0], entry[1]): (n, entry[-1]) for n, entry in enumerate(base_entries)
+                 if counts[(entry[0], entry[1])] == 1}
+
+    header = dict(header or {})
+    header['delta'] = {'base': content_hash, 'path': os.path.abspath(base_path), 'name': os.path.basename(base_path)}
+
+    order = []
+    changed = 0
+
+    with ContainerWriter(path, header=header, chunk_size=chunk_size, codec=codec, threads=threads) as writer:
+        for ds in datasets:
+            data = pickle_dataset(ds)
+            match = unchanged.get((ds.get('database'), ds.get('code')))
+            if match is not None and match[1] == dataset_digest(data):
+                order.append(-match[0] - 1)
+            else:
+                order.append(changed)
+                writer.add(ds, data)
+                changed += 1
+
+        writer.index['order'] = order
+        writer.close(state)
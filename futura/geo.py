@@ -0,0 +1,348 @@
+from wurst.geo import geomatcher
+from constructive_geometries import resolved_row
+import constructive_geometries
+import wurst
+
+from .storage import storage
+
+import numpy as np
+import os
+
+# Increase if the layout of the saved topology table changes
+TOPOLOGY_FORMAT = 1
+
+
+def _version_string(version):
+    if isinstance(version, tuple):
+        return ".".join(str(x) for x in version)
+    return str(version)
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+
+class Topology:
+
+    """
+    Table of the topological faces of every location in a geomatcher, with each location stored as an integer bitset
+    of its faces.
+
+    Locations are stored by the names used in datasets, i.e. ``'RER'`` rather than ``('ecoinvent', 'RER')``.
+    Containment and intersection tests are bitwise operations on the bitsets.
+
+    Building the table from a geomatcher takes a while, so :func:`cached` saves it as NumPy arrays in
+    ``storage.cache_dir``. The file name includes the table format and the versions of ``constructive_geometries``
+    and ``wurst``, so the table is rebuilt if either of them is updated.
+
+    :param names: location names
+    :param faces: face ids, in the order of the bits of the bitsets
+    :param bitsets: bitset for each location, in the same order as ``names``
+    """
+
+    def __init__(self, names, faces, bitsets):
+
+        self.names = list(names)
+        self.faces = [int(x) for x in faces]
+        self._face_array = np.array(self.faces, dtype=np.int64)
+        self.bitsets = dict(zip(self.names, bitsets))
+        self.all_faces = (1 << len(self.faces)) - 1
+
+    def __repr__(self):
+        return "Topology with {} locations and {} faces".format(len(self.names), len(self.faces))
+
+    def __contains__(self, location):
+        return location in self.bitsets
+
+    def __getitem__(self, location):
+        return self.bitsets[location]
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_geomatcher(cls, geomatcher):
+        """
+        Build the table from a geomatcher
+
+        ``('ecoinvent', x)`` locations are stored as ``x``, unless there is also a location ``x``. Locations in other
+        namespaces are left out.
+
+        :param geomatcher: geomatcher to build the table from
+        :type geomatcher: :class:`~constructive_geometries.Geomatcher`
+        """
+        faces = sorted(geomatcher.faces)
+        positions = {f: n for n, f in enumerate(faces)}
+
+        names = []
+        bitsets = []
+
+        keys = [k for k in geomatcher.topology if isinstance(k, str)]
+        keys += [k for k in geomatcher.topology if isinstance(k, tuple) and k[0] == 'ecoinvent' and k[1] not in keys]
+
+        for key in keys:
+            name = key if isinstance(key, str) else key[1]
+            bits = 0
+            for f in geomatcher.topology[key]:
+                bits |= 1 << positions[f]
+            names.append(name)
+            bitsets.append(bits)
+
+        return cls(names, faces, bitsets)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            names = data['names'].tolist()
+            faces = data['faces'].tolist()
+            bitsets = [int.from_bytes(row.tobytes(), 'little') for row in data['bitsets']]
+
+        return cls(names, faces, bitsets)
+
+    def save(self, path):
+        """
+        Save the table as compressed NumPy arrays, one row of packed bits per location
+        """
+        width = (len(self.faces) + 7) // 8
+        rows = np.array([np.frombuffer(self.bitsets[name].to_bytes(width, 'little'), dtype=np.uint8)
+                         for name in self.names], dtype=np.uint8).reshape(len(self.names), width)
+
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez_compressed(f, names=np.array(self.names), faces=np.array(self.faces, dtype=np.int64),
+                                bitsets=rows)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def cache_path(directory=None):
+        filename = "topology_{}_cg{}_wurst{}.npz".format(TOPOLOGY_FORMAT,
+                                                         _version_string(constructive_geometries.__version__),
+                                                         _version_string(wurst.__version__))
+        return os.path.join(directory or storage.cache_dir, filename)
+
+    @classmethod
+    def cached(cls, geomatcher=geomatcher, directory=None):
+        """
+        Load the table for the wurst geomatcher from the cache, building and saving it if it's not there yet
+
+        :param geomatcher: geomatcher to build the table from if it isn't cached
+        :param directory: cache directory, default is ``storage.cache_dir``
+        :rtype: :class:`Topology`
+        """
+        path = cls.cache_path(directory)
+
+        if os.path.exists(path):
+            try:
+                return cls.load(path)
+            except Exception:
+                pass
+
+        topology = cls.from_geomatcher(geomatcher)
+        try:
+            topology.save(path)
+        except OSError:
+            pass
+
+        return topology
+
+    def faces_of(self, bits):
+        """
+        Convert a bitset back into a set of face ids
+
+        :rtype: frozenset
+        """
+        width = (len(self.faces) + 7) // 8
+        row = np.unpackbits(np.frombuffer(bits.to_bytes(width, 'little'), dtype=np.uint8), bitorder='little')
+        return frozenset(self._face_array[np.flatnonzero(row[:len(self.faces)])].tolist())
+
+    def contains(self, outer, inner):
+        """
+        Check whether ``inner`` is completely within ``outer``
+
+        ``RoW`` isn't defined outside of a set of locations, so like locations that aren't in the table nothing
+        contains it and it contains nothing.
+        """
+        if outer not in self or inner not in self:
+            return False
+        bits = self[inner]
+        return bool(bits) and not bits & ~self[outer]
+
+    def intersects(self, first, second):
+        if first not in self or second not in self:
+            return False
+        return bool(self[first] & self[second])
+
+    def contained(self, location, include_self=True, biggest_first=True):
+        """
+        Get all locations that are completely within ``location``, ordered by size
+
+        :rtype: list
+        """
+        found = [(name, _popcount(self.bitsets[name])) for name in self.names
+                 if (include_self or name != location) and self.contains(location, name)]
+        found.sort(key=lambda x: x[1], reverse=biggest_first)
+        return [name for name, _ in found]
+
+
+_topology = None
+
+
+def get_topology():
+    """
+    Get the topology table of the wurst geomatcher, shared by everything in futura that works with locations
+
+    :rtype: :class:`Topology`
+    """
+    global _topology
+    if _topology is None:
+        _topology = Topology.cached()
+    return _topology
+
+
+class LocationResolver:
+
+    """
+    Memoised geography resolution for relinking technosphere exchanges.
+
+    For a dataset location and the locations of the possible providers, :func:`resolve` returns the provider locations
+    to link to and the topological faces of the dataset location which none of them cover, working both out inside a
+    :func:`~constructive_geometries.resolved_row` context the first time and answering from the cache after that.
+
+    The candidate locations are part of the key in the order they are first seen, because the geomatcher breaks ties
+    between locations of the same size in that order.
+
+    Misses are worked out with bitwise operations on a :class:`Topology` table if the dataset location and all of the
+    candidate locations are in it, and with the geomatcher otherwise (e.g. for locations only the country converter
+    recognises). Both give the same result.
+
+    The cache isn't cleared if the topology of ``geomatcher`` changes, call :func:`clear` if you change it.
+
+    :param geomatcher: the geomatcher to resolve locations with, default is the wurst geomatcher
+    :type geomatcher: :class:`~constructive_geometries.Geomatcher`, optional
+    :param topology: topology table of ``geomatcher``, by default the shared table from :func:`get_topology` for the
+        wurst geomatcher, or one built from ``geomatcher`` the first time it's needed otherwise
+    :type topology: :class:`Topology`, optional
+    """
+
+    def __init__(self, geomatcher=geomatcher, topology=None):
+
+        self.geomatcher = geomatcher
+        self._topology = topology
+        self.cache = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return "LocationResolver with {} items (hit rate {:.1%})".format(len(self.cache), self.hit_rate)
+
+    @property
+    def topology(self):
+        if self._topology is None:
+            if self.geomatcher is geomatcher:
+                self._topology = get_topology()
+            else:
+                self._topology = Topology.from_geomatcher(self.geomatcher)
+        return self._topology
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit rate': self.hit_rate, 'size': len(self.cache)}
+
+    def clear(self):
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, location, possible_locations, exclusive=True, contained=True, biggest_first=False):
+        """
+        Find the provider locations to use for a dataset in ``location``
+
+        :param location: location of the dataset being relinked
+        :param possible_locations: locations of the possible providers, after any excluded locations have been removed
+        :param exclusive: don't allow overlapping provider locations
+        :param contained: only use provider locations within ``location``, otherwise use all intersecting locations
+        :param biggest_first: search order when selecting provider locations
+        :return: ``(matched_locations, missing_faces)``, where ``missing_faces`` is the set of faces of ``location`` not
+            covered by any of the matched locations, or ``None`` if nothing matched
+        :rtype: tuple
+        """
+        candidates = tuple(dict.fromkeys(possible_locations))
+        key = (location, candidates, exclusive, contained, biggest_first)
+
+        try:
+            result = self.cache[key]
+            self.hits += 1
+            return result
+        except KeyError:
+            self.misses += 1
+
+        result = self._resolve_bitsets(location, candidates, exclusive, contained, biggest_first)
+
+        if result is None:
+            with resolved_row(candidates, self.geomatcher) as g:
+                func = g.contained if contained else g.intersects
+                gis_match = func(location, include_self=True, exclusive=exclusive,
+                                 biggest_first=biggest_first, only=list(candidates))
+
+                missing_faces = None
+                if gis_match:
+                    missing_faces = frozenset(g[location].difference(set.union(*[g[loc] for loc in gis_match])))
+
+            result = (tuple(gis_match), missing_faces)
+
+        self.cache[key] = result
+
+        return result
+
+    def _resolve_bitsets(self, location, candidates, exclusive, contained, biggest_first):
+        # Same steps as resolved_row and Geomatcher.contained/intersects, on bitsets. Returns None if the topology table
+        # can't answer, so the geomatcher is used instead
+        topology = self.topology
+
+        others = [x for x in candidates if x != 'RoW']
+        if not candidates or any(x not in topology for x in others):
+            return None
+        if location != 'RoW' and location not in topology:
+            return None
+
+        bits = {x: topology[x] for x in others}
+
+        used = 0
+        for x in others:
+            used |= bits[x]
+        bits['RoW'] = topology.all_faces & ~used
+
+        faces = bits[location] if location in bits else topology[location]
+
+        if contained:
+            found = [(x, _popcount(bits[x])) for x in candidates if bits[x] and not bits[x] & ~faces]
+        else:
+            found = [(x, (_popcount(bits[x] & faces), _popcount(bits[x]))) for x in candidates if bits[x] & faces]
+
+        found.sort(key=lambda x: x[1], reverse=biggest_first)
+        gis_match = [x for x, _ in found]
+
+        if exclusive:
+            removed, remaining = 0, []
+            for x in gis_match:
+                if not bits[x] & removed:
+                    removed |= bits[x]
+                    remaining.append(x)
+            gis_match = remaining
+
+        missing_faces = None
+        if gis_match:
+            covered = 0
+            for x in gis_match:
+                covered |= bits[x]
+            missing_faces = topology.faces_of(faces & ~covered)
+
+        return tuple(gis_match), missing_faces
+
+
+resolver = LocationResolver()
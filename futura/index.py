@@ -0,0 +1,296 @@
+INDEXED_FIELDS = ('code', 'name', 'location', 'unit', 'reference product', 'database')
+PROVIDER_FIELDS = ('name', 'reference product', 'unit')
+COMPOSITE_FIELDS = (('database', 'code'), PROVIDER_FIELDS)
+TEXT_FIELDS = ('name', 'reference product')
+
+
+def equality_filter(func):
+    """
+    Get the field and value tested by an ``equals`` filter
+
+    :param func: a filter function, usually a :class:`~futura.proxy.WurstFilter`
+    :return: ``(field, value)`` if ``func`` is a described ``equals`` filter, otherwise ``None``
+    :rtype: tuple or None
+    """
+    description = getattr(func, 'description', None)
+
+    if isinstance(description, dict) and description.get('filter') == 'equals' and len(description['args']) == 2:
+        field, value = description['args']
+        return field, value
+
+    return None
+
+
+class NGramIndex:
+
+    """
+    Case insensitive n-gram inverted index over text fields, used to find the datasets which could match a
+    ``contains`` or ``startswith`` filter without testing every dataset.
+
+    Lookups return candidates, i.e. every dataset whose field contains all the n-grams of the search text. The
+    candidates still need to be checked with the filter itself.
+
+    :param fields: text fields to index
+    :type fields: tuple, optional
+    :param n: length of the n-grams, default is 3 (trigrams)
+    :type n: int, optional
+    """
+
+    def __init__(self, fields=TEXT_FIELDS, n=3):
+
+        self.fields = tuple(fields)
+        self.n = n
+
+        self.tables = {field: {} for field in self.fields}
+        self._datasets = {}
+        self._values = {}
+
+    def __repr__(self):
+        return "NGramIndex ({}-grams) on {} with {} items".format(self.n, ", ".join(self.fields), len(self._datasets))
+
+    def grams(self, text):
+        text = text.lower()
+        return {text[i:i + self.n] for i in range(len(text) - self.n + 1)}
+
+    def add(self, ds):
+        values = {}
+        for field in self.fields:
+            value = ds.get(field)
+            if not isinstance(value, str):
+                continue
+            for gram in self.grams(value):
+                self.tables[field].setdefault(gram, set()).add(id(ds))
+            values[field] = value
+
+        self._datasets[id(ds)] = ds
+        self._values[id(ds)] = values
+
+    def remove(self, ds):
+        for field, value in self._values.pop(id(ds), {}).items():
+            for gram in self.grams(value):
+                posting = self.tables[field][gram]
+                posting.discard(id(ds))
+                if not posting:
+                    del self.tables[field][gram]
+
+        self._datasets.pop(id(ds), None)
+
+    def update(self, ds):
+        values = {field: ds.get(field) for field in self.fields if isinstance(ds.get(field), str)}
+        if id(ds) in self._datasets and values == self._values[id(ds)]:
+            return
+        self.remove(ds)
+        self.add(ds)
+
+    def can_search(self, field, text):
+        return field in self.tables and isinstance(text, str) and len(text) >= self.n
+
+    def search(self, field, text):
+        """
+        Find the datasets whose ``field`` could contain ``text``, ignoring case
+
+        :return: list of candidate datasets in no particular order, or ``None`` if the index can't answer the query
+            (e.g. ``text`` is shorter than ``n``)
+        :rtype: list or None
+        """
+        if not self.can_search(field, text):
+            return None
+
+        postings = sorted((self.tables[field].get(gram, set()) for gram in self.grams(text)), key=len)
+
+        found = set(postings[0])
+        for posting in postings[1:]:
+            if not found:
+                break
+            found &= posting
+
+        return [self._datasets[x] for x in found]
+
+
+class DatabaseIndex:
+
+    """
+    Hash indexes over a list of datasets, one per field in ``fields`` plus one per tuple of fields in ``composites``.
+
+    Each index maps a value to the list of datasets with that value, in the order they were added, so results come back
+    in the same order as a linear scan of the database would return them.
+
+    The index doesn't see changes made directly to the datasets, so if an indexed field of a dataset that is already in
+    the index is changed, call :func:`update` with that dataset. :class:`~futura.proxy.WurstDatabase` does this for
+    its datasets whenever they're changed.
+
+    :param data: datasets to index
+    :type data: iterable, optional
+    :param fields: fields to index
+    :type fields: tuple, optional
+    :param composites: tuples of fields to index together
+    :type composites: tuple, optional
+    :param text_fields: text fields to add to an :class:`NGramIndex` for ``contains`` and ``startswith`` lookups.
+        Default is no text index
+    :type text_fields: tuple, optional
+    """
+
+    def __init__(self, data=(), fields=INDEXED_FIELDS, composites=COMPOSITE_FIELDS, text_fields=()):
+
+        self.fields = tuple(fields)
+        self.composites = tuple(tuple(c) for c in composites)
+
+        self.tables = {key: {} for key in self.fields + self.composites}
+        self.text = NGramIndex(text_fields) if text_fields else None
+        self.tracked_fields = set(self.fields).union(*self.composites).union(text_fields)
+
+        self._values = {}
+        self._order = {}
+        self._counter = 0
+
+        for ds in data:
+            self.add(ds)
+
+    def __repr__(self):
+        return "DatabaseIndex on {} with {} items".format(", ".join([str(k) for k in self.tables]), len(self._values))
+
+    def __len__(self):
+        return len(self._values)
+
+    @staticmethod
+    def value_of(ds, key):
+        if isinstance(key, tuple):
+            return tuple(ds.get(k) for k in key)
+        return ds.get(key)
+
+    def add(self, ds):
+        self._order[id(ds)] = self._counter
+        self._counter += 1
+        self._insert(ds)
+        if self.text is not None:
+            self.text.add(ds)
+
+    def remove(self, ds):
+        for key, value in self._values.pop(id(ds), {}).items():
+            bucket = self.tables[key][value]
+            bucket[:] = [x for x in bucket if x is not ds]
+            if not bucket:
+                del self.tables[key][value]
+        self._order.pop(id(ds), None)
+        if self.text is not None:
+            self.text.remove(ds)
+
+    def contains(self, ds):
+        return id(ds) in self._values
+
+    def tracks(self, keys):
+        """
+        Whether changing the fields ``keys`` of a dataset can change where it is in the index
+        """
+        return any(key in self.tracked_fields for key in keys)
+
+    def update(self, ds):
+        """
+        Move a dataset to the right buckets after one of its indexed fields has been changed in place. Only the buckets
+        of the fields whose values changed are touched
+        """
+        if id(ds) not in self._values:
+            self.add(ds)
+            return
+
+        values = self._values[id(ds)]
+        position = self._order[id(ds)]
+
+        for key in self.tables:
+            value = self.value_of(ds, key)
+
+            if key in values:
+                if values[key] == value:
+                    continue
+                old = values.pop(key)
+                bucket = self.tables[key][old]
+                del bucket[self._place(bucket, position)]
+                if not bucket:
+                    del self.tables[key][old]
+
+            try:
+                bucket = self.tables[key].setdefault(value, [])
+            except TypeError:
+                continue
+            bucket.insert(self._place(bucket, position), ds)
+            values[key] = value
+
+        if self.text is not None:
+            self.text.update(ds)
+
+    def _place(self, bucket, position):
+        # index of the dataset added at ``position`` in a bucket, or where it goes, as buckets are in database order
+        low, high = 0, len(bucket)
+        while low < high:
+            middle = (low + high) // 2
+            if self._order[id(bucket[middle])] < position:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _insert(self, ds):
+
+        values = {}
+
+        for key in self.tables:
+            value = self.value_of(ds, key)
+            try:
+                bucket = self.tables[key].setdefault(value, [])
+            except TypeError:
+                # unhashable values can't be looked up, so they're left out of the index
+                continue
+
+            bucket.append(ds)
+            values[key] = value
+
+        self._values[id(ds)] = values
+
+    def lookup(self, key, value):
+        """
+        Get the datasets where ``key`` equals ``value``
+
+        :param key: field name, or tuple of field names for a composite index
+        :param value: value, or tuple of values for a composite index
+        :return: list of datasets in database order
+        :rtype: list
+        """
+        return self.tables[key].get(value, [])
+
+    def count(self, key, value):
+        """
+        Number of datasets where ``key`` equals ``value``, without building a list of them
+        """
+        return len(self.tables[key].get(value, ()))
+
+    def providers(self, name, product, unit):
+        """
+        Get the datasets which could provide a technosphere exchange, i.e. those with the given name, reference product
+        and unit
+
+        :return: list of datasets in database order
+        :rtype: list
+        """
+        return self.lookup(PROVIDER_FIELDS, (name, product, unit))
+
+    def position(self, ds):
+        """
+        Position of a dataset in the order it was added to the index
+        """
+        return self._order[id(ds)]
+
+    def text_search(self, field, text):
+        """
+        Candidate datasets for a ``contains`` or ``startswith`` filter on ``field``, see :func:`NGramIndex.search`
+
+        :return: list of datasets in database order, or ``None`` if there is no text index for ``field`` or it can't
+            answer the query
+        """
+        if self.text is None:
+            return None
+
+        found = self.text.search(field, text)
+        if found is None:
+            return None
+
+        return sorted(found, key=self.position)
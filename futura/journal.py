@@ -0,0 +1,146 @@
+import atexit
+import logging
+
+# Dataset fields recorded with every entry, as in ``wurst.log``
+DATASET_FIELDS = ("database", "code", "name", "reference product", "unit", "location")
+
+
+class LoggerSink:
+
+    """
+    Journal sink that passes entries on to a :class:`logging.Logger`, as ``wurst.log`` does
+
+    Entries are only formatted for levels the logger is enabled for, so changing the level of the logger turns the
+    detailed journal on and off.
+
+    :param logger: logger to write to, default is the ``wurst`` logger
+    """
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger('wurst')
+
+    def __repr__(self):
+        return "LoggerSink for {}".format(self.logger.name)
+
+    def enabled(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def write(self, level, record):
+        self.logger.log(level, record)
+
+
+class ListSink:
+
+    """
+    Journal sink that keeps the formatted entries in a list, e.g. to inspect the changes made by a recipe
+
+    :param level: lowest level to keep
+    """
+
+    def __init__(self, level=logging.DEBUG):
+        self.level = level
+        self.records = []
+
+    def __repr__(self):
+        return "ListSink with {} records".format(len(self.records))
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def write(self, level, record):
+        self.records.append(record)
+
+
+def format_entry(entry):
+    """
+    Format a journal entry into the record ``wurst.log`` would have made for it
+
+    :param entry: ``(level, function, message, args, dataset_values)`` tuple
+    :rtype: dict
+    """
+    _, function, message, args, values = entry
+    record = {'function': function, 'message': message.format(*args)}
+    record.update(zip(DATASET_FIELDS, values))
+    return record
+
+
+class ChangeJournal:
+
+    """
+    Buffered, structured journal of the changes futura makes to datasets.
+
+    :func:`record` keeps each change as a tuple of the message template and its arguments. Nothing is recorded unless
+    a sink is enabled for the level of the change, and messages are only formatted when the buffer is flushed to the
+    sinks, so detailed journalling costs next to nothing while it's turned off.
+
+    The buffer is flushed when it's full, when :func:`flush` is called and when Python exits.
+
+    :param buffer_size: number of entries to keep before flushing
+    :type buffer_size: int, optional
+    :param detail_level: level of the entries made for every exchange or dataset changed (relinks, copies, renamed
+        exchanges). Default is ``INFO``, as ``wurst.log`` records them; set it to ``DEBUG`` to leave them out of a log
+        at ``INFO``
+    :type detail_level: int, optional
+    """
+
+    def __init__(self, buffer_size=1000, detail_level=logging.INFO):
+
+        self.buffer_size = buffer_size
+        self.detail_level = detail_level
+        self.buffer = []
+        self.sinks = []
+
+    def __repr__(self):
+        return "ChangeJournal with {} sinks ({} buffered entries)".format(len(self.sinks), len(self.buffer))
+
+    def add_sink(self, sink):
+        # entries recorded before the sink was added aren't written to it
+        self.flush()
+        self.sinks.append(sink)
+        return sink
+
+    def remove_sink(self, sink):
+        self.flush()
+        self.sinks.remove(sink)
+
+    def enabled(self, level):
+        return any(sink.enabled(level) for sink in self.sinks)
+
+    def record(self, level, function, message, args, ds):
+        """
+        Record a change
+
+        :param level: logging level of the change
+        :param function: name of the function making the change
+        :param message: message template, formatted with ``message.format(*args)``
+        :param args: tuple of message arguments
+        :param ds: dataset (or exchange) the change was made to
+        """
+        if not self.enabled(level):
+            return
+
+        self.buffer.append((level, function, message, args, tuple(ds.get(key) for key in DATASET_FIELDS)))
+
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Format the buffered entries and write them to the sinks enabled for their level
+        """
+        buffer, self.buffer = self.buffer, []
+
+        for entry in buffer:
+            level = entry[0]
+            record = None
+            for sink in self.sinks:
+                if sink.enabled(level):
+                    if record is None:
+                        record = format_entry(entry)
+                    sink.write(level, record)
+
+
+journal = ChangeJournal()
+journal.add_sink(LoggerSink())
+
+atexit.register(journal.flush)
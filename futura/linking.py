@@ -0,0 +1,141 @@
+from bw2io.errors import StrategyError
+from bw2io.strategies.generic import format_nonunique_key_error
+
+from collections import Counter, OrderedDict
+import logging
+
+from .journal import journal
+
+REFERENCE_PRODUCT_FIELDS = ('reference product', 'name', 'unit', 'location')
+NAME_FIELDS = ('name', 'unit', 'location')
+
+
+def link_key(obj, fields):
+    """
+    Key used to match an exchange to a dataset on ``fields``
+
+    Matches the same objects as ``bw2io.utils.activity_hash``: missing fields are empty strings, lists are joined and
+    everything is lower case.
+    """
+    values = []
+    for field in fields:
+        value = obj.get(field)
+        if isinstance(value, (list, tuple)):
+            value = "".join(value or [])
+        values.append((value or "").lower())
+    return "".join(values)
+
+
+def _glo_to_row(exc):
+    if exc.get('location') == 'GLO':
+        exc['location'] = 'RoW'
+
+
+def _trim_name(exc):
+    # snip off trailing descriptions (e.g. ', at user', ', metallurgical' etc.)
+    if exc['name'].rfind(',') != -1:
+        exc['name'] = exc['name'][:exc['name'].rfind(',')]
+
+
+def _row_to_glo(exc):
+    if exc.get('location') == 'RoW':
+        exc['location'] = 'GLO'
+
+
+# (rule, change made to unlinked exchanges before trying the rule, fields to match on)
+DEFAULT_CASCADE = (
+    ('reference product', None, REFERENCE_PRODUCT_FIELDS),
+    ('name', None, NAME_FIELDS),
+    ('GLO to RoW', _glo_to_row, NAME_FIELDS),
+    ('trimmed name', _trim_name, NAME_FIELDS),
+    ('trimmed name twice', _trim_name, NAME_FIELDS),
+    ('RoW to GLO', _row_to_glo, NAME_FIELDS),
+)
+
+
+class ExchangeLinker:
+
+    """
+    Links the unlinked exchanges of imported datasets (e.g. from an Excel technology file) to a background database.
+
+    The background database is indexed once, on every set of fields used by the cascade, and each rule of the cascade
+    is tried in turn against the exchanges that are still unlinked. A rule can change the unlinked exchanges before
+    they're matched (e.g. switching ``GLO`` to ``RoW``), and those changes are kept even if the exchange isn't linked,
+    as when the rules were run one after the other with ``bw2io.strategies.generic.link_iterable_by_fields``.
+
+    Each link is recorded in :attr:`links` with the rule that made it, and in the change journal at ``INFO`` level.
+
+    :param background: datasets to link to
+    :param cascade: list of ``(rule name, change, fields)``, default is :data:`DEFAULT_CASCADE`
+    """
+
+    def __init__(self, background, cascade=DEFAULT_CASCADE):
+
+        self.cascade = list(cascade)
+        self.links = []
+
+        self.candidates = OrderedDict((fields, {}) for _, _, fields in self.cascade)
+        self.duplicates = {fields: {} for fields in self.candidates}
+
+        try:
+            for ds in background:
+                for fields, candidates in self.candidates.items():
+                    key = link_key(ds, fields)
+                    if key in candidates:
+                        self.duplicates[fields].setdefault(key, []).append(ds)
+                    else:
+                        candidates[key] = (ds['database'], ds['code'])
+        except KeyError:
+            raise StrategyError("Not all datasets in database to be linked have ``database`` or ``code`` attributes")
+
+    def __repr__(self):
+        return "ExchangeLinker with {} links".format(len(self.links))
+
+    def unlinked(self, data):
+        return [(ds, exc) for ds in data for exc in ds.get('exchanges', []) if not exc.get('input')]
+
+    def link(self, data, fields, rule):
+        """
+        Link the unlinked exchanges in ``data`` which match a background dataset on ``fields``
+
+        :return: number of exchanges linked
+        """
+        candidates = self.candidates[fields]
+        duplicates = self.duplicates[fields]
+
+        count = 0
+        for ds, exc in self.unlinked(data):
+            key = link_key(exc, fields)
+            if key in duplicates:
+                raise StrategyError(format_nonunique_key_error(exc, fields, duplicates[key]))
+            elif key in candidates:
+                exc['input'] = candidates[key]
+                self.links.append((ds, exc, rule))
+                journal.record(logging.INFO, 'extract_excel_data', "Linked exchange {} [{}] to {} ({} rule)",
+                               (exc.get('name'), exc.get('location'), exc['input'], rule), ds)
+                count += 1
+
+        return count
+
+    def link_cascade(self, data):
+        """
+        Run the cascade of rules over ``data``, stopping as soon as everything is linked
+
+        :return: number of exchanges linked by each rule
+        :rtype: :class:`collections.Counter`
+        """
+        for rule, change, fields in self.cascade:
+            unlinked = self.unlinked(data)
+            if not unlinked:
+                break
+
+            if change is not None:
+                for _, exc in unlinked:
+                    change(exc)
+
+            self.link(data, fields, rule)
+
+        return self.summary()
+
+    def summary(self):
+        return Counter(rule for _, _, rule in self.links)
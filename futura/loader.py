@@ -5,6 +5,7 @@ from futura.storage import storage
 from .wrappers import FuturaDatabase
 
 from .recipe import FuturaRecipeExecutor
+from .container import write_container, write_delta_container, is_container, ContainerReader, peek
 
 import os.path
 
@@ -40,6 +41,8 @@ class FuturaLoader:
     :type recipe_filepath: str, optional
     :param autocreate: Automatically run the recipe when it is loaded. Default is `True`
     :type autocreate: bool, optional
+    :param variables: Values for the template variables of the recipe, see :func:`load_recipe`
+    :type variables: dict, optional
 
     :ivar recipe: Dictionary representation of the current recipe. Can be set by :func:`load_recipe`
     :vartype recipe: dict
@@ -57,7 +60,7 @@ class FuturaLoader:
     :vartype load_path: str
     """
 
-    def __init__(self, recipe_filepath=None, autocreate=True):
+    def __init__(self, recipe_filepath=None, autocreate=True, variables=None):
 
         self.recipe = {}
         self.database = FuturaDatabase()
@@ -68,18 +71,22 @@ class FuturaLoader:
         self.load_path = None
 
         if self.recipe_filepath:
-            self.recipe = self.load_recipe(self.recipe_filepath)
+            self.recipe = self.load_recipe(self.recipe_filepath, variables)
         else:
             autocreate = None
 
         if autocreate:
             self.run()
 
-    def load_recipe(self, filename):
+    def load_recipe(self, filename, variables=None):
 
         """
-        Docstring: This is load_recipe - I need to write a docstring
+        Load a recipe file and set :attr:`recipe_filepath`
 
+        Recipes are jinja2 templates, rendered with ``variables`` before they're parsed
+
+        :param variables: Values for the template variables, e.g. ``{'factor': 0.5}`` for ``{{ factor }}``
+        :type variables: dict, optional
         :return: Parsed recipe as a dict
         :rtype: dict
         """
@@ -89,17 +96,45 @@ class FuturaLoader:
         with open(filename, "r") as f:
             template = jinja2.Template(f.read())
 
-        t_data = template.render()
+        t_data = template.render(**(variables or {}))
         data = yaml.load(t_data, yaml.Loader)
 
         return data
 
-    def run(self):
+    def run(self, step_cache=None, checkpoint=None):
+
+        """
+        Run the current recipe
+
+        :param step_cache: resume from the database state cached after the longest unchanged prefix of the recipe's
+            actions, and cache the state after expensive actions. ``True`` uses the default cache under
+            ``storage.cache_dir``, see :class:`~futura.recipe_cache.RecipeStepCache`
+        :type step_cache: :class:`~futura.recipe_cache.RecipeStepCache` or bool, optional
+        :param checkpoint: snapshot the database after each action, so the run can be picked up with :func:`resume` if
+            it fails. ``True`` uses the default location under ``storage.cache_dir``, see
+            :class:`~futura.checkpoint.RecipeCheckpoint`
+        :type checkpoint: :class:`~futura.checkpoint.RecipeCheckpoint` or bool, optional
+        """
 
-        executor = FuturaRecipeExecutor(self)
+        executor = FuturaRecipeExecutor(self, step_cache=step_cache, checkpoint=checkpoint)
         executor.execute_recipe()
         # executor = None
 
+    def resume(self, checkpoint=True, step_cache=None):
+
+        """
+        Resume a checkpointed run of the current recipe from the last action it completed, or run it from the start if
+        there's no checkpoint for it
+
+        The loader must be in the state the run started from (usually a new loader with the same recipe).
+
+        :param checkpoint: where the checkpoints were written, ``True`` for the default location
+        :type checkpoint: :class:`~futura.checkpoint.RecipeCheckpoint` or bool, optional
+        """
+
+        executor = FuturaRecipeExecutor(self, step_cache=step_cache, checkpoint=checkpoint)
+        executor.execute_recipe(resume=True)
+
     def write_database(self, project=None, database=None, overwrite=True):
         assert isinstance(self.database, FuturaDatabase)
         assert 'metadata' in self.recipe.keys()
@@ -112,7 +147,18 @@ class FuturaLoader:
 
         self.database.write_database(project, database, overwrite)
 
-    def save(self, save_path=None):
+    def save(self, save_path=None, codec=None, threads=None, base=None):
+
+        """
+        Save the recipe and database as an ``.fl`` file
+
+        :param save_path: default is the database names joined with ``-`` in ``storage.data_dir``
+        :param codec: compression codec, ``zlib`` (default), ``lz4`` or ``zstd``, see :mod:`futura.compression`
+        :param threads: number of compression threads
+        :param base: path of an ``.fdb`` or ``.fl`` file (e.g. of the base ecoinvent database) to save a delta against:
+            only the datasets which are new or different from those in ``base`` are saved, and ``base`` is needed to
+            load the file again
+        """
 
         if save_path is None:
             save_directory = storage.data_dir
@@ -121,19 +167,52 @@ class FuturaLoader:
             print("Saving as default filename({})".format(save_filename))
             save_path = os.path.join(save_directory, save_filename)
 
-        with open(save_path, 'wb') as f:
-            f.write(zlib.compress(pickle.dumps(FuturaSaver(self))))
+        # the datasets are written a chunk at a time, and the recipe with the rest of the database, see futura.container
+        saver = FuturaSaver(self)
+        saver.database = self.database.without_datasets()
+        # the header lets the file be previewed with peek without loading the database
+        header = dict(self.database.summary(), kind='loader', recipe=self.recipe)
+        if base:
+            write_delta_container(save_path, self.database.db, base, state=saver, header=header, codec=codec,
+                                  threads=threads)
+        else:
+            write_container(save_path, self.database.db, state=saver, header=header, codec=codec, threads=threads)
 
         print('Saved to {}'.format(save_path))
 
-    def load(self, load_path):
+    @staticmethod
+    def peek(load_path):
+        """
+        The recipe, database names, dataset counts and creation details of an ``.fl`` file, without loading it
+
+        See :func:`futura.container.peek`
+
+        :rtype: dict
+        """
+        return peek(load_path)
+
+    def load(self, load_path, threads=None, base=None):
+
+        """
+        Load an ``.fl`` file
+
+        :param threads: number of decompression threads
+        :param base: path of the base of a delta file, if it has moved since the delta was saved
+        """
 
         self.load_path = load_path
 
-        with open(load_path, 'rb') as f:
-            assert load_path[-3:] == '.fl', "Not a valid file path"
-            print("Loading fl file from {}".format(load_path))
-            loaded = pickle.loads(zlib.decompress(f.read()))
+        assert load_path[-3:] == '.fl', "Not a valid file path"
+        print("Loading fl file from {}".format(load_path))
+
+        if is_container(load_path):
+            with ContainerReader(load_path, threads=threads) as reader:
+                loaded = reader.state()
+                loaded.database.db.extend(reader.datasets(base))
+        else:
+            # whole-object pickle saved by older versions
+            with open(load_path, 'rb') as f:
+                loaded = pickle.loads(zlib.decompress(f.read()))
 
         self.database = loaded.database
         self.recipe = loaded.recipe
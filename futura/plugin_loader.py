@@ -1,15 +1,45 @@
 import sys
 import importlib
-from pkg_resources import iter_entry_points
+from functools import lru_cache
+
+try:
+    from importlib.metadata import entry_points
+except ImportError:
+    from importlib_metadata import entry_points
+
+PLUGIN_GROUP = 'futura_plugins'
+
+
+@lru_cache(maxsize=None)
+def plugin_entry_points():
+    """
+    Find the futura plugins once per process
+
+    :return: tuple of :class:`importlib.metadata.EntryPoint`
+    """
+    found = entry_points()
+    if hasattr(found, 'select'):
+        return tuple(found.select(group=PLUGIN_GROUP))
+    return tuple(found.get(PLUGIN_GROUP, []))
+
+
+@lru_cache(maxsize=None)
+def loaded_plugins():
+    """
+    Load the futura plugins once per process
+
+    :return: tuple of the objects the plugin entry points refer to
+    """
+    return tuple(entry_point.load() for entry_point in plugin_entry_points())
 
 
 def load_plugins():
     importlib.import_module('futura')
 
-    for entry_point in iter_entry_points(group="futura_plugins"):
-        submodule_name = entry_point.module_name#.split('.')[-1]
+    for entry_point in plugin_entry_points():
+        submodule_name = entry_point.value.split(':')[0].strip()#.split('.')[-1]
 
         setattr(sys.modules['futura'],
                 submodule_name,
-                importlib.import_module(entry_point.module_name, package='futura')
+                importlib.import_module(submodule_name, package='futura')
                 )
@@ -1,13 +1,295 @@
 from pprint import pformat
+import weakref
+
+from .index import DatabaseIndex, TEXT_FIELDS
+from .query import QueryPlan, has_exact_lookup
+from .cache import FilterCache, canonical_key
+
+
+class WurstDataset(dict):
+    """
+    A wurst dataset which tells the :class:`WurstDatabase` lists holding it when its fields are changed, so their
+    indexes and filter caches stay current.
+
+    Only the dataset's own fields are tracked, not changes made inside their values (e.g. appending to the list of
+    exchanges). Copies (``copy.copy``, ``copy.deepcopy``, pickling) are plain dicts which belong to no database.
+    """
+    __slots__ = ('_owners',)
+
+    def __init__(self, *args, **kwargs):
+        super(WurstDataset, self).__init__(*args, **kwargs)
+        self._owners = ()
+
+    def __reduce_ex__(self, protocol):
+        return dict, (dict(self),)
+
+    def _adopt(self, database):
+        if not any(ref() is database for ref in self._owners):
+            self._owners = tuple(ref for ref in self._owners if ref() is not None) + (weakref.ref(database),)
+
+    def _changed(self, keys):
+        for ref in self._owners:
+            database = ref()
+            if database is not None:
+                database._dataset_changed(self, keys)
+
+    def __setitem__(self, key, value):
+        super(WurstDataset, self).__setitem__(key, value)
+        if self._owners:
+            self._changed((key,))
+
+    def __delitem__(self, key):
+        super(WurstDataset, self).__delitem__(key)
+        if self._owners:
+            self._changed((key,))
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, *args, **kwargs):
+        changes = dict(*args, **kwargs)
+        super(WurstDataset, self).update(changes)
+        if self._owners and changes:
+            self._changed(tuple(changes))
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def pop(self, key, *args):
+        changed = key in self
+        value = super(WurstDataset, self).pop(key, *args)
+        if self._owners and changed:
+            self._changed((key,))
+        return value
+
+    def popitem(self):
+        key, value = super(WurstDataset, self).popitem()
+        if self._owners:
+            self._changed((key,))
+        return key, value
+
+    def clear(self):
+        keys = tuple(self)
+        super(WurstDataset, self).clear()
+        if self._owners and keys:
+            self._changed(keys)
 
 
 class WurstDatabase(list):
+    """
+    A list of wurst datasets which keeps a :class:`~futura.index.DatabaseIndex` up to date as datasets are added or
+    changed.
+
+    Datasets are stored as :class:`WurstDataset`, which report changes to their fields to the database, so the index
+    follows datasets edited in place (``db[3]['location'] = 'FR'``). A plain dict added to the database is copied into
+    a :class:`WurstDataset`, so edit it through the database (e.g. as ``db[-1]``) after adding it, not through the dict
+    it was made from.
+
+    The index is built the first time it's needed. Appending and extending keep it current, any other change to the
+    list throws it away so that it's rebuilt on the next lookup. Changes made inside a field's value (e.g. to the list
+    of exchanges) aren't seen by the database, call :func:`reindex` with the dataset after making them if they matter
+    to a filter.
+
+    A text index for ``contains`` and ``startswith`` filters is optional, see :func:`enable_text_index`.
+
+    Every change increases :attr:`version`, and the results of described filters (e.g. those made by
+    :func:`~futura.utils.create_filter_from_description`) are kept in a :class:`~futura.cache.FilterCache` which is
+    checked against the version on every lookup. Filters the index can answer with an exact lookup aren't cached.
+
+    :ivar version: mutation counter, increased by every change to the database or its datasets
+    :vartype version: int
+
+    :ivar rebased: the version at which the database was last changed by something other than appending datasets or
+        changing them in place
+    :vartype rebased: int
+    """
+    # Defaults for databases unpickled from files saved before these attributes existed
+    version = 0
+    rebased = 0
+
     def __init__(self, *args, **kwargs):
         super(WurstDatabase, self).__init__(*args, **kwargs)
+        super(WurstDatabase, self).__setitem__(slice(None), [self._adopt(ds) for ds in self])
+        self._index = None
+        self._cache = None
+        self.text_fields = ()
+        self.version = 0
+        self.rebased = 0
 
     def __repr__(self):
         return "WurstDatabase with {} items".format(len(self))
 
+    def __reduce_ex__(self, protocol):
+        # Pickle the datasets as a plain list so the index is never saved, and is rebuilt after loading
+        return self.__class__, (list(self),), {'text_fields': self.__dict__.get('text_fields', ())}
+
+    @property
+    def index(self):
+        if self.__dict__.get('_index') is None:
+            self._index = DatabaseIndex(self, text_fields=self.__dict__.get('text_fields', ()))
+        return self._index
+
+    @property
+    def cache(self):
+        if self.__dict__.get('_cache') is None:
+            self._cache = FilterCache()
+        return self._cache
+
+    def cache_info(self):
+        """
+        Hit and miss statistics of the filter result cache, see :func:`~futura.cache.FilterCache.info`
+        """
+        return self.cache.info()
+
+    def _bump(self, rebase=False):
+        self.version += 1
+        if rebase:
+            self.rebased = self.version
+            if self.__dict__.get('_cache') is not None:
+                self._cache.clear()
+
+    def enable_text_index(self, fields=TEXT_FIELDS):
+        """
+        Add a case insensitive n-gram index on ``fields`` so that ``contains`` and ``startswith`` filters on them can
+        be answered without a full scan
+
+        :param fields: text fields to index, default is ``name`` and ``reference product``
+        :type fields: tuple, optional
+        """
+        fields = tuple(fields)
+        if fields != self.__dict__.get('text_fields', ()):
+            self.text_fields = fields
+            self._index = None
+
+    def disable_text_index(self):
+        self.enable_text_index(())
+
+    def reindex(self, *datasets):
+        """
+        Update the index and the filter cache after datasets have been changed in a way the database can't see, i.e.
+        inside the value of one of their fields. If no datasets are given the whole index is rebuilt and the cache is
+        cleared
+        """
+        if not datasets:
+            self._invalidate()
+            return
+
+        self._bump()
+        for ds in datasets:
+            if self.__dict__.get('_index') is not None:
+                self._index.update(ds)
+            if self.__dict__.get('_cache') is not None:
+                self._cache.changed(ds)
+
+    def _adopt(self, ds):
+        # store datasets as WurstDataset, registered with this database so it hears about their changes
+        if not isinstance(ds, WurstDataset):
+            ds = WurstDataset(ds)
+        ds._adopt(self)
+        return ds
+
+    def _dataset_changed(self, ds, keys):
+        # called by a WurstDataset when its fields are changed, which might be after it was removed from the database
+        index = self.__dict__.get('_index')
+        if index is not None and index.tracks(keys):
+            if not index.contains(ds):
+                return
+            index.update(ds)
+
+        self._bump()
+        if self.__dict__.get('_cache') is not None:
+            self._cache.changed(ds, keys)
+
+    def _invalidate(self):
+        self._index = None
+        self._bump(rebase=True)
+
+    def search(self, *funcs):
+        """
+        Apply all filter functions ``funcs`` to the database using a :class:`~futura.query.QueryPlan`. Results of
+        described filters are cached until the database changes, unless the index can answer them with an exact
+        lookup anyway
+
+        :return: iterator of matching datasets, in database order
+        """
+        key = canonical_key(funcs)
+
+        if key is None or has_exact_lookup(self.index, funcs):
+            return QueryPlan(self, funcs).execute()
+
+        result = self.cache.get(key, self)
+
+        if result is None:
+            result = list(QueryPlan(self, funcs).execute())
+            self.cache.put(key, self, funcs, result)
+
+        return iter(list(result))
+
+    def append(self, ds):
+        ds = self._adopt(ds)
+        super(WurstDatabase, self).append(ds)
+        self._bump()
+        if self.__dict__.get('_index') is not None:
+            self._index.add(ds)
+
+    def extend(self, iterable):
+        datasets = [self._adopt(ds) for ds in iterable]
+        super(WurstDatabase, self).extend(datasets)
+        self._bump()
+        if self.__dict__.get('_index') is not None:
+            for ds in datasets:
+                self._index.add(ds)
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def insert(self, i, ds):
+        super(WurstDatabase, self).insert(i, self._adopt(ds))
+        self._invalidate()
+
+    def remove(self, ds):
+        super(WurstDatabase, self).remove(ds)
+        self._invalidate()
+
+    def pop(self, *args):
+        ds = super(WurstDatabase, self).pop(*args)
+        self._invalidate()
+        return ds
+
+    def clear(self):
+        super(WurstDatabase, self).clear()
+        self._invalidate()
+
+    def sort(self, *args, **kwargs):
+        super(WurstDatabase, self).sort(*args, **kwargs)
+        self._invalidate()
+
+    def reverse(self):
+        super(WurstDatabase, self).reverse()
+        self._invalidate()
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            value = [self._adopt(ds) for ds in value]
+        else:
+            value = self._adopt(value)
+        super(WurstDatabase, self).__setitem__(key, value)
+        self._invalidate()
+
+    def __delitem__(self, key):
+        super(WurstDatabase, self).__delitem__(key)
+        self._invalidate()
+
+    def __imul__(self, n):
+        super(WurstDatabase, self).__imul__(n)
+        self._invalidate()
+        return self
+
 
 class WurstProcess(dict):
     def __init__(self, *args, **kwargs):
@@ -42,3 +324,15 @@ class WurstFilterSet(list):
 
     def __repr__(self):
         return "WurstFilterSet: {}".format(pformat([x for x in self]))
+
+    def plan(self, data):
+        """
+        Get the :class:`~futura.query.QueryPlan` for applying this filter set to ``data``
+        """
+        return QueryPlan(data, self)
+
+    def explain(self, data):
+        """
+        Describe how this filter set would be applied to ``data``, see :func:`~futura.query.QueryPlan.explain`
+        """
+        return self.plan(data).explain()
@@ -0,0 +1,287 @@
+from .index import DatabaseIndex, equality_filter
+
+# Rough relative cost of evaluating one filter against one dataset, used to order the residual filters of a plan
+FILTER_COSTS = {
+    'equals': 1,
+    'startswith': 2,
+    'contains': 3,
+}
+EXCLUDE_COST = 1
+UNKNOWN_COST = 100
+
+
+def estimate_cost(description):
+    """
+    Estimate the relative cost of a filter from its description
+
+    :param description: a filter description, as used by :func:`~futura.utils.create_filter_from_description`, or
+        ``None`` for a filter without a description
+    :return: relative cost
+    :rtype: int
+    """
+    if not isinstance(description, dict):
+        return UNKNOWN_COST
+
+    kind = description.get('filter')
+    args = description.get('args', [])
+
+    if kind in FILTER_COSTS:
+        return FILTER_COSTS[kind]
+    elif kind == 'doesnt_contain_any':
+        return FILTER_COSTS['contains'] * max(len(args[1]), 1)
+    elif kind == 'either':
+        return sum(estimate_cost(x) for x in args)
+    elif kind == 'exclude':
+        return EXCLUDE_COST + sum(estimate_cost(x) for x in args)
+
+    return UNKNOWN_COST
+
+
+def _either_equalities(func):
+    """
+    Get the ``(field, value)`` pairs of an ``either`` filter made up entirely of ``equals`` filters on the same field
+    """
+    description = getattr(func, 'description', None)
+
+    if not isinstance(description, dict) or description.get('filter') != 'either' or not description.get('args'):
+        return None
+
+    pairs = []
+    for d in description['args']:
+        if not isinstance(d, dict) or d.get('filter') != 'equals' or len(d.get('args', [])) != 2:
+            return None
+        pairs.append(tuple(d['args']))
+
+    if len(set(f for f, _ in pairs)) != 1:
+        return None
+
+    return pairs
+
+
+def _text_terms(func):
+    """
+    Get the ``(field, text)`` pairs of a ``contains`` or ``startswith`` filter, or of an ``either`` filter made up
+    entirely of them on the same field
+    """
+    description = getattr(func, 'description', None)
+
+    if not isinstance(description, dict):
+        return None
+
+    if description.get('filter') in ('contains', 'startswith'):
+        children = [description]
+    elif description.get('filter') == 'either' and description.get('args'):
+        children = description['args']
+    else:
+        return None
+
+    pairs = []
+    for d in children:
+        if not isinstance(d, dict) or d.get('filter') not in ('contains', 'startswith') or len(d.get('args', [])) != 2:
+            return None
+        pairs.append(tuple(d['args']))
+
+    if len(set(f for f, _ in pairs)) != 1:
+        return None
+
+    return pairs
+
+
+def has_exact_lookup(index, funcs):
+    """
+    Whether a :class:`QueryPlan` for ``funcs`` can be driven by an exact lookup in ``index``, i.e. an ``equals`` filter
+    (or an ``either`` of them) on an indexed field
+
+    :param index: :class:`~futura.index.DatabaseIndex`
+    :param funcs: filter functions
+    :rtype: bool
+    """
+    for f in funcs:
+        eq = equality_filter(f)
+        pairs = [eq] if eq else _either_equalities(f)
+        if not pairs or pairs[0][0] not in index.tables:
+            continue
+        try:
+            for _, value in pairs:
+                hash(value)
+        except TypeError:
+            continue
+        return True
+
+    return False
+
+
+def _describe(func):
+    signature = getattr(func, 'signature', None)
+    if signature:
+        return signature
+    description = getattr(func, 'description', None)
+    if description:
+        return str(description)
+    return str(func)
+
+
+class QueryPlan:
+
+    """
+    An inspectable plan for applying a set of filters to a database.
+
+    The most selective ``equals`` lookup that the database index can answer (or an ``either`` of ``equals`` filters on
+    one indexed field) drives the query, and only the datasets it returns are checked against the remaining filters,
+    cheapest first. Without a usable lookup the plan falls back to a scan of the whole database.
+
+    If the database has a text index (see :func:`~futura.proxy.WurstDatabase.enable_text_index`) ``contains`` and
+    ``startswith`` filters, and ``either`` filters made of them, can drive the query too. The text index ignores case,
+    so e.g. ``either(contains('name', 'Hard coal'), contains('name', 'hard coal'))`` is a single lookup. Text lookups
+    only narrow down the candidates, so the filter itself is still applied to them.
+
+    The results are the same datasets, in the same order, as applying the filters one after the other to the whole
+    database with ``wurst.get_many``. If a residual filter raises an error for a dataset the filters are re-run on that
+    dataset in their original order, so any error is the one a plain scan would raise.
+
+    :param data: database to query, a :class:`~futura.proxy.WurstDatabase` (or :class:`~futura.wrappers.FuturaDatabase`)
+        for indexed lookups, or any other iterable of datasets for a scan
+    :param funcs: filter functions
+    """
+
+    def __init__(self, data, funcs):
+
+        data = getattr(data, 'db', data)
+
+        self.data = data
+        self.funcs = list(funcs)
+        index = getattr(data, 'index', None)
+        self.index = index if isinstance(index, DatabaseIndex) else None
+
+        self.lookup = None
+        self.candidates = None
+        self.residuals = self.funcs
+
+        if self.index is not None:
+            self._choose_lookup()
+
+        self.residuals = sorted(self.residuals, key=lambda f: estimate_cost(getattr(f, 'description', None)))
+
+    def __repr__(self):
+        return "QueryPlan:\n{}".format(self.explain())
+
+    def _choose_lookup(self):
+
+        equalities = {}
+        options = []
+
+        for n, f in enumerate(self.funcs):
+            eq = equality_filter(f)
+            if eq and eq[0] not in equalities:
+                equalities[eq[0]] = (n, eq[1])
+                continue
+
+            pairs = _either_equalities(f)
+            if pairs and pairs[0][0] in self.index.tables:
+                try:
+                    size = sum(self.index.count(field, value) for field, value in pairs)
+                except TypeError:
+                    continue
+                label = "{} in ({})".format(pairs[0][0], ", ".join(["'{}'".format(v) for _, v in pairs]))
+                options.append((size, lambda pairs=pairs: self._union(pairs), {n}, label))
+                continue
+
+            pairs = _text_terms(f)
+            if pairs:
+                field = pairs[0][0]
+                if not all(isinstance(text, str) for _, text in pairs):
+                    # the text index only holds strings, so leave the filter to the scan
+                    continue
+
+                texts = []
+                for _, text in pairs:
+                    if text.lower() not in texts:
+                        texts.append(text.lower())
+
+                found = [self.index.text_search(field, text) for text in texts]
+                if not texts or any(x is None for x in found):
+                    continue
+
+                if len(found) == 1:
+                    candidates = found[0]
+                else:
+                    union = {id(x): x for candidates in found for x in candidates}
+                    candidates = sorted(union.values(), key=self.index.position)
+
+                label = "{} ~ ({})".format(field, ", ".join(["'{}'".format(t) for t in texts]))
+                options.append((len(candidates), lambda candidates=candidates: candidates, set(), label))
+
+        for key in self.index.tables:
+            fields = key if isinstance(key, tuple) else (key,)
+            if not all(f in equalities for f in fields):
+                continue
+
+            if isinstance(key, tuple):
+                value = tuple(equalities[f][1] for f in fields)
+            else:
+                value = equalities[key][1]
+
+            try:
+                size = self.index.count(key, value)
+            except TypeError:
+                continue
+
+            label = "{} == {}".format(key, repr(value))
+            options.append((size, lambda key=key, value=value: list(self.index.lookup(key, value)),
+                            {equalities[f][0] for f in fields}, label))
+
+        if not options:
+            return
+
+        # options are ranked by the size of their buckets, only the one used is read
+        _, candidates, used, label = min(options, key=lambda x: x[0])
+
+        self.lookup = label
+        self.candidates = candidates()
+        self.residuals = [f for n, f in enumerate(self.funcs) if n not in used]
+
+    def _union(self, pairs):
+        found = {id(x): x for field, value in pairs for x in self.index.lookup(field, value)}
+        return sorted(found.values(), key=self.index.position)
+
+    @property
+    def estimated_rows(self):
+        """
+        Number of datasets the residual filters will be applied to
+        """
+        if self.candidates is not None:
+            return len(self.candidates)
+        return len(self.data) if hasattr(self.data, '__len__') else None
+
+    def explain(self):
+        """
+        Describe the plan
+
+        :return: one line for the driving lookup (or scan) followed by one line per residual filter, in the order they
+            are applied
+        :rtype: str
+        """
+        if self.lookup:
+            lines = ["lookup {} ({} candidates)".format(self.lookup, self.estimated_rows)]
+        else:
+            lines = ["scan ({} datasets)".format(self.estimated_rows)]
+
+        for f in self.residuals:
+            lines.append("  filter {} (cost {})".format(_describe(f), estimate_cost(getattr(f, 'description', None))))
+
+        return "\n".join(lines)
+
+    def matches(self, ds):
+        try:
+            return all(f(ds) for f in self.residuals)
+        except Exception:
+            return all(f(ds) for f in self.funcs)
+
+    def execute(self):
+        """
+        Run the plan
+
+        :return: iterator of matching datasets
+        """
+        data = self.candidates if self.candidates is not None else self.data
+        return filter(self.matches, data)
@@ -1,25 +1,53 @@
-import pkg_resources
-
 from .technology import *
 from .regionalisation import *
 from .markets import FuturaMarket
 from .targeted import FuturaProcess
 from .ecoinvent import check_database
 from .constants import ASSET_PATH, DEFAULT_SETUP_PROJECT
+from .plugin_loader import loaded_plugins
+
+from .recipe_cache import RecipeStepCache, recipe_fingerprints
+from .checkpoint import RecipeCheckpoint
 
 from . import w
+import logging
 import os
+import time
 
 
 class FuturaRecipeExecutor:
     """
     TODO: Write doctring
+
+    :param loader: the loader whose recipe and database to use
+    :param step_cache: cache of the database state after expensive actions, so re-running an edited recipe starts from
+        the longest unchanged prefix of its actions. ``True`` uses the default :class:`~futura.recipe_cache.RecipeStepCache`
+    :type step_cache: :class:`~futura.recipe_cache.RecipeStepCache` or bool, optional
+    :param checkpoint: snapshot the database after each action, so an interrupted run can be resumed with
+        ``recipe_generator(resume=True)``. ``True`` uses the default :class:`~futura.checkpoint.RecipeCheckpoint`
+    :type checkpoint: :class:`~futura.checkpoint.RecipeCheckpoint` or bool, optional
+    :param task_callback: called as ``task_callback(action, task, seconds)`` after each task has run
+    :type task_callback: callable, optional
+    :param base_store: load the databases extracted from Brightway from, and keep them in, the local base store (see
+        :class:`~futura.base_store.BaseStore`)
+    :type base_store: bool, optional
     """
 
-    def __init__(self, loader):
+    def __init__(self, loader, step_cache=None, checkpoint=None, task_callback=None, base_store=False):
 
         self.loader = loader
 
+        if step_cache is True:
+            step_cache = RecipeStepCache()
+        self.step_cache = step_cache or None
+
+        if checkpoint is True:
+            checkpoint = RecipeCheckpoint()
+        self.checkpoint = checkpoint or None
+
+        self.task_callback = task_callback
+        self.base_store = base_store
+
         self.database_functions = [
             'add_technology_to_database',
             'add_default_CCS_processes',
@@ -36,12 +64,33 @@ class FuturaRecipeExecutor:
             'create_regional_activities_from_filter'
         ]
 
-        self.market = None
+        self._actions = None
+        self._slots = None
+        self._actions_database = None
 
-        self.process = None
+        self._market = None
+        self._process = None
 
     @property
     def actions(self):
+        """
+        Registry of the functions recipe tasks can call, as ``{action: {function name: function}}``
+
+        The registry is built the first time it's needed, with the actions of the plugins found when futura was first
+        asked for them (see :func:`~futura.plugin_loader.loaded_plugins`). After that only the slots bound to the
+        current market, process and database are updated, when those change.
+        """
+        if self._actions is None:
+            self._actions = self._build_actions()
+            self._refresh_market_actions()
+            self._refresh_process_actions()
+
+        if self.loader and self._actions_database is not self.database:
+            self._refresh_load_actions()
+
+        return self._actions
+
+    def _build_actions(self):
         base_actions = {
             'load':
                 {
@@ -80,31 +129,60 @@ class FuturaRecipeExecutor:
                     'change_production_amount': None,
                     'change_exchange_amounts': None,
                 }
-            
-        }
 
-        if self.market:
-            base_actions['alter_market']['add_alternative_exchanges'] = self.market.add_alternative_exchanges
-            base_actions['alter_market']['set_pv'] = self.market.set_pv
-            base_actions['alter_market']['transfer_pv'] = self.market.transfer_pv
-            base_actions['alter_market']['relink'] = self.market.relink
-
-        if self.process:
-            base_actions['target_processes']['change_production_amount'] = self.process.change_production_amount
-            base_actions['target_processes']['change_exchange_amounts'] = self.process.change_exchange_amounts
+        }
 
-        if self.loader:
-            base_actions['load']['extract_bw2_database'] = self.database.extract_bw2_database
-            base_actions['load']['extract_excel_data'] = self.database.extract_excel_data
-            base_actions['load']['get_ecoinvent'] = self.database.get_ecoinvent
-            base_actions['load']['extract_BW2Package'] = self.database.extract_BW2Package
+        # the slots for the market, process and database, kept even if a plugin replaces the action
+        self._slots = {action: base_actions[action] for action in ('load', 'alter_market', 'target_processes')}
 
-        for entry_point in pkg_resources.iter_entry_points('futura_plugins'):
-            x = entry_point.load()
+        for x in loaded_plugins():
             base_actions.update(x.actions)
 
         return base_actions
 
+    def _refresh_market_actions(self):
+        if self._actions is None:
+            return
+
+        slots = self._slots['alter_market']
+        for name in ('add_alternative_exchanges', 'set_pv', 'transfer_pv', 'relink'):
+            slots[name] = getattr(self._market, name) if self._market else None
+
+    def _refresh_process_actions(self):
+        if self._actions is None:
+            return
+
+        slots = self._slots['target_processes']
+        for name in ('change_production_amount', 'change_exchange_amounts'):
+            slots[name] = getattr(self._process, name) if self._process else None
+
+    def _refresh_load_actions(self):
+        self._actions_database = self.database
+
+        slots = self._slots['load']
+        for name in ('extract_bw2_database', 'extract_excel_data', 'get_ecoinvent', 'extract_BW2Package'):
+            slots[name] = getattr(self.database, name)
+
+    @property
+    def market(self):
+        return self._market
+
+    @market.setter
+    def market(self, market):
+        if market is not self._market:
+            self._market = market
+            self._refresh_market_actions()
+
+    @property
+    def process(self):
+        return self._process
+
+    @process.setter
+    def process(self, process):
+        if process is not self._process:
+            self._process = process
+            self._refresh_process_actions()
+
     @property
     def database(self):
         return self.loader.database
@@ -117,20 +195,86 @@ class FuturaRecipeExecutor:
     def recipe(self):
         return self.loader.recipe
 
-    def execute_recipe(self):
+    def execute_recipe(self, resume=False):
 
-        for message in self.recipe_generator():
+        for message in self.recipe_generator(resume=resume):
             print(message['message'])
 
-    def recipe_generator(self):
+    def recipe_generator(self, resume=False):
+
+        """
+        Run the recipe one action at a time, yielding a message before and after each action
+
+        As well as ``message``, each item has the ``action`` name, its ``step`` (starting from 1) in the recipe and a
+        ``status`` (``started``, ``finished`` or ``restored``). Finished actions also have their run time in
+        ``seconds``.
+
+        :param resume: continue from the latest checkpoint of this recipe, if there is one (needs ``checkpoint``)
+        :type resume: bool, optional
+        """
+
+        actions = self.recipe['actions']
+        start = 0
+        fingerprints = None
+
+        if self.step_cache is not None or self.checkpoint is not None:
+            # fingerprint before running, as running the tasks changes their kwargs
+            fingerprints = recipe_fingerprints(self.database, self.recipe,
+                                               state=self.step_cache.state if self.step_cache is not None else None)
+
+        if self.checkpoint is not None:
+            self.checkpoint.attach(fingerprints)
 
-        for action in self.recipe['actions']:
+        database, source = None, None
+        if resume and self.checkpoint is not None:
+            start, database = self.checkpoint.load()
+            source = 'checkpoint'
+        if not start and self.step_cache is not None:
+            start = self.step_cache.longest_prefix(fingerprints)
+            database = self.step_cache.load(fingerprints[start]) if start else None
+            source = 'cache'
 
-            yield {'message': "{} started".format(action['action'])}
+        if database is not None:
+            self.loader.database = database
+            self.market = None
+            self.process = None
 
-            self.execute_recipe_action(action)
+        for n, action in enumerate(actions[:start], 1):
+            yield {'message': "{} loaded from {}".format(action['action'], source),
+                   'action': action['action'], 'step': n, 'status': 'restored'}
+            yield {'message': "{} finished".format(action['action']),
+                   'action': action['action'], 'step': n, 'status': 'finished', 'seconds': 0}
 
-            yield {'message': "{} finished".format(action['action'])}
+        for n, action in enumerate(actions[start:], start + 1):
+
+            yield {'message': "{} started".format(action['action']),
+                   'action': action['action'], 'step': n, 'status': 'started'}
+
+            started = time.time()
+            try:
+                self.execute_recipe_action(action)
+            except BaseException:
+                if self.checkpoint is not None:
+                    # make sure the last snapshot is on disk before giving up, without hiding the original error
+                    try:
+                        self.checkpoint.close()
+                    except Exception:
+                        logging.getLogger('futura').exception("Couldn't write the last checkpoint of the recipe")
+                raise
+
+            seconds = time.time() - started
+
+            if self.step_cache is not None and self.step_cache.should_store(seconds):
+                self.step_cache.store(fingerprints[n], self.database)
+
+            if self.checkpoint is not None and n < len(actions):
+                self.checkpoint.save(n, self.database)
+
+            yield {'message': "{} finished".format(action['action']),
+                   'action': action['action'], 'step': n, 'status': 'finished', 'seconds': seconds}
+
+        if self.checkpoint is not None:
+            self.checkpoint.finish()
 
     def set_market(self, market_filter):
 
@@ -187,12 +331,15 @@ class FuturaRecipeExecutor:
                     # try the recipe path
                     _, split_name = os.path.split(technology_path)
 
-                    if self.loader.recipe_filepath:
+                    recipe_filepath = getattr(self.loader, 'recipe_filepath', None)
+                    load_path = getattr(self.loader, 'load_path', None)
+
+                    if recipe_filepath:
                         print('assuming recipe_path')
-                        split_path, _ = os.path.split(self.loader.recipe_filepath)
-                    elif self.loader.load_path:
+                        split_path, _ = os.path.split(recipe_filepath)
+                    elif load_path:
                         print('assuming loader_path')
-                        split_path, _ = os.path.split(self.loader.load_path)
+                        split_path, _ = os.path.split(load_path)
                     else:
                         split_path = ''
                         print('no alternative path found for file')
@@ -217,6 +364,9 @@ class FuturaRecipeExecutor:
 
                 assert project_name and database_name, 'Project or database name missing'
 
+                if self.base_store:
+                    extra_kwargs['use_store'] = True
+
                 check = check_database(project_name, database_name)
 
                 if not check:
@@ -237,16 +387,22 @@ class FuturaRecipeExecutor:
                                     ', '.join(["{}={}".format(k, v) for k, v in this_kwargs.items()])
                                     ))
 
+            started = time.time()
             _ = this_function(*this_args, **this_kwargs)
 
+            if self.task_callback is not None:
+                self.task_callback(recipe_action, task, time.time() - started)
+
             print(self.loader)
             print(self.loader.database)
 
     def ecoinvent_fallback(self):
 
         print("The database defined in this recipe doesn't exist")
-        ecoinvent_version = self.recipe['metadata'].get('ecoinvent_version')
-        ecoinvent_system_model = self.recipe['metadata'].get('ecoinvent_system_model')
+        # the recipe can be empty, e.g. for the loader of a ScenarioSweep
+        metadata = (self.recipe or {}).get('metadata') or {}
+        ecoinvent_version = metadata.get('ecoinvent_version')
+        ecoinvent_system_model = metadata.get('ecoinvent_system_model')
 
         if ecoinvent_version and ecoinvent_system_model:
             print("The recipe specifies an ecoinvent version "
@@ -258,7 +414,8 @@ class FuturaRecipeExecutor:
             check = check_database(DEFAULT_SETUP_PROJECT, check_database_name)
 
             if check:
-                self.database.extract_bw2_database(DEFAULT_SETUP_PROJECT, check_database_name)
+                self.database.extract_bw2_database(DEFAULT_SETUP_PROJECT, check_database_name,
+                                                   use_store=self.base_store)
             else:
                 self.database.get_ecoinvent(db_name=check_database_name,
                                             store_download=True,
@@ -0,0 +1,201 @@
+from .storage import storage
+from .constants import ASSET_PATH
+from .base_store import brightway_state
+from .container import ContainerReader, dataset_digest, is_container, pickle_dataset
+
+import hashlib
+import json
+import os
+
+try:
+    import _pickle as pickle
+except ImportError:
+    import pickle
+
+import zlib
+
+# Increase if the way fingerprints are worked out changes, so old cache entries aren't used
+FINGERPRINT_VERSION = 2
+
+# Tasks which read databases from Brightway, with the names of their project and database arguments, so the Brightway
+# state of those databases is part of the fingerprint of the action
+BRIGHTWAY_TASKS = {'extract_bw2_database': ('project_name', 'database_name')}
+
+
+def _file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _file_fingerprint(path):
+    # saved databases already have a hash of their datasets, which is much quicker to read than hashing the file, and
+    # for delta files the hash of their base has to be included too
+    if is_container(path):
+        with ContainerReader(path) as reader:
+            if reader.content_hash:
+                return {'content_hash': reader.content_hash, 'base': (reader.delta or {}).get('base'),
+                        'database_names': reader.header.get('database_names')}
+    return {'sha256': _file_digest(path)}
+
+
+def _canonical(obj):
+    # Files referred to by a task (e.g. technology files) are part of its fingerprint, so editing them counts as a change
+    if isinstance(obj, dict):
+        return {str(k): _canonical(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [_canonical(x) for x in obj]
+    elif isinstance(obj, str):
+        path = obj.replace("__ASSET_PATH__/", ASSET_PATH + os.sep) if "__ASSET_PATH__/" in obj else obj
+        if len(path) < 1024 and os.path.isfile(path):
+            return dict(_file_fingerprint(path), __file__=obj)
+        return obj
+    return obj
+
+
+def canonical_json(obj):
+    """
+    Serialise a recipe action (or any other recipe data) the same way every time, with sorted keys and the contents
+    of any files it refers to replaced by their hashes
+    """
+    return json.dumps(_canonical(obj), sort_keys=True, separators=(',', ':'), default=str)
+
+
+def database_fingerprint(database):
+    """
+    Hash the contents of a :class:`~futura.wrappers.FuturaDatabase`: the database names and the digest of every dataset
+    (as saved in container files, see :func:`~futura.container.dataset_digest`), in order
+    """
+    sha = hashlib.sha256()
+    sha.update(json.dumps(list(database.database_names), default=str).encode('utf-8'))
+    for ds in database.db:
+        sha.update(dataset_digest(pickle_dataset(ds)).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def brightway_inputs(action):
+    """
+    The ``(project name, database name)`` of every Brightway database read by the tasks of ``action``
+    """
+    inputs = []
+    for task in action.get('tasks', []):
+        names = BRIGHTWAY_TASKS.get(task.get('function'))
+        if names is None:
+            continue
+        values = dict(zip(names, task.get('args') or []))
+        values.update(task.get('kwargs') or {})
+        inputs.append(tuple(values.get(x) for x in names))
+    return inputs
+
+
+def recipe_fingerprints(database, recipe, state=None):
+    """
+    Fingerprint every prefix of the actions of ``recipe`` run from ``database``
+
+    Actions reading from Brightway include the modification state of the databases they read, so writing to them in
+    Brightway changes the fingerprint.
+
+    :param state: function giving the modification state of a project's databases, default is
+        :func:`~futura.base_store.brightway_state`
+    :return: list of ``len(recipe['actions']) + 1`` hex digests, where item ``n`` identifies the state of the database
+        after the first ``n`` actions
+    :rtype: list
+    """
+    state = state or brightway_state
+
+    sha = hashlib.sha256()
+    sha.update("{}\n{}\n{}\n".format(FINGERPRINT_VERSION, database_fingerprint(database),
+                                     canonical_json(recipe.get('metadata', {}))).encode('utf-8'))
+
+    fingerprints = [sha.hexdigest()]
+    for action in recipe.get('actions', []):
+        sha.update(canonical_json(action).encode('utf-8'))
+        for project_name, database_name in brightway_inputs(action):
+            sha.update(canonical_json(state(project_name, [database_name])).encode('utf-8'))
+        fingerprints.append(sha.hexdigest())
+
+    return fingerprints
+
+
+class RecipeStepCache:
+
+    """
+    On-disk cache of the database state after the expensive actions of a recipe, keyed by the fingerprint of the
+    starting database and the actions up to that point (see :func:`recipe_fingerprints`).
+
+    When a recipe is run again, :class:`~futura.recipe.FuturaRecipeExecutor` starts from the longest cached prefix, so
+    only the actions after the first change are run again.
+
+    :param directory: cache directory, default is ``steps`` in ``storage.cache_dir``
+    :type directory: str, optional
+    :param min_seconds: only cache the state after actions taking at least this long
+    :type min_seconds: float, optional
+    :param max_entries: number of cached states to keep, the least recently used are removed first
+    :type max_entries: int, optional
+    :param state: function giving the modification state of Brightway databases, see :func:`recipe_fingerprints`
+    :type state: callable, optional
+    """
+
+    def __init__(self, directory=None, min_seconds=5, max_entries=8, state=None):
+
+        self.directory = directory or os.path.join(storage.cache_dir, 'steps')
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        self.min_seconds = min_seconds
+        self.max_entries = max_entries
+        self.state = state
+
+    def __repr__(self):
+        return "RecipeStepCache in {} ({} entries)".format(self.directory, len(self.entries()))
+
+    def path(self, fingerprint):
+        return os.path.join(self.directory, "{}.fdb".format(fingerprint))
+
+    def entries(self):
+        return [os.path.join(self.directory, x) for x in os.listdir(self.directory) if x.endswith('.fdb')]
+
+    def __contains__(self, fingerprint):
+        return os.path.exists(self.path(fingerprint))
+
+    def longest_prefix(self, fingerprints):
+        """
+        Find the longest cached prefix
+
+        :param fingerprints: fingerprints from :func:`recipe_fingerprints`
+        :return: number of actions in the longest cached prefix, 0 if nothing is cached
+        :rtype: int
+        """
+        for n in range(len(fingerprints) - 1, 0, -1):
+            if fingerprints[n] in self:
+                return n
+        return 0
+
+    def load(self, fingerprint):
+        path = self.path(fingerprint)
+        with open(path, 'rb') as f:
+            database = pickle.loads(zlib.decompress(f.read()))
+        os.utime(path)
+        return database
+
+    def store(self, fingerprint, database):
+        path = self.path(fingerprint)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(zlib.compress(pickle.dumps(database)))
+        os.replace(temp_path, path)
+        self.prune()
+
+    def should_store(self, seconds):
+        return seconds >= self.min_seconds
+
+    def prune(self):
+        entries = sorted(self.entries(), key=os.path.getmtime, reverse=True)
+        for path in entries[self.max_entries:]:
+            os.remove(path)
+
+    def clear(self):
+        for path in self.entries():
+            os.remove(path)
@@ -2,21 +2,28 @@
 from . import w
 from .utils import create_filter_from_description
 from .proxy import WurstProcess
+from .geo import get_topology
+from .wurst_monkeypatch import relink_many
 from futura.wrappers import FuturaDatabase
 
 import warnings
 
 def create_regional_activities(base_activity, new_regions, db, production_volumes=None,
-                               remove_production_from_original=True, relink_now=True, keep_invalid=True):
+                               remove_production_from_original=True, relink_now=True, keep_invalid=True,
+                               workers=None):
+    # The new datasets are relinked together against db as it was before any of them were added, so they're never
+    # linked to each other and the order of new_regions doesn't matter. With workers they're relinked by a pool of that
+    # many processes (see wurst_monkeypatch.relink_many)
     if production_volumes:
         assert len(production_volumes) == len(new_regions)
         total_production = 0
 
-    geomatcher = w.geomatcher
+    topology = get_topology()
     added_datasets = []
     code_list = []
+    to_relink = []
     for n, region in enumerate(new_regions):
-        if region not in geomatcher.contained(base_activity['location']):
+        if not topology.contains(base_activity['location'], region):
             # print("{} not found within {}".format(region, base_activity['location']))
             #warnings.warn("{} not found within {}".format(region, base_activity['location']))
             pass
@@ -33,14 +40,7 @@ def create_regional_activities(base_activity, new_regions, db, production_volume
                 del e['input']
 
         if relink_now:
-            new_ds = w.relink_technosphere_exchanges(new_ds,
-                                                     db,
-                                                     exclusive=True,
-                                                     drop_invalid=False,
-                                                     biggest_first=False,
-                                                     contained=False,
-                                                     exclude=['UCTE'],
-                                                     keep_invalid=keep_invalid)
+            to_relink.append(new_ds)
         else:
             code_list.append((new_ds['database'], new_ds['code']))
 
@@ -55,7 +55,22 @@ def create_regional_activities(base_activity, new_regions, db, production_volume
             total_production += pv
 
         added_datasets.append("{} [{}]".format(new_ds['name'], new_ds['location']))
-        db.append(new_ds)
+        if not relink_now:
+            db.append(new_ds)
+
+    if to_relink:
+        relink_many(to_relink,
+                    db,
+                    exclusive=True,
+                    drop_invalid=False,
+                    biggest_first=False,
+                    contained=False,
+                    exclude=['UCTE'],
+                    keep_invalid=keep_invalid,
+                    workers=workers,
+                    verbose=False)
+        for new_ds in to_relink:
+            db.append(new_ds)
 
     if production_volumes:
         if remove_production_from_original:
@@ -75,7 +90,7 @@ def create_regional_activities(base_activity, new_regions, db, production_volume
 
 
 def create_regional_activities_from_filter(base_activity_filter, new_regions, db, production_volumes=None,
-                                           remove_production_from_original=True, relink_now=True):
+                                           remove_production_from_original=True, relink_now=True, workers=None):
 
     if not callable(base_activity_filter[0]):
         print('Creating base_activity_filter from description')
@@ -84,4 +99,4 @@ def create_regional_activities_from_filter(base_activity_filter, new_regions, db
     base_activity = WurstProcess(w.get_one(db, *base_activity_filter))
 
     create_regional_activities(base_activity, new_regions, db, production_volumes,
-                               remove_production_from_original, relink_now)
+                               remove_production_from_original, relink_now, workers=workers)
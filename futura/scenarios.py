@@ -0,0 +1,503 @@
+from .loader import FuturaLoader
+from .recipe import FuturaRecipeExecutor
+from .recipe_cache import canonical_json
+from .journal import journal
+
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+import datetime
+import gc
+import itertools
+import jinja2
+import jinja2.meta
+import json
+import multiprocessing
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+try:
+    import _pickle as pickle
+except ImportError:
+    import pickle
+
+# os.fork isn't available on Windows, where the database is copied for each branch instead
+CAN_FORK = hasattr(os, 'fork')
+
+
+def vary_task(recipe, function, match=None, **kwargs):
+    """
+    Make a variant of ``recipe`` by changing the keyword arguments of the tasks calling ``function``
+
+    e.g. ``vary_task(recipe, 'transfer_pv', match={'from_name': 'electricity production, lignite'}, factor=0.8)``
+
+    :param recipe: recipe to vary, which isn't changed
+    :param function: name of the task function to change
+    :param match: only change tasks whose keyword arguments include these values
+    :type match: dict, optional
+    :return: a new recipe
+    :rtype: dict
+    """
+    variant = deepcopy(recipe)
+    match = match or {}
+
+    count = 0
+    for action in variant['actions']:
+        for task in action['tasks']:
+            task_kwargs = task.setdefault('kwargs', {})
+            if task['function'] == function and all(task_kwargs.get(k) == v for k, v in match.items()):
+                task_kwargs.update(kwargs)
+                count += 1
+
+    assert count, "No {} tasks match {}".format(function, match)
+
+    return variant
+
+
+class _Node:
+
+    # A node of the tree of recipe actions; variants with the same first n actions share the first n nodes
+
+    def __init__(self, action=None):
+        self.action = action
+        self.children = {}
+        self.variants = []
+
+    def child(self, action):
+        key = canonical_json(action)
+        if key not in self.children:
+            self.children[key] = _Node(deepcopy(action))
+        return self.children[key]
+
+
+class ScenarioSweep:
+
+    """
+    Runs many variants of a recipe, running the actions they share only once.
+
+    The variants are arranged in a tree by their actions: actions shared by several variants are run once, and the
+    database is only forked where the variants differ. On POSIX systems each branch is run in a child process made with
+    :func:`os.fork`, and up to ``workers`` branches run at once. The child starts with the parent's memory shared
+    copy-on-write, which saves copying the database up front, but it isn't a saving that lasts: a page is copied as
+    soon as anything in it is written, and Python writes to every object it touches to update its reference count, so a
+    branch that goes through the whole database ends up with most of it copied. :func:`gc.freeze` only keeps the
+    garbage collector's own writes off the shared objects.
+
+    Open Brightway database connections are closed before forking (they're opened again when next used), and while
+    other threads are running (e.g. writing a checkpoint) the branches are copied rather than forked, as a forked child
+    would inherit any locks those threads hold. Where :func:`os.fork` isn't available, or isn't safe, each branch but
+    the last gets a copy of the database and the branches run one after the other.
+
+    While an action runs, ``loader.recipe`` is the recipe of one of the variants sharing it, so tasks which look at the
+    recipe (e.g. its ecoinvent version) see the variant's metadata.
+
+    When a variant's last action has run, ``finish(name, loader)`` is called with the loader holding its database, and
+    the variant's recipe as ``loader.recipe``. The default saves it as ``<name>.fdb`` in ``output_dir``. ``finish`` is
+    called in the process that ran the variant, so anything it needs to keep must go to disk (or Brightway).
+
+    :param loader: loader holding the starting database (usually blank), its recipe is ignored
+    :type loader: :class:`~futura.loader.FuturaLoader`
+    :param variants: ``{name: recipe}`` for each variant, see :func:`vary_task` to make them
+    :type variants: dict
+    :param output_dir: directory for the ``.fdb`` files written by the default ``finish``
+    :type output_dir: str, optional
+    :param finish: called as ``finish(name, loader)`` for each finished variant
+    :type finish: callable, optional
+    :param workers: maximum number of child processes running at once
+    :type workers: int, optional
+    :param fork: use :func:`os.fork`, default is to use it where it's available
+    :type fork: bool, optional
+    """
+
+    def __init__(self, loader, variants, output_dir=None, finish=None, workers=None, fork=None):
+
+        assert variants, "No variants to run"
+        assert finish or output_dir, "Either output_dir or finish is needed"
+
+        self.loader = loader
+        self.variants = dict(variants)
+        self.output_dir = output_dir
+        self.finish = finish or self.save_variant
+        self.workers = workers or os.cpu_count() or 1
+        self.fork = CAN_FORK if fork is None else fork and CAN_FORK
+
+        self.root = _Node()
+        for name, recipe in self.variants.items():
+            node = self.root
+            for action in recipe['actions']:
+                node = node.child(action)
+            node.variants.append(name)
+
+        self.executor = FuturaRecipeExecutor(self.loader)
+
+        self._index = {name: n for n, name in enumerate(self.variants)}
+        self._results_dir = None
+        self._running = set()
+
+    def __repr__(self):
+        return "ScenarioSweep of {} variants ({} actions, {} if run separately)".format(
+            len(self.variants), self.action_count(), sum(len(x['actions']) for x in self.variants.values()))
+
+    def action_count(self, node=None):
+        """
+        Number of actions the sweep runs
+        """
+        node = node or self.root
+        return sum(1 + self.action_count(child) for child in node.children.values())
+
+    def save_variant(self, name, loader):
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        filename = "{}.fdb".format(name)
+        loader.database.save(self.output_dir, filename)
+        return os.path.join(self.output_dir, filename)
+
+    def run(self):
+        """
+        Run every variant
+
+        :return: ``{name: result}``, where ``result`` has the ``status`` (``finished`` or ``failed``) of the variant,
+            and either what ``finish`` returned as ``output`` or the ``error``
+        :rtype: dict
+        """
+
+        self._results_dir = tempfile.mkdtemp(prefix='futura_sweep_')
+
+        try:
+            self._run_node(self.root, self.executor)
+            self._wait_all()
+
+            results = {}
+            for name in self.variants:
+                path = self._result_path(name)
+                if os.path.exists(path):
+                    with open(path, 'r') as f:
+                        results[name] = json.load(f)
+                else:
+                    results[name] = {'status': 'failed', 'error': 'variant did not finish'}
+
+            return results
+
+        finally:
+            if hasattr(gc, 'unfreeze'):
+                gc.unfreeze()
+            shutil.rmtree(self._results_dir, ignore_errors=True)
+            self._results_dir = None
+
+    def _result_path(self, name):
+        return os.path.join(self._results_dir, "{}.json".format(self._index[name]))
+
+    def _record(self, name, result):
+        with open(self._result_path(name), 'w') as f:
+            json.dump(result, f, default=str)
+
+    def _record_failure(self, node, error):
+        for name in node.variants:
+            self._record(name, {'status': 'failed', 'error': error})
+        for child in node.children.values():
+            self._record_failure(child, error)
+
+    def _run_node(self, node, executor):
+
+        if node.action is not None:
+            self.loader.recipe = self.variants[self._variant_of(node)]
+            try:
+                executor.execute_recipe_action(deepcopy(node.action))
+            except Exception:
+                # the variants below this action fail, the others carry on
+                traceback.print_exc()
+                self._record_failure(node, traceback.format_exc(limit=1))
+                return
+
+        for name in node.variants:
+            self.loader.recipe = self.variants[name]
+            try:
+                output = self.finish(name, self.loader)
+                self._record(name, {'status': 'finished', 'output': output})
+            except Exception:
+                traceback.print_exc()
+                self._record(name, {'status': 'failed', 'error': traceback.format_exc(limit=1)})
+
+        children = list(node.children.values())
+        if not children:
+            return
+
+        # every branch but the last gets its own copy of the database, the last one carries on with this one
+        if self.fork and threading.active_count() == 1:
+            self._fork_branches(children[:-1], executor)
+        else:
+            self._copy_branches(children[:-1], executor)
+
+        self._run_node(children[-1], executor)
+
+    def _variant_of(self, node):
+        # the name of a variant including this node
+        while not node.variants:
+            node = next(iter(node.children.values()))
+        return node.variants[0]
+
+    def _copy_branches(self, nodes, executor):
+        snapshot = pickle.dumps(self.loader.database)
+        database, market, process = self.loader.database, executor.market, executor.process
+
+        for node in nodes:
+            # the market and process set so far belong to the original database, not the copy
+            self.loader.database = pickle.loads(snapshot)
+            executor.market = None
+            executor.process = None
+            self._run_node(node, executor)
+
+        self.loader.database = database
+        executor.market = market
+        executor.process = process
+
+    def _fork_branches(self, nodes, executor):
+        for node in nodes:
+            while len(self._running) >= self.workers:
+                pid, _ = os.wait()
+                self._running.discard(pid)
+
+            # keep the garbage collector from touching (and so copying) the objects the child shares
+            gc.collect()
+            if hasattr(gc, 'freeze'):
+                gc.freeze()
+
+            journal.flush()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            _close_brightway_connections()
+
+            pid = os.fork()
+            if pid == 0:
+                code = 1
+                try:
+                    self._running = set()
+                    self._run_node(node, executor)
+                    self._wait_all()
+                    journal.flush()
+                    code = 0
+                finally:
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                    os._exit(code)
+
+            self._running.add(pid)
+
+    def _wait_all(self):
+        while self._running:
+            os.waitpid(self._running.pop(), 0)
+
+
+def _close_brightway_connections():
+    # a forked child mustn't use the sqlite connections of its parent, so they're closed before forking, and peewee
+    # opens new ones in each process the next time they're needed
+    if 'bw2data' not in sys.modules:
+        return
+
+    from bw2data import projects
+    try:
+        from bw2data.backends import sqlite3_lci_db
+    except ImportError:
+        from bw2data.backends.peewee import sqlite3_lci_db
+
+    for database in (projects.db, sqlite3_lci_db):
+        try:
+            database.db.close()
+        except Exception:
+            pass
+
+
+def parameter_grid(grid):
+    """
+    Every combination of the values of the template variables in ``grid``
+
+    e.g. ``parameter_grid({'factor': [0.25, 0.5], 'year': [2030, 2050]})`` gives four points
+
+    :param grid: ``{variable: list of values}``
+    :type grid: dict
+    :return: list of ``{variable: value}``
+    :rtype: list
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def latin_hypercube(ranges, samples, seed=None):
+    """
+    Latin hypercube sample of the template variables in ``ranges``
+
+    Each range is split into ``samples`` equal intervals, and each interval is sampled exactly once for each variable.
+
+    :param ranges: ``{variable: (low, high)}``
+    :type ranges: dict
+    :param samples: number of points
+    :type samples: int
+    :param seed: seed for the random number generator, for repeatable samples
+    :type seed: int, optional
+    :return: list of ``{variable: value}``
+    :rtype: list
+    """
+    rng = np.random.default_rng(seed)
+
+    columns = {}
+    for name, (low, high) in ranges.items():
+        strata = (rng.permutation(samples) + rng.random(samples)) / samples
+        columns[name] = low + strata * (high - low)
+
+    return [{name: float(columns[name][n]) for name in ranges} for n in range(samples)]
+
+
+def template_variables(recipe_filepath):
+    """
+    Names of the variables used by a recipe template
+    """
+    with open(recipe_filepath, "r") as f:
+        source = f.read()
+    return jinja2.meta.find_undeclared_variables(jinja2.Environment().parse(source))
+
+
+_brightway_lock = None
+
+
+def _start_sweep_worker(lock):
+    global _brightway_lock
+    _brightway_lock = lock
+
+
+def _run_point(recipe_filepath, variables, name, fdb_path, project, finish):
+
+    started = time.time()
+    result = {'name': name, 'variables': variables}
+
+    try:
+        loader = FuturaLoader(recipe_filepath, autocreate=False, variables=variables)
+        loader.run()
+
+        if fdb_path:
+            directory, filename = os.path.split(fdb_path)
+            loader.database.save(directory, filename)
+            result['fdb'] = fdb_path
+
+        if project:
+            # Brightway's sqlite files don't like being written by several processes at once
+            with _brightway_lock:
+                loader.write_database(project, name)
+            result['brightway'] = {'project': project, 'database': name}
+
+        if finish is not None:
+            result['output'] = finish(name, loader)
+
+        result['status'] = 'finished'
+
+    except Exception:
+        traceback.print_exc()
+        result['status'] = 'failed'
+        result['error'] = traceback.format_exc(limit=1)
+
+    result['seconds'] = time.time() - started
+
+    return result
+
+
+class ParameterSweep:
+
+    """
+    Renders a recipe template at each point of a parameter sweep and runs the recipes concurrently in a process pool.
+
+    Recipes are jinja2 templates (see :func:`~futura.loader.FuturaLoader.load_recipe`), so any value in a recipe can be
+    made a variable, e.g. ``factor: {{ factor }}`` in a ``transfer_pv`` task. The points come from
+    :func:`parameter_grid` or :func:`latin_hypercube` (or any list of ``{variable: value}``).
+
+    Each run is named with ``name``, formatted with the ``stem`` of the recipe file, the number ``n`` of the point and
+    its variables. The final database of each run is saved as ``<name>.fdb`` in ``output_dir`` and/or written to the
+    Brightway ``project`` as a database called ``<name>``. ``manifest.json`` in ``output_dir`` lists every run with its
+    variables, outputs, status and run time.
+
+    :param recipe_filepath: recipe template
+    :type recipe_filepath: str
+    :param points: list of ``{variable: value}``, one run each
+    :type points: list
+    :param output_dir: directory for the manifest and the ``.fdb`` files
+    :type output_dir: str
+    :param name: name of each run, default is ``{stem}_{n:03d}``
+    :type name: str, optional
+    :param save_fdb: save each final database as an ``.fdb`` file
+    :type save_fdb: bool, optional
+    :param project: also write each final database to this Brightway project
+    :type project: str, optional
+    :param finish: called as ``finish(name, loader)`` in the worker after each run, must be picklable; whatever it
+        returns is recorded in the manifest as ``output``
+    :type finish: callable, optional
+    :param workers: number of worker processes, default is the number of CPUs
+    :type workers: int, optional
+    """
+
+    def __init__(self, recipe_filepath, points, output_dir, name="{stem}_{n:03d}", save_fdb=True, project=None,
+                 finish=None, workers=None):
+
+        self.recipe_filepath = recipe_filepath
+        self.points = [dict(x) for x in points]
+        self.output_dir = output_dir
+        self.name = name
+        self.save_fdb = save_fdb
+        self.project = project
+        self.finish = finish
+        self.workers = workers or os.cpu_count() or 1
+
+        used = template_variables(recipe_filepath)
+        for point in self.points:
+            unused = set(point) - used
+            assert not unused, "The recipe doesn't use the variables {}".format(", ".join(sorted(unused)))
+
+        names = self.names()
+        assert len(set(names)) == len(names), "Run names must be unique, add variables or {n} to the name"
+
+    def __repr__(self):
+        return "ParameterSweep of {} with {} points".format(self.recipe_filepath, len(self.points))
+
+    def names(self):
+        stem, _ = os.path.splitext(os.path.basename(self.recipe_filepath))
+        return [self.name.format(stem=stem, n=n, **point) for n, point in enumerate(self.points)]
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.output_dir, 'manifest.json')
+
+    def run(self):
+        """
+        Run every point of the sweep and write the manifest
+
+        :return: the manifest
+        :rtype: dict
+        """
+
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        started = datetime.datetime.now().isoformat()
+        lock = multiprocessing.Lock()
+
+        jobs = []
+        for name, point in zip(self.names(), self.points):
+            fdb_path = os.path.join(self.output_dir, "{}.fdb".format(name)) if self.save_fdb else None
+            jobs.append((self.recipe_filepath, point, name, fdb_path, self.project, self.finish))
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_start_sweep_worker,
+                                 initargs=(lock,)) as pool:
+            futures = [pool.submit(_run_point, *job) for job in jobs]
+            runs = [future.result() for future in futures]
+
+        manifest = {'recipe': os.path.abspath(self.recipe_filepath),
+                    'started': started,
+                    'finished': datetime.datetime.now().isoformat(),
+                    'runs': runs}
+
+        with open(self.manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2, default=str)
+
+        return manifest
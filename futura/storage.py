@@ -29,6 +29,11 @@ class FuturaStorage():
         if not os.path.isdir(self.ecoinvent_dir):
             os.mkdir(self.ecoinvent_dir)
 
+        # caches
+        self.cache_dir = os.path.join(self.futura_dir, 'cache')
+        if not os.path.isdir(self.cache_dir):
+            os.mkdir(self.cache_dir)
+
 
         # config
         self.config_file = os.path.join(self.futura_dir, 'futura_config.yml')
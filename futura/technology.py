@@ -6,6 +6,7 @@ from tqdm import tqdm
 from .constants import FULL_CCS_FILE
 from.utils import create_filter_from_description
 from.proxy import WurstProcess
+from .wurst_monkeypatch import relink_many
 
 
 def add_technology_to_database(database, technology_file, funcs=None):
@@ -56,7 +57,7 @@ def fix_ch_only_processes(database):
 
 
 
-def regionalise_multiple_processes(database, locations, base_activity_filter, progress_message=None):
+def regionalise_multiple_processes(database, locations, base_activity_filter, progress_message=None, workers=None):
 
     if not callable(base_activity_filter[0]):
         print('Creating base_activity_filter from description')
@@ -73,29 +74,33 @@ def regionalise_multiple_processes(database, locations, base_activity_filter, pr
         code_list.extend(create_regional_activities(a, locations, database.db, relink_now=False))
 
     print("Relinking regionalised versions of {}...".format(progress_message))
-    for x in tqdm(code_list):
-        ds = w.get_one(database.db, *[w.equals('code', x[1])])
-
-        if ds['name'].startswith('market'):
-            exclusive = False
-        else:
-            exclusive = True
+    new_datasets = [ds for x in code_list
+                    for ds in w.get_many(database.db, *[w.equals('database', x[0]), w.equals('code', x[1])])]
 
+    for ds in new_datasets:
         if 'input' in w.reference_product(ds).keys():
             del w.reference_product(ds)['input']
 
-        w.relink_technosphere_exchanges(ds,
-                                        database.db,
-                                        exclusive=exclusive,
-                                        drop_invalid=False,
-                                        biggest_first=False,
-                                        contained=False,
-                                        exclude=['UCTE'],
-                                        keep_invalid=True)
+    # markets can draw on overlapping locations, everything else is linked exclusively
+    relink_many(new_datasets if workers else tqdm(new_datasets),
+                database.db,
+                exclusive=lambda ds: not ds['name'].startswith('market'),
+                drop_invalid=False,
+                biggest_first=False,
+                contained=False,
+                exclude=['UCTE'],
+                keep_invalid=True,
+                workers=workers,
+                verbose=False)
+
+    if new_datasets:
+        database.db.reindex(*new_datasets)
+
     return database
 
 
-def regionalise_based_on_filters(database, location_filter, base_activity_filter, progress_message=None):
+def regionalise_based_on_filters(database, location_filter, base_activity_filter, progress_message=None,
+                                 workers=None):
 
     location_list = list(w.get_many(database.db, *location_filter))
     if len(set([x['name'] for x in location_list])) != 1:
@@ -103,7 +108,7 @@ def regionalise_based_on_filters(database, location_filter, base_activity_filter
 
     locations = list(set([x['location'] for x in location_list]))
 
-    return regionalise_multiple_processes(database, locations, base_activity_filter, progress_message)
+    return regionalise_multiple_processes(database, locations, base_activity_filter, progress_message, workers)
 
 
 add_hard_coal_ccs = partial(regionalise_based_on_filters,
@@ -1,34 +1,76 @@
 #import wurst as w
 from . import w
-from .proxy import WurstFilter, WurstFilterSet
-import pprint
+from .proxy import WurstFilter, WurstFilterSet, WurstDatabase
+from .index import DatabaseIndex
 from wurst.searching import exclude
 
+CODE_FIELDS = ('database', 'code')
 
-def fix_unset_technosphere_and_production_exchange_locations(db, matching_fields=('name', 'unit')):
+
+def fix_unset_technosphere_and_production_exchange_locations(db, matching_fields=('name', 'unit'), verbose=True):
 
     """
     Utility function from wurst publication supplementary materials to fix unset technosphere and production
     exchanges.
-    Database is fixed in place, function returns nothing
+    Database is fixed in place.
+
+    The locations of the datasets are looked up in a map from ``matching_fields`` to locations, built with a single
+    pass over the database, rather than with a search of the whole database for every exchange.
 
     :param db: database to fix
     :param matching_fields: fields on which to search for exchanges
-    :return: nothing
+    :param verbose: print a summary of the exchanges without a unique location
+    :return: exchanges without a unique location, as a dict of ``{values of matching_fields: {'locations': list of
+        locations found, 'exchanges': number of exchanges}}``
+    :rtype: dict
     """
+    location_map = location_lookup(db, matching_fields)
+    ambiguous = {}
+
     for ds in db:
         for exc in ds['exchanges']:
             if exc['type'] == 'production' and exc.get('location') is None:
                 exc['location'] = ds['location']
             elif exc['type'] == 'technosphere' and exc.get('location') is None:
-                locs = find_location_given_lookup_dict(db,
-                                                       {k: exc.get(k) for k in matching_fields})
+                key = tuple(exc.get(k) for k in matching_fields)
+                try:
+                    locs = location_map.get(key, [])
+                except TypeError:
+                    locs = find_location_given_lookup_dict(db, dict(zip(matching_fields, key)))
                 if len(locs) == 1:
                     exc['location'] = locs[0]
                 else:
-                    print("No unique location found for exchange:\n{}\nFound: {}".format(
-                        pprint.pformat(exc), locs
-                    ))
+                    summary = ambiguous.setdefault(key, {'locations': locs, 'exchanges': 0})
+                    summary['exchanges'] += 1
+
+    if ambiguous and verbose:
+        print("No unique location found for {} exchanges ({} distinct {}):".format(
+            sum(x['exchanges'] for x in ambiguous.values()), len(ambiguous), "/".join(matching_fields)))
+        for key, summary in ambiguous.items():
+            print("    {} ({} exchanges) - found: {}".format(key, summary['exchanges'], summary['locations']))
+
+    return ambiguous
+
+
+def location_lookup(db, matching_fields=('name', 'unit')):
+    """
+    Map the values of ``matching_fields`` of each dataset in ``db`` to the locations of the datasets with those values
+
+    Datasets with unhashable values are left out.
+
+    :param db: database
+    :param matching_fields: fields to map
+    :return: dict of ``{values of matching_fields: list of locations}``, with locations in database order
+    :rtype: dict
+    """
+    location_map = {}
+    for ds in db:
+        key = tuple(ds.get(k) for k in matching_fields)
+        try:
+            location_map.setdefault(key, []).append(ds['location'])
+        except TypeError:
+            continue
+    return location_map
 
 
 def find_location_given_lookup_dict(db, lookup_dict):
@@ -49,7 +91,30 @@ def remove_nones(db):
         ds['exchanges'] = [exists(exc) for exc in ds['exchanges']]
 
 
+def code_index(data):
+    """
+    Get a ``(database, code)`` index of ``data``
+
+    :param data: list of datasets, or a :class:`~futura.proxy.WurstDatabase` to use its own index
+    :rtype: :class:`~futura.index.DatabaseIndex`
+    """
+    if isinstance(data, WurstDatabase):
+        return data.index
+    return DatabaseIndex(data, fields=(), composites=(CODE_FIELDS,))
+
+
 def fix_products_and_locations_external(external_data, existing_data):
+    """
+    Add missing products, locations and production volumes to the exchanges of imported external data (e.g. from an
+    Excel technology file), using the datasets the exchanges link to.
+
+    Inputs are found in a ``(database, code)`` index of each of the external and existing data, built once, so the
+    time taken depends on the size of the external data rather than external × existing.
+
+    :param external_data: imported datasets, fixed in place
+    :param existing_data: datasets already in the database
+    """
+    indexes = {}
     external_db_set = set([a['database'] for a in external_data])
     internal_db_set = set([a['database'] for a in existing_data])
     # print(external_db_set)
@@ -74,9 +139,13 @@ def fix_products_and_locations_external(external_data, existing_data):
             # add missing location
 
             if e['input'][0] in external_db_set:
-                look_in = external_data
+                look_in = 'external'
+                if look_in not in indexes:
+                    indexes[look_in] = code_index(external_data)
             elif e['input'][0] in internal_db_set:
-                look_in = existing_data
+                look_in = 'existing'
+                if look_in not in indexes:
+                    indexes[look_in] = code_index(existing_data)
             else:
                 # print(e['input'][0])
                 continue
@@ -84,13 +153,14 @@ def fix_products_and_locations_external(external_data, existing_data):
             this_input = e['input']
             # print(this_input)
 
-            input_filter = [w.equals('database', this_input[0])]
-            input_filter += [w.equals('code', this_input[1])]
+            found = indexes[look_in].lookup(CODE_FIELDS, tuple(this_input))
 
-            try:
-                this_input = w.get_one(look_in, *input_filter)
-            except w.errors.NoResults:
+            if not found:
                 assert 0, "{} not found".format(this_input)
+            elif len(found) > 1:
+                raise w.errors.MultipleResults("Multiple datasets found for {}".format(this_input))
+
+            this_input = found[0]
 
             if not 'product' in e.keys():
                 e['product'] = this_input['reference product']
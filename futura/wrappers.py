@@ -15,8 +15,11 @@ from .storage import storage
 from .constants import DEFAULT_SETUP_PROJECT
 from .ecoinvent import check_database
 import os
-from copy import deepcopy
-from bw2io.strategies.generic import link_iterable_by_fields
+from copy import copy, deepcopy
+from .linking import ExchangeLinker
+from .container import write_container, write_delta_container, is_container, ContainerReader
+from collections import Counter
+from .base_store import base_store
 from bw2io import BW2Package
 
 try:
@@ -52,10 +55,49 @@ class FuturaDatabase:
     def __repr__(self):
         return "FuturaDatabase with {} items".format(len(self.db))
 
-    def extract_bw2_database(self, project_name, database_name):
+    @property
+    def index(self):
+        """
+        The :class:`~futura.index.DatabaseIndex` used to answer ``equals`` filters on :attr:`db` without a full scan
+        """
+        return self.db.index
+
+    @property
+    def version(self):
+        """
+        Mutation counter of :attr:`db`, increased every time datasets are added or changed through Futura
+        """
+        return self.db.version
+
+    def cache_info(self):
+        """
+        Hit and miss statistics of the filter result cache of :attr:`db`
+        """
+        return self.db.cache_info()
+
+    def enable_text_index(self, *args, **kwargs):
+        """
+        Index ``name`` and ``reference product`` for ``contains`` and ``startswith`` filters, see
+        :func:`~futura.proxy.WurstDatabase.enable_text_index`
+        """
+        self.db.enable_text_index(*args, **kwargs)
+
+    def extract_bw2_database(self, project_name, database_name, use_store=False):
+
+        """
+        Extract databases from Brightway and add them to :attr:`db`
+
+        With ``use_store``, extracted databases are kept in :data:`futura.base_store.base_store`, so later extractions
+        of the same databases load the snapshot instead, until the databases are changed in Brightway.
+
+        :param use_store: load from and save to the base store
+        :type use_store: bool, optional
+        """
 
         if isinstance(database_name, str):
             database_names = [database_name]
+        else:
+            database_names = list(database_name)
         assert project_name in projects, "That project doesn't exist"
         assert isinstance(self.database_names, (list, tuple, set)), "Must pass list of database names"
 
@@ -63,10 +105,17 @@ class FuturaDatabase:
 
         projects.set_current(project_name)
 
-        input_db = w.extract_brightway2_databases(database_names)
+        def extract():
+            extracted = w.extract_brightway2_databases(database_names)
+            fix_unset_technosphere_and_production_exchange_locations(extracted)
+            #remove_nones(extracted)
+            return extracted
 
-        fix_unset_technosphere_and_production_exchange_locations(input_db)
-        #remove_nones(input_db)
+        if use_store:
+            input_db, snapshot_path = base_store.get(project_name, database_names, extract)
+            print("Base database snapshot: {}".format(snapshot_path))
+        else:
+            input_db = extract()
 
         self.db.extend(input_db)
         print(self.db)
@@ -114,41 +163,12 @@ class FuturaDatabase:
         # make the internal links
         sp.match_database(fields=["name", "unit", "location"])
 
-        # make the links to existing data
-        still_unlinked = link_iterable_by_fields(sp.data, self.db, fields=["reference product", "name", "unit", "location"])
-        still_unlinked = link_iterable_by_fields(still_unlinked, self.db, fields=["name", "unit", "location"])
-
-        # Change GLO to RoW
-        if still_unlinked:
-            for x in still_unlinked:
-                for exc in x.get('exchanges', []):
-                    if not exc.get("input"):
-                        if exc.get('location') == 'GLO':
-                            exc['location'] = 'RoW'
-
-            still_unlinked = link_iterable_by_fields(still_unlinked, self.db, fields=["name", "unit", "location"])
-
-        # Make processes less specific, by snipping off trailing descriptions (e.g. ', at user', ', metallurgical' etc.)
-        if still_unlinked:
-            attempts = 2
-            for i in range(attempts):
-                for x in still_unlinked:
-                    for exc in x.get('exchanges', []):
-                        if not exc.get("input"):
-                            if exc['name'].rfind(',') != -1:
-                                exc['name'] = exc['name'][:exc['name'].rfind(',')]
-
-                still_unlinked = link_iterable_by_fields(still_unlinked, self.db, fields=["name", "unit", "location"])
-
-        # Try switching despecified items back to GLO
-        if still_unlinked:
-            for x in still_unlinked:
-                for exc in x.get('exchanges', []):
-                    if not exc.get("input"):
-                        if exc.get('location') == 'RoW':
-                            exc['location'] = 'GLO'
-
-            still_unlinked = link_iterable_by_fields(still_unlinked, self.db, fields=["name", "unit", "location"])
+        # make the links to existing data, falling back on less specific matches (see futura.linking.DEFAULT_CASCADE)
+        linker = ExchangeLinker(self.db)
+        linked = linker.link_cascade(sp.data)
+
+        for rule, count in linked.items():
+            print("Linked {} exchanges by {}".format(count, rule))
 
         if sp.statistics()[2] != 0:
             fp = sp.write_excel()
@@ -307,7 +327,18 @@ class FuturaDatabase:
 
         w.write_brightway2_database(self.db, name)
 
-    def save(self, save_directory=None, save_filename=None):
+    def save(self, save_directory=None, save_filename=None, codec=None, threads=None, base=None):
+
+        """
+        Save the database as an ``.fdb`` file
+
+        :param save_directory: default is ``storage.data_dir``
+        :param save_filename: default is the database names joined with ``-``
+        :param codec: compression codec, ``zlib`` (default), ``lz4`` or ``zstd``, see :mod:`futura.compression`
+        :param threads: number of compression threads
+        :param base: path of an ``.fdb`` or ``.fl`` file to save a delta against: only the datasets which are new or
+            different from those in ``base`` are saved, and ``base`` is needed to load the file again
+        """
 
         assert self.database_names, 'Nothing to save yet'
 
@@ -321,19 +352,56 @@ class FuturaDatabase:
 
         save_path = os.path.join(save_directory, save_filename)
 
-        with open(save_path, 'wb') as f:
-            f.write(zlib.compress(pickle.dumps(self)))
+        # datasets are pickled and compressed a chunk at a time, see futura.container
+        header = dict(self.summary(), kind='database')
+        if base:
+            write_delta_container(save_path, self.db, base, state=self.without_datasets(), header=header,
+                                  codec=codec, threads=threads)
+        else:
+            write_container(save_path, self.db, state=self.without_datasets(), header=header, codec=codec,
+                            threads=threads)
 
         print('Saved to {}'.format(save_path))
 
-    def load(self, load_path):
+    def summary(self):
+        """
+        The database names and the number of datasets in each, as saved in the header of ``.fdb`` and ``.fl`` files
+        """
+        counts = Counter(ds.get('database') for ds in self.db)
+        return {'database_names': list(self.database_names),
+                'datasets': {str(name): count for name, count in counts.items()},
+                'dataset_count': len(self.db)}
 
-        assert self.db == [], "Can only load data into a blank instance of FuturaDatabase"
+    def without_datasets(self):
+        """
+        A copy of this FuturaDatabase with an empty :attr:`db`, to save alongside the datasets themselves
+        """
+        shell = copy(self)
+        shell.db = WurstDatabase()
+        shell.db.text_fields = self.db.__dict__.get('text_fields', ())
+        return shell
+
+    def load(self, load_path, threads=None, base=None):
+
+        """
+        Load an ``.fdb`` file into this (blank) FuturaDatabase
+
+        :param threads: number of decompression threads
+        :param base: path of the base of a delta file, if it has moved since the delta was saved
+        """
 
-        with open(load_path, 'rb') as f:
-            assert load_path[-4:] == '.fdb', "Not a valid file path"
-            print("Loading fdb file from {}".format(load_path))
-            loaded = pickle.loads(zlib.decompress(f.read()))
+        assert self.db == [], "Can only load data into a blank instance of FuturaDatabase"
+        assert load_path[-4:] == '.fdb', "Not a valid file path"
+        print("Loading fdb file from {}".format(load_path))
+
+        if is_container(load_path):
+            with ContainerReader(load_path, threads=threads) as reader:
+                loaded = reader.state()
+                loaded.db.extend(reader.datasets(base))
+        else:
+            # whole-object pickle saved by older versions
+            with open(load_path, 'rb') as f:
+                loaded = pickle.loads(zlib.decompress(f.read()))
 
         self.db = loaded.db
         self.database_names = loaded.database_names
@@ -1,11 +1,36 @@
-from wurst import log
 from wurst.errors import InvalidLink
-from wurst.geo import geomatcher
-from wurst.searching import reference_product, get_many, equals, get_one
-from wurst.transformations.uncertainty import rescale_exchange
+from wurst.searching import reference_product
 from wurst.transformations.utils import copy_dataset
-from constructive_geometries import resolved_row
 from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
+
+from .proxy import WurstDatabase, WurstFilter
+from .geo import resolver
+from .journal import journal
+
+import logging
+
+
+def equals(field, value):
+    """Return function where input ``field`` value is equal to ``value``.
+
+    The function is a described :class:`~futura.proxy.WurstFilter`, so the lookup can be answered by the index of a
+    :class:`~futura.proxy.WurstDatabase` instead of a scan."""
+    w_filter = WurstFilter(lambda x: x.get(field) == value,
+                           signature="equals('{}', '{}')".format(field, value))
+    w_filter.description = {'filter': 'equals', 'args': [field, value]}
+    return w_filter
+
+
+def get_many(data, *funcs):
+    """Apply all filter functions ``funcs`` to ``data``.
+
+    If ``data`` is a :class:`~futura.proxy.WurstDatabase` its index is used for any ``equals`` filters."""
+    if isinstance(data, WurstDatabase):
+        return data.search(*funcs)
+    for fltr in funcs:
+        data = filter(fltr, data)
+    return data
 
 
 def copy_to_new_location(ds, location):
@@ -14,11 +39,8 @@ def copy_to_new_location(ds, location):
     Doesn't change exchange locations, except for production exchanges.
 
     Returns the new dataset."""
-    MESSAGE = "Copied activity from '{old}' location to '{new}'."
-    log({
-        'function': 'copy_to_new_location',
-        'message': MESSAGE.format(old=ds['location'], new=location)
-    }, ds)
+    MESSAGE = "Copied activity from '{}' location to '{}'."
+    journal.record(journal.detail_level, 'copy_to_new_location', MESSAGE, (ds['location'], location), ds)
 
     cp = copy_dataset(ds)
     cp['location'] = location
@@ -30,7 +52,8 @@ def copy_to_new_location(ds, location):
 
 
 def relink_technosphere_exchanges(ds, data, exclusive=True,
-                                  drop_invalid=False, keep_invalid=False, biggest_first=False, contained=True, exclude=None):
+                                  drop_invalid=False, keep_invalid=False, biggest_first=False, contained=True, exclude=None,
+                                  verbose=True):
     """Find new technosphere providers based on the location of the dataset.
 
     Designed to be used when the dataset's location changes, or when new datasets are added.
@@ -45,6 +68,8 @@ def relink_technosphere_exchanges(ds, data, exclusive=True,
 
     Allocation between providers is done using ``allocate_inputs``; results seem strange if ``contained=False``, as production volumes for large regions would be used as allocation factors.
 
+    Geography resolution is memoised by :data:`futura.geo.resolver`, so each combination of dataset location and provider locations is only worked out once.
+
     Input arguments:
 
         * ``ds``: The dataset whose technosphere exchanges will be modified.
@@ -55,35 +80,148 @@ def relink_technosphere_exchanges(ds, data, exclusive=True,
         * ``biggest_first``: Bool, default is ``False``. Determines search order when selecting provider locations. Only relevant is ``exclusive`` is ``True``.
         * ``contained``: Bool, default is ``True``. If ture, only use providers whose location is completely within the ``ds`` location; otherwise use all intersecting locations.
         * ``exclude``: List, optional list of locations to exclude possible exchanges from.
+        * ``verbose``: Bool, default is ``True``. Print the exchanges kept by ``keep_invalid``, as well as recording them in the journal.
+
+    Changes are recorded in :data:`futura.journal.journal`. Relinked exchanges are recorded at the journal's ``detail_level`` (``INFO`` by default, set it to ``DEBUG`` to leave them out of the log); dropped and retained exchanges are recorded at ``INFO`` level, and a retained exchange only has its retained entry.
 
     Modifies the dataset in place; returns the modified dataset."""
 
     #print("MonkeyPatch!! relink_technosphere_exchanges")
 
+    relinker = TechnosphereRelinker(data, exclusive=exclusive, drop_invalid=drop_invalid, keep_invalid=keep_invalid,
+                                    biggest_first=biggest_first, contained=contained, exclude=exclude, verbose=verbose)
+    return relinker.relink(ds)
+
+
+def relink_many(datasets, data, exclusive=True, drop_invalid=False, keep_invalid=False, biggest_first=False,
+                contained=True, exclude=None, workers=None, verbose=True):
+    """Relink the technosphere exchanges of a batch of datasets, e.g. all the new datasets from a regionalisation.
+
+    Takes the same options as ``relink_technosphere_exchanges`` and gives the same exchanges, but exchanges with the
+    same provider key and dataset location are only resolved and allocated once (see :class:`TechnosphereRelinker`).
+
+    ``exclusive`` can also be a function of the dataset, e.g. to not use exclusive locations for markets.
+
+    With ``workers`` the datasets are relinked by a pool of that many processes, each with its own copy of ``data``
+    taken when the pool starts. The new exchanges are copied back into ``datasets`` in their original order. Relinking
+    only changes technosphere exchanges, which aren't used to choose providers, so the result is the same as without
+    workers as long as ``data`` isn't changed while the pool runs. With the ``fork`` start method (the default on
+    Linux) the workers share the memory of ``data`` with this process, but with ``spawn`` (Windows and macOS) the
+    whole of ``data`` is pickled and sent to every worker, which can take longer than it saves for a large database.
+
+    Modifies the datasets in place; returns the list of modified datasets."""
+    options = dict(drop_invalid=drop_invalid, keep_invalid=keep_invalid, biggest_first=biggest_first,
+                   contained=contained, exclude=exclude, verbose=verbose)
+
+    if workers and workers > 1:
+        return _relink_in_pool(list(datasets), data, exclusive, options, workers)
+
+    if callable(exclusive):
+        relinkers = {x: TechnosphereRelinker(data, exclusive=x, **options) for x in (True, False)}
+        relinked = [relinkers[bool(exclusive(ds))].relink(ds) for ds in datasets]
+        journal.flush()
+        return relinked
+
+    relinker = TechnosphereRelinker(data, exclusive=exclusive, **options)
+    relinked = [relinker.relink(ds) for ds in datasets]
+    journal.flush()
+    return relinked
+
+
+# relinkers of a worker process in the pool started by relink_many, one for exclusive and one for non-exclusive links
+_worker_relinkers = None
+
+
+def _start_relink_worker(data, options):
+    global _worker_relinkers
+    _worker_relinkers = {x: TechnosphereRelinker(data, exclusive=x, **options) for x in (True, False)}
+
+
+def _relink_chunk(chunk):
+    exchanges = [_worker_relinkers[exclusive].relink(ds)['exchanges'] for exclusive, ds in chunk]
+    # pool workers don't run atexit handlers, so write out the journal of each chunk before returning it
+    journal.flush()
+    return exchanges
+
+
+def _relink_in_pool(datasets, data, exclusive, options, workers):
+    if not datasets:
+        return datasets
+
+    if isinstance(data, WurstDatabase):
+        # build the index before the pool starts, so forked workers share it instead of each building their own
+        # (spawned workers get a pickled copy of data, which leaves out the index)
+        _ = data.index
+
+    flags = [bool(exclusive(ds)) if callable(exclusive) else bool(exclusive) for ds in datasets]
+    jobs = list(zip(flags, datasets))
+
+    chunk_size = max(1, len(jobs) // (workers * 4))
+    chunks = [jobs[n:n + chunk_size] for n in range(0, len(jobs), chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_start_relink_worker,
+                             initargs=(data, options)) as executor:
+        results = executor.map(_relink_chunk, chunks)
+        for chunk, exchange_lists in zip(chunks, results):
+            for (_, ds), exchanges in zip(chunk, exchange_lists):
+                ds['exchanges'] = exchanges
+
+    return datasets
+
+
+class TechnosphereRelinker:
+    """Relinks technosphere exchanges against ``data``, see ``relink_technosphere_exchanges`` for the options.
+
+    Technosphere exchanges are grouped by the provider key of the exchange (name, reference product and unit) and
+    the location of the dataset. The providers of a group, and how the exchange is split between them, are worked out
+    the first time the group is seen and reused for every other exchange in it.
+
+    The groups are only valid while the providers in ``data`` don't change, so use a new relinker after adding or
+    changing providers."""
+
     MESSAGE = "Relinked technosphere exchange of {}/{}/{} from {}/{} to {}/{}."
     DROPPED = "Dropped technosphere exchange of {}/{}/{}; no valid providers."
     RETAINED = "Retained potentially invalid technosphere exchange of {}/{}/{}; no valid providers."
-    new_exchanges = []
-    technosphere = lambda x: x['type'] == 'technosphere'
 
-    for exc in filter(technosphere, ds['exchanges']):
-        possible_datasets = list(get_possibles(exc, data))
+    def __init__(self, data, exclusive=True, drop_invalid=False, keep_invalid=False, biggest_first=False,
+                 contained=True, exclude=None, verbose=True):
+        self.data = data
+        self.exclusive = exclusive
+        self.drop_invalid = drop_invalid
+        self.keep_invalid = keep_invalid
+        self.biggest_first = biggest_first
+        self.contained = contained
+        self.exclude = exclude
+        self.verbose = verbose
+
+        self.groups = {}
+
+    def __repr__(self):
+        return "TechnosphereRelinker with {} provider groups".format(len(self.groups))
+
+    def providers(self, exc, location):
+        """Get the providers for ``exc`` in a dataset in ``location`` and their allocation factors
+
+        :return: list of ``(provider, factor)``, empty if there are no valid providers
+        """
+        key = (exc['name'], exc['product'], exc['unit'], location)
+
+        try:
+            return self.groups[key]
+        except KeyError:
+            pass
+
+        possible_datasets = list(get_possibles(exc, self.data))
         possible_locations = [obj['location'] for obj in possible_datasets]
-        if exclude:
-            possible_locations = [x for x in possible_locations if x not in exclude]
-        with resolved_row(possible_locations, geomatcher) as g:
-            func = g.contained if contained else g.intersects
-            gis_match = func(ds['location'], include_self=True, exclusive=exclusive,
-                             biggest_first=biggest_first, only=possible_locations)
+        if self.exclude:
+            possible_locations = [x for x in possible_locations if x not in self.exclude]
+        gis_match, missing_faces = resolver.resolve(location, possible_locations, exclusive=self.exclusive,
+                                                    contained=self.contained, biggest_first=self.biggest_first)
 
         kept = [ds for loc in gis_match for ds in possible_datasets
                 if ds['location'] == loc]
 
         if kept:
-            with resolved_row(possible_locations, geomatcher) as g:
-                missing_faces = geomatcher[ds['location']].difference(
-                    set.union(*[geomatcher[obj['location']] for obj in kept])
-                )
             if missing_faces and "RoW" in possible_locations:
                 kept.extend([obj for obj in possible_datasets if obj['location'] == 'RoW'])
         elif 'RoW' in possible_locations:
@@ -92,61 +230,63 @@ def relink_technosphere_exchanges(ds, data, exclusive=True,
         if not kept and "GLO" in possible_locations:
             kept = [obj for obj in possible_datasets if obj['location'] == 'GLO']
 
-        if not kept:
-            if drop_invalid:
-                log({
-                    'function': 'relink_technosphere_exchanges',
-                    'message': DROPPED.format(
-                        exc['name'], exc['product'], exc['unit']
-                    )
-                }, ds)
+        group = list(zip(kept, allocation_factors(kept))) if kept else []
+        self.groups[key] = group
+
+        return group
+
+    def relink(self, ds):
+        """Relink the technosphere exchanges of ``ds``
+
+        Modifies the dataset in place; returns the modified dataset."""
+        new_exchanges = []
+        technosphere = lambda x: x['type'] == 'technosphere'
+
+        for exc in filter(technosphere, ds['exchanges']):
+            group = self.providers(exc, ds['location'])
+
+            if group:
+                allocated = [new_exchange(exc, obj, factor) for obj, factor in group]
+
+            elif self.drop_invalid:
+                journal.record(logging.INFO, 'relink_technosphere_exchanges', self.DROPPED,
+                               (exc['name'], exc['product'], exc['unit']), ds)
                 continue
 
-            elif keep_invalid:
-                print('keeping invalid links')
-                log({
-                    'function': 'relink_technosphere_exchanges',
-                    'message': RETAINED.format(
-                        exc['name'], exc['product'], exc['unit']
-                    )
-                }, ds)
-                print(exc)
-                kept = [exc]
+            elif self.keep_invalid:
+                if self.verbose:
+                    print('keeping invalid links')
+                    print(exc)
+                journal.record(logging.INFO, 'relink_technosphere_exchanges', self.RETAINED,
+                               (exc['name'], exc['product'], exc['unit']), ds)
+                new_exchanges.append(exc)
+                continue
 
             else:
                 print("technosphere exchange of {}/{}/{}; no valid providers.".format(exc['name'], exc['product'],
                                                                                       exc['unit']))
                 raise InvalidLink
 
-        allocated = allocate_inputs(exc, kept)
-
-        for obj in allocated:
-            log({
-                'function': 'relink_technosphere_exchanges',
-                'message': MESSAGE.format(
-                    exc['name'], exc['product'], exc['unit'], exc['amount'],
-                    ds['location'], obj['amount'], obj['location']
-                )
-            }, ds)
+            if journal.enabled(journal.detail_level):
+                for obj in allocated:
+                    journal.record(journal.detail_level, 'relink_technosphere_exchanges', self.MESSAGE,
+                                   (exc['name'], exc['product'], exc['unit'], exc['amount'],
+                                    ds['location'], obj['amount'], obj['location']), ds)
 
-        new_exchanges.extend(allocated)
+            new_exchanges.extend(allocated)
 
-    ds['exchanges'] = [
-                          exc for exc in ds['exchanges']
-                          if exc['type'] != 'technosphere'
-                      ] + new_exchanges
-    return ds
+        ds['exchanges'] = [
+                              exc for exc in ds['exchanges']
+                              if exc['type'] != 'technosphere'
+                          ] + new_exchanges
+        return ds
 
 
-def allocate_inputs(exc, lst):
-    """Allocate the input exchanges in ``lst`` to ``exc``, using production volumes where possible, and equal splitting otherwise.
+def allocation_factors(lst):
+    """Get the share of an input allocated to each dataset in ``lst``, using production volumes where possible, and
+    equal splitting otherwise.
 
     Always uses equal splitting if ``RoW`` is present."""
-
-    #print("MonkeyPatch!! allocate_inputs")
-
-    MESSAGE = "Changed technosphere exchange of {}/{} to {}/{}."
-
     has_row = any((x['location'] in ('RoW', 'GLO') for x in lst))
     pvs = [reference_product(o).get('production volume') or 0 for o in lst]
     if all((x > 0 for x in pvs)) and not has_row:
@@ -157,58 +297,99 @@ def allocate_inputs(exc, lst):
         total = len(lst)
         pvs = [1 for _ in range(total)]
 
-    def new_exchange(exc, obj, factor):
-        cp = deepcopy(exc)
+    return [factor / total for factor in pvs]
 
-        if cp['name'] != obj['name']:
-            log({
-                'function': 'allocate_inputs',
-                'message': MESSAGE.format(
-                    cp['name'], cp['location'],
-                    obj['name'], obj['location']
-                )
-            }, cp)
 
-            cp['name'] = obj['name']
+# Exchange values that can be shared between an exchange and its copies
+_ATOMIC_TYPES = (str, int, float, bool, type(None))
+
+# Uncertainty fields removed when an exchange is rescaled (as in ``wurst.transformations.uncertainty.rescale_exchange``)
+_UNCERTAINTY_FIELDS = ('scale', 'minimum', 'maximum')
+
+
+def clone_exchange(exc):
+    """Copy an exchange.
+
+    Gives the same result as ``deepcopy(exc)``, but only the nested values (e.g. ``properties``) are deep copied, so
+    copying a normal flat exchange is a single dict copy."""
+    cp = dict(exc)
+    for key, value in cp.items():
+        if not isinstance(value, _ATOMIC_TYPES):
+            cp[key] = deepcopy(value)
+    return cp
 
-        cp['location'] = obj['location']
 
-        return rescale_exchange(cp, factor)
+def new_exchange(exc, obj, factor):
+    """Copy ``exc``, link it to the dataset ``obj`` and rescale it by ``factor``.
+
+    Rescaling removes the uncertainty of the copy, as ``rescale_exchange`` does by default."""
+    MESSAGE = "Changed technosphere exchange of {}/{} to {}/{}."
+
+    cp = clone_exchange(exc)
+
+    if cp['name'] != obj['name']:
+        journal.record(journal.detail_level, 'allocate_inputs', MESSAGE,
+                       (cp['name'], cp['location'], obj['name'], obj['location']), cp)
+
+        cp['name'] = obj['name']
+
+    cp['location'] = obj['location']
+
+    cp['amount'] *= factor
+    cp['uncertainty type'] = 0
+    cp['loc'] = cp['amount']
+    for field in _UNCERTAINTY_FIELDS:
+        cp.pop(field, None)
+
+    return cp
+
+
+def allocate_inputs(exc, lst):
+    """Allocate the input exchanges in ``lst`` to ``exc``, using production volumes where possible, and equal splitting otherwise.
+
+    Always uses equal splitting if ``RoW`` is present."""
+
+    #print("MonkeyPatch!! allocate_inputs")
 
     return [
-        new_exchange(exc, obj, factor / total)
-        for obj, factor in zip(lst, pvs)
+        new_exchange(exc, obj, factor)
+        for obj, factor in zip(lst, allocation_factors(lst))
     ]
 
 
 def get_possibles(exchange, data):
     """Filter a list of datasets ``data``, returning those with the same name, reference product, and unit as in ``exchange``.
 
+    If ``data`` is a :class:`~futura.proxy.WurstDatabase` the providers are looked up in its index instead of scanning
+    the whole list.
+
     Returns a generator."""
 
     market_name = exchange['name']
     if market_name.startswith('market group'):
         market_name = 'market' + market_name[len('market group'):]
 
+    if isinstance(data, WurstDatabase):
+        def find(key):
+            return list(data.index.providers(*key))
+    else:
+        def find(key):
+            return (ds for ds in data if (ds['name'], ds.get('reference product'), ds['unit']) == key)
+
     if market_name != exchange['name']:
-        key = (market_name, exchange['product'], exchange['unit'])
-        for ds in data:
-            if (ds['name'], ds['reference product'], ds['unit']) == key:
-                yield ds
+        yield from find((market_name, exchange['product'], exchange['unit']))
     try:
         key = (exchange['name'], exchange['product'], exchange['unit'])
     except KeyError:
         print(exchange)
         assert 0
-    for ds in data:
-        if (ds['name'], ds.get('reference product'), ds['unit']) == key:
-            yield ds
+    yield from find(key)
 
 
 def default_global_location(database):
     """Set missing locations to ```GLO``` for datasets in ``database``.
 
     Changes location if ``location`` is missing or ``None``. Will add key ``location`` if missing."""
-    for ds in get_many(database, *[equals('location', None)]):
+    for ds in list(get_many(database, *[equals('location', None)])):
         ds['location'] = 'GLO'
     return database
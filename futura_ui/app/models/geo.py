@@ -1,4 +1,3 @@
-import constructive_geometries as cg
 import country_converter as cc
 from PySide2.QtGui import QStandardItemModel, QStandardItem
 from PySide2.QtWidgets import QApplication, QTreeView
@@ -7,11 +6,14 @@ from PySide2.QtCore import Qt
 import json
 import os
 
-g = cg.Geomatcher()
 from pprint import pprint
 
 
 def location_tree(root, exclude_phrases=None, name_switch_dict=None, other=None):
+    # only needed to regenerate global_tree.json, so share the wurst geomatcher rather than building one at import
+    from futura.geo import resolver
+    g = resolver.geomatcher
+
     seen = []
     tree = {}
     other_dict = {'name': 'Other', 'children': {}}
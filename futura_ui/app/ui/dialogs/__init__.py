@@ -4,4 +4,5 @@ from .add_base_database import BaseDatabaseDialog
 from .new_recipe import NewRecipeDialog
 from .ecoinvent_dialog import EcoinventLoginDialog
 from .brightway_dialog import BrightwayDialog
-from .brightway_open_dialog import BrightwayOpenDialog
\ No newline at end of file
+from .brightway_open_dialog import BrightwayOpenDialog
+from .loader_preview import LoaderPreviewDialog
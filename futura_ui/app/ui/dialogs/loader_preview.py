@@ -0,0 +1,124 @@
+from PySide2 import QtWidgets, QtCore
+from futura.loader import FuturaLoader
+import glob
+import os
+
+
+def describe_header(header):
+    """
+    Text preview of a saved loader from its header (see :func:`futura.container.peek`)
+    """
+    if header.get('format', 0) == 0:
+        return "Saved by an older version of Futura.\n\nDetails are shown once it's opened."
+
+    lines = []
+
+    metadata = (header.get('recipe') or {}).get('metadata', {})
+    if metadata.get('output_database'):
+        lines.append("Output database: {}".format(metadata['output_database']))
+    if metadata.get('ecoinvent_version'):
+        lines.append("ecoinvent {} {}".format(metadata['ecoinvent_version'], metadata.get('ecoinvent_system_model', '')))
+
+    lines.append("Recipe actions: {}".format(len((header.get('recipe') or {}).get('actions', []))))
+    lines.append("")
+
+    lines.append("Databases:")
+    for name in header.get('database_names', []):
+        lines.append("    {} ({} activities)".format(name, header.get('datasets', {}).get(name, 0)))
+    lines.append("Total activities: {}".format(header.get('dataset_count', 0)))
+
+    if header.get('delta'):
+        lines.append("Saved as changes to {}".format(header['delta'].get('name')))
+
+    lines.append("")
+    lines.append("Saved {}{}".format(header.get('created', '')[:16].replace('T', ' '),
+                                     " by {}".format(header['created_by']) if header.get('created_by') else ''))
+
+    return "\n".join(lines)
+
+
+class LoaderPreviewDialog(QtWidgets.QDialog):
+
+    """
+    Lists the saved loaders (.fl files) in a folder with a preview of the selected one, read from the file header, so
+    only the loader that's opened is actually loaded
+    """
+
+    def __init__(self, directory=None, parent=None):
+        super(LoaderPreviewDialog, self).__init__(parent)
+
+        self.setWindowTitle('Open Futura file...')
+        self.resize(700, 400)
+
+        self.directory = directory or os.path.join(os.path.expanduser('~'), 'Documents')
+        self.selected_path = None
+
+        self.directoryLabel = QtWidgets.QLabel()
+        self.browseButton = QtWidgets.QPushButton('Browse...')
+        self.fileList = QtWidgets.QListWidget()
+        self.preview = QtWidgets.QPlainTextEdit()
+        self.preview.setReadOnly(True)
+        self.buttonBox = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Open |
+                                                    QtWidgets.QDialogButtonBox.Cancel)
+
+        directory_layout = QtWidgets.QHBoxLayout()
+        directory_layout.addWidget(self.directoryLabel, 1)
+        directory_layout.addWidget(self.browseButton)
+
+        file_layout = QtWidgets.QHBoxLayout()
+        file_layout.addWidget(self.fileList, 1)
+        file_layout.addWidget(self.preview, 2)
+
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addLayout(directory_layout)
+        layout.addLayout(file_layout)
+        layout.addWidget(self.buttonBox)
+
+        self.connect_widgets()
+        self.list_files()
+
+    def connect_widgets(self):
+        self.browseButton.clicked.connect(self.browse)
+        self.fileList.currentItemChanged.connect(self.show_preview)
+        self.fileList.itemDoubleClicked.connect(self.accept)
+        self.buttonBox.accepted.connect(self.accept)
+        self.buttonBox.rejected.connect(self.reject)
+
+    def browse(self):
+        directory = QtWidgets.QFileDialog.getExistingDirectory(self, 'Choose a folder', self.directory)
+        if directory:
+            self.directory = directory
+            self.list_files()
+
+    def list_files(self):
+        self.directoryLabel.setText(self.directory)
+        self.fileList.clear()
+        self.preview.clear()
+
+        paths = sorted(glob.glob(os.path.join(self.directory, '*.fl')), key=os.path.getmtime, reverse=True)
+        for path in paths:
+            item = QtWidgets.QListWidgetItem(os.path.basename(path))
+            item.setData(QtCore.Qt.UserRole, path)
+            self.fileList.addItem(item)
+
+        if paths:
+            self.fileList.setCurrentRow(0)
+
+        self.buttonBox.button(QtWidgets.QDialogButtonBox.Open).setEnabled(bool(paths))
+
+    def show_preview(self, item, previous=None):
+        if item is None:
+            self.preview.clear()
+            return
+
+        try:
+            header = FuturaLoader.peek(item.data(QtCore.Qt.UserRole))
+            self.preview.setPlainText(describe_header(header))
+        except Exception as e:
+            self.preview.setPlainText("Can't read this file: {}".format(e))
+
+    def accept(self, *args):
+        item = self.fileList.currentItem()
+        if item is not None:
+            self.selected_path = item.data(QtCore.Qt.UserRole)
+            super(LoaderPreviewDialog, self).accept()
@@ -19,6 +19,11 @@ try:
 except ImportError:
     from futura_ui.app.utils import findMainWindow
 
+try:
+    from ...threads import FunctionThread
+except ImportError:
+    from futura_ui.app.threads import FunctionThread
+
 from ..widgets import LocationInputWidget
 
 from PySide2.QtCore import Signal
@@ -115,6 +120,32 @@ def parse_filter_widget(widget):
     return filter_description
 
 
+def has_text_filter(description):
+    """
+    Whether a filter description has a ``contains`` or ``startswith`` filter anywhere in it, so searches with it can
+    use a text index
+    """
+    if isinstance(description, dict):
+        return description.get('filter') in ('contains', 'startswith') or has_text_filter(description.get('args'))
+    if isinstance(description, list):
+        return any(has_text_filter(x) for x in description)
+    return False
+
+
+def describe_result(result):
+    if len(result) == 0:
+        return "No results found!"
+    elif len(result) == 1:
+        return "{} result found - {} ({}) [{}]".format(len(result),
+                                                       result[0]['name'],
+                                                       result[0]['unit'],
+                                                       result[0]['location'])
+    return "{} results found, including {} ({}) [{}]".format(len(result),
+                                                             result[0]['name'],
+                                                             result[0]['unit'],
+                                                             result[0]['location'])
+
+
 class FilterWidget(QtWidgets.QWidget):
     def __init__(self, parent=None):
         super(FilterWidget, self).__init__(parent)
@@ -234,6 +265,9 @@ class SubFilterWidget(QtWidgets.QWidget):
 
 
 class FilterListerWidget(QtWidgets.QWidget):
+
+    result_ready = Signal(str)
+
     def __init__(self, parent=None):
         super(FilterListerWidget, self).__init__(parent)
 
@@ -249,8 +283,10 @@ class FilterListerWidget(QtWidgets.QWidget):
         self.removeButton.pressed.connect(self.remove_filter_step)
 
         self.testButton.pressed.connect(self.test_filter)
+        self.result_ready.connect(self.test_result.setText)
 
         self.filter_steps = []
+        self.thread = None
 
         self.add_filter_step()
 
@@ -268,21 +304,21 @@ class FilterListerWidget(QtWidgets.QWidget):
 
     def test_filter(self):
         test_filter = self.create_filter()
-        db = findMainWindow().loader.database.db
-        result = list(w.get_many(db, *test_filter))
-        if len(result) == 0:
-            message = "No results found!"
-        elif len(result) == 1:
-            message = "{} result found - {} ({}) [{}]".format(len(result),
-                                                              result[0]['name'],
-                                                              result[0]['unit'],
-                                                              result[0]['location'])
-        else:
-            message = "{} results found, including {} ({}) [{}]".format(len(result),
-                                                              result[0]['name'],
-                                                              result[0]['unit'],
-                                                              result[0]['location'])
-        self.test_result.setText(message)
+        database = findMainWindow().loader.database
+        if has_text_filter(test_filter.description):
+            # only sets the fields, the index itself is built by the first search that needs it, on the thread below
+            database.enable_text_index()
+        db = database.db
+
+        def run():
+            self.result_ready.emit(describe_result(list(w.get_many(db, *test_filter))))
+
+        self.testButton.setEnabled(False)
+        self.test_result.setText("Searching...")
+
+        self.thread = FunctionThread(run)
+        self.thread.finished.connect(lambda: self.testButton.setEnabled(True))
+        self.thread.start()
 
 
 class FilterListerDialog(QtWidgets.QDialog):
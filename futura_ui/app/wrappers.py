@@ -4,7 +4,7 @@ from futura.recipe import FuturaRecipeExecutor
 from futura.storage import storage
 
 from .signals import signals
-from .ui.dialogs import EcoinventLoginDialog
+from .ui.dialogs import EcoinventLoginDialog, LoaderPreviewDialog
 from .utils import findMainWindow
 from PySide2.QtWidgets import QProgressDialog, QFileDialog, QApplication
 from PySide2.QtCore import Qt
@@ -74,12 +74,10 @@ class FuturaGuiLoader(FuturaLoader):
 
         print('load_dialog has been called')
 
-        filename, _ = QFileDialog.getOpenFileName(None,
-                                                  'Open Futura file...',
-                                                  os.path.join(os.path.expanduser('~'), 'Documents'),
-                                                  "Futura Loader Files (*.fl)")
-        if filename:
-            self.load(filename)
+        # the dialog previews files from their headers, only the chosen one is loaded
+        dialog = LoaderPreviewDialog(os.path.join(os.path.expanduser('~'), 'Documents'), findMainWindow())
+        if dialog.exec_() and dialog.selected_path:
+            self.load(dialog.selected_path)
 
             signals.update_recipe.emit()
             signals.show_recipe_actions.emit()
@@ -51,7 +51,9 @@ setup(
     package_data={'futura': my_package_files},
     entry_points={
         'console_scripts': [
-            'futura = futura_ui.bin.run_futura:main'
+            'futura = futura_ui.bin.run_futura:main',
+            'futura-batch = futura.cli:main',
+            'futura-store = futura.base_store:main'
         ],
         'gui_scripts': [
             'futura_ui = futura_ui.bin.run_futura_ui:main'
@@ -59,6 +61,10 @@ setup(
     },
     # install_requires=[
     # ],
+    extras_require={
+        'lz4': ['lz4'],
+        'zstd': ['zstandard'],
+    },
     include_package_data=True,
     url="https://github.com/pjamesjoyce/{}/".format(PACKAGE_NAME),
     download_url="https://github.com/pjamesjoyce/{}/archive/{}.tar.gz".format(PACKAGE_NAME, VERSION),
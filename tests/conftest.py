@@ -0,0 +1,53 @@
+"""
+Builders for the datasets and recipes used by the tests, shared as fixtures which return the builder function
+"""
+import pytest
+
+
+@pytest.fixture
+def make_dataset():
+    """
+    ``make_dataset(n, name, location, ...)`` builds a dataset with a single production exchange, coded ``code_<n>``
+    (or ``n`` itself if it's a string). ``inputs`` are added as technosphere exchanges
+    """
+
+    def make_dataset(n, name=None, location='GLO', product=None, unit='kilowatt hour', database='test_db',
+                     production_volume=None, inputs=()):
+        name = name or 'process {}'.format(n)
+        product = product or name
+
+        production = {'name': name, 'product': product, 'unit': unit, 'location': location, 'type': 'production',
+                      'amount': 1}
+        if production_volume is not None:
+            production['production volume'] = production_volume
+
+        return {'name': name, 'reference product': product, 'location': location, 'unit': unit,
+                'database': database, 'code': n if isinstance(n, str) else 'code_{}'.format(n),
+                'exchanges': [production] + [dict(exc, type='technosphere') for exc in inputs]}
+
+    return make_dataset
+
+
+@pytest.fixture
+def make_provider(make_dataset):
+    """
+    ``make_provider(n, name, location, pv)`` builds a dataset producing electricity, with production volume ``pv``
+    """
+
+    def make_provider(n, name, location, pv=10):
+        return make_dataset(n, name, location, product='electricity', production_volume=pv)
+
+    return make_provider
+
+
+@pytest.fixture
+def make_recipe():
+    """
+    ``make_recipe(*codes)`` builds a recipe with one ``test`` action per code, each with a single ``add`` task
+    """
+
+    def make_recipe(*codes):
+        return {'metadata': {}, 'actions': [{'action': 'test', 'tasks': [{'function': 'add', 'kwargs': {'code': code}}]}
+                                            for code in codes]}
+
+    return make_recipe
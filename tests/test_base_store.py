@@ -0,0 +1,104 @@
+from futura.base_store import BaseStore, brightway_state
+from futura.container import BASE_LOCATORS
+from futura.loader import FuturaLoader
+from futura.wrappers import FuturaDatabase
+
+from types import ModuleType
+import os
+import pytest
+import sys
+
+
+@pytest.fixture
+def store(tmpdir):
+    brightway = {'ecoinvent': ['2020-01-01T00:00:00', 10]}
+
+    def state(project_name, database_names):
+        if project_name != 'test' or any(name not in brightway for name in database_names):
+            return None
+        return [[name] + brightway[name] for name in database_names]
+
+    store = BaseStore(str(tmpdir.join('bases')), state=state)
+    store.brightway = brightway
+    return store
+
+
+def test_snapshot_is_reused_until_modified(store, make_dataset):
+    extracted = []
+
+    def extract():
+        extracted.append(1)
+        return [make_dataset(n, database='ecoinvent') for n in range(10)]
+
+    datasets, path = store.get('test', ['ecoinvent'], extract)
+    again, again_path = store.get('test', ['ecoinvent'], extract)
+
+    assert again == datasets and again_path == path
+    assert len(extracted) == 1
+
+    store.brightway['ecoinvent'] = ['2020-02-01T00:00:00', 10]
+    store.get('test', ['ecoinvent'], extract)
+    assert len(extracted) == 2
+    assert len(store.entries()) == 2
+
+    assert store.invalidate(database_name='other') == 0
+    assert store.invalidate(project_name='test') == 2
+    assert store.entries() == {}
+
+
+def test_delta_finds_snapshot_by_content_hash(store, tmpdir, make_dataset):
+    datasets, path = store.get('test', ['ecoinvent'],
+                               lambda: [make_dataset(n, database='ecoinvent') for n in range(10)])
+
+    loader = FuturaLoader()
+    loader.recipe = {'metadata': {}, 'actions': []}
+    loader.database = FuturaDatabase()
+    loader.database.database_names = ['ecoinvent']
+    loader.database.db.extend(datasets + [make_dataset(10, database='ecoinvent')])
+
+    # save against a copy of the snapshot, which is then removed, so the snapshot has to be found by its hash
+    copy_path = tmpdir.join('copy.fdb')
+    tmpdir.join('bases').join(os.path.basename(path)).copy(copy_path)
+
+    scenario_path = str(tmpdir.join('scenario.fl'))
+    loader.save(scenario_path, base=str(copy_path))
+    copy_path.remove()
+
+    BASE_LOCATORS.append(store.locate)
+    try:
+        loaded = FuturaLoader()
+        loaded.load(scenario_path)
+        assert list(loaded.database.db) == list(loader.database.db)
+    finally:
+        BASE_LOCATORS.remove(store.locate)
+
+
+def test_directory_is_created_on_first_store(store, tmpdir, make_dataset):
+    assert store.entries() == {}
+    assert store.locate('hash') is None
+    assert not tmpdir.join('bases').check()
+
+    store.store('test', ['ecoinvent'], [make_dataset(0, database='ecoinvent')])
+    assert tmpdir.join('bases').check(dir=True)
+    assert len(store.entries()) == 1
+
+
+def test_brightway_state_restores_current_project(monkeypatch):
+    switched = []
+
+    class Projects(list):
+        current = 'default'
+
+        def set_current(self, name):
+            switched.append(name)
+            self.current = name
+
+    bw2data = ModuleType('bw2data')
+    bw2data.projects = Projects(['default', 'test'])
+    bw2data.databases = {'ecoinvent': {'modified': '2020-01-01T00:00:00', 'number': 10}}
+    monkeypatch.setitem(sys.modules, 'bw2data', bw2data)
+
+    assert brightway_state('test', ['ecoinvent']) == [['ecoinvent', '2020-01-01T00:00:00', 10]]
+    assert brightway_state('test', ['missing']) is None
+    assert switched == ['test', 'default', 'test', 'default']
+    assert bw2data.projects.current == 'default'
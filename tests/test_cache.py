@@ -0,0 +1,119 @@
+from futura import w
+from futura.cache import canonical_key
+from futura.proxy import WurstDatabase, WurstFilter
+from futura.utils import create_filter_from_description
+
+import pytest
+
+
+@pytest.fixture
+def db(make_dataset):
+    return WurstDatabase([make_dataset(n, name, location)
+                          for n, (name, location) in enumerate([('electricity, hard coal', 'GB'),
+                                                                ('electricity, hard coal', 'DE'),
+                                                                ('electricity, lignite', 'GB')])])
+
+
+@pytest.fixture
+def gb_filter():
+    return create_filter_from_description([{'filter': 'startswith', 'args': ['location', 'G']},
+                                           {'filter': 'contains', 'args': ['name', 'coal']}])
+
+
+def codes(result):
+    return [x['code'] for x in result]
+
+
+def test_repeated_query_hits_cache(db, gb_filter):
+    assert codes(w.get_many(db, *gb_filter)) == ['code_0']
+    assert codes(w.get_many(db, *create_filter_from_description(gb_filter.description))) == ['code_0']
+
+    info = db.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
+
+
+def test_version_increases_on_changes(db, make_dataset):
+    versions = [db.version]
+    db.append(make_dataset(3, 'heat', 'GB'))
+    versions.append(db.version)
+    db.extend([make_dataset(4, 'heat', 'DE')])
+    versions.append(db.version)
+    db.reindex(db[0])
+    versions.append(db.version)
+    del db[0]
+    versions.append(db.version)
+
+    assert versions == sorted(set(versions))
+
+
+def test_append_catches_up_cached_result(db, gb_filter, make_dataset):
+    list(w.get_many(db, *gb_filter))
+    db.append(make_dataset(3, 'electricity, hard coal', 'GB'))
+    db.append(make_dataset(4, 'electricity, hard coal', 'FR'))
+
+    assert codes(w.get_many(db, *gb_filter)) == ['code_0', 'code_3']
+    assert db.cache_info().hits == 1
+
+
+def test_in_place_edit_drops_affected_entries(db, gb_filter):
+    de_filter = create_filter_from_description([{'filter': 'startswith', 'args': ['location', 'D']}])
+    lignite_filter = create_filter_from_description([{'filter': 'contains', 'args': ['name', 'lignite']}])
+    for f in (gb_filter, de_filter, lignite_filter):
+        list(w.get_many(db, *f))
+
+    db[1]['location'] = 'GB'
+    db.reindex(db[1])
+
+    assert len(db.cache) == 1
+    assert codes(w.get_many(db, *gb_filter)) == ['code_0', 'code_1']
+    assert codes(w.get_many(db, *de_filter)) == []
+    assert codes(w.get_many(db, *lignite_filter)) == ['code_2']
+
+
+def test_other_changes_clear_cache(db, gb_filter, make_dataset):
+    list(w.get_many(db, *gb_filter))
+    db.insert(0, make_dataset(3, 'electricity, hard coal', 'GB'))
+
+    assert len(db.cache) == 0
+    assert codes(w.get_many(db, *gb_filter)) == ['code_3', 'code_0']
+
+
+def test_exact_lookups_are_not_cached(db):
+    gb_filter = create_filter_from_description([{'filter': 'equals', 'args': ['location', 'GB']},
+                                                {'filter': 'contains', 'args': ['name', 'coal']}])
+    assert codes(w.get_many(db, *gb_filter)) == ['code_0']
+
+    assert len(db.cache) == 0
+    assert db.cache_info().misses == 0
+
+
+def test_edit_without_reindex_drops_stale_entry(db, gb_filter):
+    assert codes(w.get_many(db, *gb_filter)) == ['code_0']
+
+    db[0]['location'] = 'DE'
+
+    assert codes(w.get_many(db, *gb_filter)) == []
+    assert db.cache_info().invalidations == 1
+
+
+def test_edit_that_starts_matching_drops_entry(db):
+    de_filter = create_filter_from_description([{'filter': 'startswith', 'args': ['location', 'D']}])
+    assert codes(w.get_many(db, *de_filter)) == ['code_1']
+
+    db[0]['location'] = 'DE'
+
+    assert codes(w.get_many(db, *de_filter)) == ['code_0', 'code_1']
+
+
+def test_hits_and_unrelated_edits_dont_rerun_filters(db, gb_filter):
+    calls = []
+    counted = WurstFilter(lambda ds: calls.append(ds['code']) or ds['location'] == 'GB')
+    counted.description = {'filter': 'equals', 'args': ['location', 'GB']}
+    key = canonical_key([counted, *gb_filter])
+
+    db.cache.put(key, db, [counted, *gb_filter], [db[0]])
+    db[1]['exchanges'] = []
+    db[2]['unit'] = 'megajoule'
+
+    assert db.cache.get(key, db) == [db[0]]
+    assert calls == []
@@ -0,0 +1,36 @@
+from futura.cli import main, output_path
+
+import json
+import os
+import subprocess
+import sys
+
+
+def run_cli(capsys, *argv):
+    code = main(list(argv))
+    out = capsys.readouterr().out
+    return code, [json.loads(line) for line in out.splitlines()]
+
+
+def test_progress_is_json_lines(tmpdir, capsys):
+    recipe = tmpdir.join('empty.yml')
+    recipe.write("metadata: {}\nactions: []\n")
+
+    code, events = run_cli(capsys, str(recipe), str(tmpdir.join('missing.yml')), '--keep-going')
+
+    assert code == 1
+    assert [x['event'] for x in events] == ['recipe_started', 'recipe_finished', 'recipe_failed']
+    assert events[0]['actions'] == 0
+    assert events[1]['datasets'] == 0
+    assert events[2]['recipe'].endswith('missing.yml')
+
+
+def test_output_path():
+    assert output_path('recipes/steel.yml', fdb_dir='out') == os.path.join('out', 'steel.fdb')
+    assert output_path('recipes/steel.yml', fdb='steel.fdb') == 'steel.fdb'
+    assert output_path('recipes/steel.yml') is None
+
+
+def test_cli_does_not_import_qt():
+    code = "import sys, futura.cli; sys.exit('PySide2' in sys.modules)"
+    assert subprocess.run([sys.executable, '-c', code], capture_output=True).returncode == 0
@@ -0,0 +1,226 @@
+from futura.container import ContainerReader, write_container, write_delta_container, is_container, fetch_dataset
+from futura.compression import CODECS, benchmark_codecs
+from futura.loader import FuturaLoader
+from futura.proxy import WurstDatabase
+from futura.wrappers import FuturaDatabase
+
+import os
+import pickle
+import pytest
+import zlib
+
+
+@pytest.fixture
+def make_database(make_dataset):
+
+    def make_database(count=10):
+        database = FuturaDatabase()
+        database.database_names = ['test_db']
+        database.db.extend(make_dataset(n) for n in range(count))
+        return database
+
+    return make_database
+
+
+def test_container_round_trip(tmpdir, make_dataset):
+    path = str(tmpdir.join('test.fdb'))
+    datasets = [make_dataset(n) for n in range(10)] + [make_dataset(0, database='other_db')]
+
+    write_container(path, datasets, state={'a': 1}, header={'kind': 'test'}, chunk_size=3)
+
+    assert is_container(path)
+    assert not os.path.exists(path + '.tmp')
+
+    with ContainerReader(path) as reader:
+        assert reader.header['kind'] == 'test'
+        assert len(reader.index['chunks']) == 4
+        assert list(reader) == datasets
+        assert reader.state() == {'a': 1}
+        assert reader.fetch('code_7') == datasets[7]
+        assert reader.fetch('code_0', 'other_db') == datasets[-1]
+
+    assert fetch_dataset(path, 'code_4') == datasets[4]
+
+
+def test_database_save_and_load(tmpdir, make_database):
+    database = make_database()
+    database.save(str(tmpdir), 'test.fdb')
+
+    loaded = FuturaDatabase()
+    loaded.load(str(tmpdir.join('test.fdb')))
+
+    assert is_container(str(tmpdir.join('test.fdb')))
+    assert list(loaded.db) == list(database.db)
+    assert loaded.database_names == ['test_db']
+    assert isinstance(loaded.db, WurstDatabase)
+
+
+def test_legacy_files_still_load(tmpdir, make_database):
+    database = make_database()
+    path = str(tmpdir.join('legacy.fdb'))
+    with open(path, 'wb') as f:
+        f.write(zlib.compress(pickle.dumps(database)))
+
+    assert not is_container(path)
+
+    loaded = FuturaDatabase()
+    loaded.load(path)
+    assert list(loaded.db) == list(database.db)
+
+
+def test_loader_save_and_load(tmpdir, make_database):
+    loader = FuturaLoader()
+    loader.recipe = {'metadata': {'output_database': 'test'}, 'actions': []}
+    loader.database = make_database()
+
+    path = str(tmpdir.join('test.fl'))
+    loader.save(path)
+
+    loaded = FuturaLoader()
+    loaded.load(path)
+
+    assert loaded.recipe == loader.recipe
+    assert list(loaded.database.db) == list(loader.database.db)
+    assert loaded.database.database_names == ['test_db']
+
+
+@pytest.mark.parametrize('codec', sorted(CODECS))
+def test_codecs_round_trip(tmpdir, codec, make_database):
+    database = make_database(25)
+    database.save(str(tmpdir), 'test.fdb', codec=codec, threads=2)
+
+    with ContainerReader(str(tmpdir.join('test.fdb')), threads=3) as reader:
+        assert reader.header['codec'] == codec
+
+    loaded = FuturaDatabase()
+    loaded.load(str(tmpdir.join('test.fdb')))
+    assert list(loaded.db) == list(database.db)
+
+
+def test_missing_codec(tmpdir):
+    with pytest.raises(ValueError):
+        write_container(str(tmpdir.join('test.fdb')), [], codec='brotli')
+
+
+def test_benchmark_codecs(make_database):
+    results = benchmark_codecs(make_database(25), codecs=['zlib'])
+    assert [x['codec'] for x in results] == ['zlib']
+    assert results[0]['size'] > 0
+
+
+def test_delta_save(tmpdir, make_dataset, make_database):
+    base = make_database(30)
+    base.save(str(tmpdir), 'base.fdb')
+
+    loader = FuturaLoader()
+    loader.recipe = {'metadata': {}, 'actions': []}
+    loader.database = FuturaDatabase()
+    loader.database.load(str(tmpdir.join('base.fdb')))
+
+    db = loader.database.db
+    db[3]['location'] = 'GB'
+    del db[10]
+    db.append(make_dataset(100))
+
+    loader.save(str(tmpdir.join('scenario.fl')), base=str(tmpdir.join('base.fdb')))
+
+    with ContainerReader(str(tmpdir.join('scenario.fl'))) as reader:
+        assert [code for _, code in reader.codes()] == ['code_3', 'code_100']
+        assert reader.fetch('code_3')['location'] == 'GB'
+        assert reader.fetch('code_4') == base.db[4]
+        with pytest.raises(AssertionError):
+            reader.fetch('code_10')
+
+    # the base can be found next to the delta once it's moved
+    moved = tmpdir.mkdir('moved')
+    tmpdir.join('base.fdb').move(moved.join('base.fdb'))
+    tmpdir.join('scenario.fl').move(moved.join('scenario.fl'))
+
+    loaded = FuturaLoader()
+    loaded.load(str(moved.join('scenario.fl')))
+    assert list(loaded.database.db) == list(db)
+
+    with pytest.raises(FileNotFoundError):
+        moved.join('base.fdb').remove()
+        FuturaLoader().load(str(moved.join('scenario.fl')))
+
+
+def test_delta_datasets_read_each_base_chunk_once(tmpdir, monkeypatch, make_dataset):
+    base_path = str(tmpdir.join('base.fdb'))
+    datasets = [make_dataset(n) for n in range(20)]
+    write_container(base_path, datasets, chunk_size=5)
+
+    datasets[7] = make_dataset(7, location='GB')
+    del datasets[12]
+    datasets.append(make_dataset(100))
+    path = str(tmpdir.join('delta.fl'))
+    write_delta_container(path, datasets, base_path, chunk_size=5)
+
+    with ContainerReader(base_path) as base:
+        base_chunks = {offset for offset, _, _ in base.index['chunks']}
+
+    reads = []
+    read = ContainerReader._read
+
+    def counting_read(self, offset, length):
+        if self.path == base_path and offset in base_chunks:
+            reads.append(offset)
+        return read(self, offset, length)
+
+    monkeypatch.setattr(ContainerReader, '_read', counting_read)
+
+    with ContainerReader(path) as reader:
+        assert list(reader.datasets()) == datasets
+        assert reader.fetch('code_3') == datasets[3]
+        with pytest.raises(AssertionError):
+            reader.fetch('code_12')
+
+    assert sorted(reads[:4]) == sorted(base_chunks)
+    assert len(reads) == 5
+
+
+def test_delta_reordered_across_base_chunks(tmpdir, make_dataset):
+    base_path = str(tmpdir.join('base.fdb'))
+    base = [make_dataset(n) for n in range(12)]
+    write_container(base_path, base, chunk_size=4)
+
+    # reversed, so every base chunk is visited twice, with a dataset removed from each chunk and one changed
+    datasets = [ds for ds in reversed(base) if ds['code'] not in ('code_1', 'code_6', 'code_11')]
+    datasets[3] = make_dataset(7, location='FR')
+    datasets.insert(2, make_dataset(50))
+
+    path = str(tmpdir.join('delta.fl'))
+    write_delta_container(path, datasets, base_path, chunk_size=3)
+
+    with ContainerReader(path) as reader:
+        assert [code for _, code in reader.codes()] == ['code_50', 'code_7']
+        assert reader.index['order'] == [-11, -10, 0, -9, 1, -6, -5, -4, -3, -1]
+        assert list(reader.datasets()) == datasets
+        assert reader.fetch('code_7')['location'] == 'FR'
+        assert reader.fetch('code_0') == base[0]
+        for code in ('code_1', 'code_6', 'code_11'):
+            with pytest.raises(AssertionError):
+                reader.fetch(code)
+
+
+def test_peek(tmpdir, make_database):
+    loader = FuturaLoader()
+    loader.recipe = {'metadata': {'output_database': 'test'}, 'actions': []}
+    loader.database = make_database(12)
+
+    path = str(tmpdir.join('test.fl'))
+    loader.save(path)
+
+    header = FuturaLoader.peek(path)
+
+    assert header['kind'] == 'loader'
+    assert header['recipe'] == loader.recipe
+    assert header['database_names'] == ['test_db']
+    assert header['datasets'] == {'test_db': 12}
+    assert header['dataset_count'] == 12
+    assert 'created' in header
+
+    legacy_path = str(tmpdir.join('legacy.fl'))
+    with open(legacy_path, 'wb') as f:
+        f.write(zlib.compress(pickle.dumps(loader.database)))
+    assert FuturaLoader.peek(legacy_path) == {'format': 0, 'kind': 'legacy'}
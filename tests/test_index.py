@@ -0,0 +1,200 @@
+from futura import w
+from futura.index import DatabaseIndex
+from futura.proxy import WurstDatabase, WurstDataset
+from futura.utils import create_filter_from_description
+
+from copy import deepcopy
+import pickle
+import pytest
+
+
+@pytest.fixture
+def db(make_dataset):
+    names = ['electricity production, hard coal', 'electricity production, lignite',
+             'market for electricity, high voltage']
+    locations = ['GB', 'DE', 'FR', 'RoW']
+    datasets = [make_dataset(n, name, location)
+                for n, (name, location) in enumerate((x, y) for x in names for y in locations)]
+    return WurstDatabase(datasets)
+
+
+def scan(db, *funcs):
+    data = list(db)
+    for f in funcs:
+        data = [x for x in data if f(x)]
+    return data
+
+
+def test_equals_lookup_matches_scan(db):
+    description = [{'filter': 'equals', 'args': ['location', 'GB']},
+                   {'filter': 'contains', 'args': ['name', 'coal']}]
+    this_filter = create_filter_from_description(description)
+
+    assert this_filter.plan(db).lookup == "location == 'GB'"
+    assert list(w.get_many(db, *this_filter)) == scan(db, *this_filter)
+    assert w.get_one(db, *this_filter)['code'] == 'code_0'
+
+
+def test_composite_lookup(db):
+    found = w.get_one(db, w.equals('database', 'test_db'), w.equals('code', 'code_5'))
+    assert found['location'] == 'DE'
+
+
+def test_index_follows_append_and_extend(db, make_dataset):
+    _ = db.index
+    db.append(make_dataset(100, 'electricity production, hard coal', 'GB'))
+    db.extend([make_dataset(101, 'electricity production, hard coal', 'GB')])
+
+    result = list(w.get_many(db, w.equals('location', 'GB'), w.equals('name', 'electricity production, hard coal')))
+
+    assert [x['code'] for x in result] == ['code_0', 'code_100', 'code_101']
+
+
+def test_reindex_after_in_place_change(db):
+    _ = db.index
+    ds = db[1]
+    ds['location'] = 'GB'
+    db.reindex(ds)
+
+    assert [x['code'] for x in w.get_many(db, w.equals('location', 'GB'))] == ['code_0', 'code_1', 'code_4', 'code_8']
+
+
+def test_index_follows_in_place_changes(db):
+    _ = db.index
+    db[3]['location'] = 'NEW'
+
+    assert [x['code'] for x in w.get_many(db, w.equals('location', 'NEW'))] == ['code_3']
+    assert [x['code'] for x in w.get_many(db, w.equals('location', 'RoW'))] == ['code_7', 'code_11']
+
+    db[1].update(location='GB', name='heat')
+    db[3].pop('location')
+    del db[5]['location']
+
+    assert [x['code'] for x in w.get_many(db, w.equals('location', 'GB'))] == ['code_0', 'code_1', 'code_4', 'code_8']
+    assert [x['code'] for x in w.get_many(db, w.equals('name', 'heat'))] == ['code_1']
+    assert [x['code'] for x in w.get_many(db, w.equals('location', None))] == ['code_3', 'code_5']
+    for key, bucket in db.index.tables.items():
+        for value, datasets in bucket.items():
+            assert datasets == scan(db, lambda x: DatabaseIndex.value_of(x, key) == value)
+
+
+def test_datasets_are_tracked_copies(db, make_dataset):
+    ds = make_dataset(100, location='GB')
+    db.append(ds)
+
+    assert isinstance(db[-1], WurstDataset) and db[-1] == ds
+    assert type(pickle.loads(pickle.dumps(db[-1]))) is dict
+    assert type(deepcopy(db[-1])) is dict
+
+    # a dataset taken out of the database doesn't come back into its index when it's changed
+    _ = db.index
+    removed = db.pop()
+    removed['location'] = 'FR'
+    assert [x['code'] for x in w.get_many(db, w.equals('location', 'FR'))] == ['code_2', 'code_6', 'code_10']
+
+
+def test_plan_reads_only_the_bucket_it_uses(db, monkeypatch):
+    read = []
+    lookup = DatabaseIndex.lookup
+
+    def counting_lookup(index, key, value):
+        read.append(key)
+        return lookup(index, key, value)
+
+    monkeypatch.setattr(DatabaseIndex, 'lookup', counting_lookup)
+
+    assert w.get_one(db, w.equals('database', 'test_db'), w.equals('code', 'code_5'))['code'] == 'code_5'
+    assert len(read) == 1
+
+
+def test_other_list_changes_rebuild_index(db):
+    _ = db.index
+    del db[0]
+
+    assert [x['code'] for x in w.get_many(db, w.equals('location', 'GB'))] == ['code_4', 'code_8']
+
+
+def test_pickle_drops_index(db):
+    _ = db.index
+    loaded = pickle.loads(pickle.dumps(db))
+
+    assert isinstance(loaded, WurstDatabase)
+    assert loaded.__dict__.get('_index') is None
+    assert loaded == db
+
+
+def test_plan_uses_most_selective_lookup(db):
+    description = [{'filter': 'equals', 'args': ['unit', 'kilowatt hour']},
+                   {'filter': 'startswith', 'args': ['name', 'market']},
+                   {'filter': 'contains', 'args': ['name', 'high']},
+                   {'filter': 'equals', 'args': ['location', 'GB']}]
+    this_filter = create_filter_from_description(description)
+
+    plan = this_filter.plan(db)
+
+    assert plan.lookup == "location == 'GB'"
+    assert plan.estimated_rows == 3
+    assert [x['code'] for x in plan.execute()] == [x['code'] for x in scan(db, *this_filter)] == ['code_8']
+    assert "lookup location == 'GB'" in this_filter.explain(db)
+
+
+def test_plan_matches_scan_for_compound_filters(db):
+    description = [{'filter': 'exclude', 'args': [{'filter': 'equals', 'args': ['location', 'RoW']}]},
+                   {'filter': 'either', 'args': [{'filter': 'equals', 'args': ['location', 'GB']},
+                                                 {'filter': 'equals', 'args': ['location', 'DE']}]},
+                   {'filter': 'doesnt_contain_any', 'args': ['name', ['market', 'lignite']]}]
+    this_filter = create_filter_from_description(description)
+
+    assert this_filter.plan(db).lookup == "location in ('GB', 'DE')"
+    assert list(w.get_many(db, *this_filter)) == scan(db, *this_filter)
+
+
+def test_plan_on_plain_list_scans(db):
+    this_filter = create_filter_from_description([{'filter': 'equals', 'args': ['location', 'FR']}])
+    plan = this_filter.plan(list(db))
+
+    assert plan.lookup is None
+    assert list(plan.execute()) == scan(db, *this_filter)
+
+
+def test_text_index_collapses_case_variants(db):
+    db.enable_text_index()
+    description = [{'filter': 'either', 'args': [{'filter': 'contains', 'args': ['name', 'Hard coal']},
+                                                 {'filter': 'contains', 'args': ['name', 'hard coal']}]}]
+    this_filter = create_filter_from_description(description)
+
+    plan = this_filter.plan(db)
+
+    assert plan.lookup == "name ~ ('hard coal')"
+    assert plan.estimated_rows == 4
+    assert list(plan.execute()) == scan(db, *this_filter)
+
+
+def test_text_index_follows_changes(db, make_dataset):
+    db.enable_text_index()
+    this_filter = create_filter_from_description([{'filter': 'startswith', 'args': ['name', 'market for heat']}])
+
+    assert list(w.get_many(db, *this_filter)) == []
+
+    db.append(make_dataset(100, 'market for heat, district', 'GB'))
+
+    assert [x['code'] for x in w.get_many(db, *this_filter)] == ['code_100']
+
+
+def test_short_text_falls_back_to_scan(db):
+    db.enable_text_index()
+    this_filter = create_filter_from_description([{'filter': 'contains', 'args': ['name', 'e']}])
+
+    assert this_filter.plan(db).lookup is None
+    assert list(w.get_many(db, *this_filter)) == scan(db, *this_filter)
+
+
+def test_non_string_text_terms_fall_back_to_scan(db):
+    db.enable_text_index()
+    this_filter = create_filter_from_description([{'filter': 'either', 'args': [
+        {'filter': 'startswith', 'args': ['name', 'electricity production, hard']},
+        {'filter': 'startswith', 'args': ['name', ('market for', 'heat')]}]}])
+
+    assert this_filter.plan(db).lookup is None
+    assert list(w.get_many(db, *this_filter)) == scan(db, *this_filter)
+    assert len(scan(db, *this_filter)) == 8
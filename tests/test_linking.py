@@ -0,0 +1,83 @@
+from futura.linking import ExchangeLinker
+from bw2io.errors import StrategyError
+from bw2io.strategies.generic import link_iterable_by_fields
+
+from copy import deepcopy
+import pytest
+
+
+def make_dataset(code, name, location, product=None):
+    return {'database': 'background', 'code': code, 'name': name, 'location': location, 'unit': 'kilogram',
+            'reference product': product or name}
+
+
+def make_exchange(name, location, product=None):
+    exc = {'name': name, 'location': location, 'unit': 'kilogram', 'type': 'technosphere', 'amount': 1}
+    if product:
+        exc['reference product'] = product
+    return exc
+
+
+@pytest.fixture
+def background():
+    return [make_dataset('steel_gb', 'steel production', 'GB', 'steel'),
+            make_dataset('steel_row', 'steel production', 'RoW', 'steel'),
+            make_dataset('copper_row', 'copper production', 'RoW'),
+            make_dataset('glass_glo', 'glass production', 'GLO'),
+            make_dataset('plastic', 'plastic production', 'GLO')]
+
+
+@pytest.fixture
+def data():
+    return [{'name': 'car', 'exchanges': [make_exchange('steel production', 'GB', 'steel'),
+                                          make_exchange('steel production', 'DE'),
+                                          make_exchange('copper production', 'GLO'),
+                                          make_exchange('glass production, float', 'GLO'),
+                                          make_exchange('plastic production, moulded, at plant', 'GLO'),
+                                          make_exchange('rubber production', 'GLO'),
+                                          dict(make_exchange('electricity', 'GB'), input=('other', 'electricity'))]}]
+
+
+def link_one_by_one(data, background):
+    # the steps extract_excel_data used to take with link_iterable_by_fields
+    def unlinked_exchanges():
+        return [exc for x in data for exc in x['exchanges'] if not exc.get('input')]
+
+    link_iterable_by_fields(data, background, fields=['reference product', 'name', 'unit', 'location'])
+    link_iterable_by_fields(data, background, fields=['name', 'unit', 'location'])
+    for exc in unlinked_exchanges():
+        if exc.get('location') == 'GLO':
+            exc['location'] = 'RoW'
+    link_iterable_by_fields(data, background, fields=['name', 'unit', 'location'])
+    for i in range(2):
+        for exc in unlinked_exchanges():
+            if exc['name'].rfind(',') != -1:
+                exc['name'] = exc['name'][:exc['name'].rfind(',')]
+        link_iterable_by_fields(data, background, fields=['name', 'unit', 'location'])
+    for exc in unlinked_exchanges():
+        if exc.get('location') == 'RoW':
+            exc['location'] = 'GLO'
+    link_iterable_by_fields(data, background, fields=['name', 'unit', 'location'])
+    return data
+
+
+def test_cascade_matches_link_iterable_by_fields(background, data):
+    expected = link_one_by_one(deepcopy(data), background)
+
+    linker = ExchangeLinker(background)
+    summary = linker.link_cascade(data)
+
+    assert data == expected
+    assert [(exc['name'], rule) for _, exc, rule in linker.links] == [('steel production', 'reference product'),
+                                                                      ('copper production', 'GLO to RoW'),
+                                                                      ('glass production', 'RoW to GLO'),
+                                                                      ('plastic production', 'RoW to GLO')]
+    assert summary['RoW to GLO'] == 2
+    assert not data[0]['exchanges'][1].get('input')
+
+
+def test_duplicate_background_datasets(background, data):
+    background.append(make_dataset('steel_gb_2', 'steel production', 'GB', 'steel'))
+
+    with pytest.raises(StrategyError):
+        ExchangeLinker(background).link_cascade(data)
@@ -0,0 +1,255 @@
+from futura.recipe import FuturaRecipeExecutor
+from futura.plugin_loader import loaded_plugins
+from futura.recipe_cache import RecipeStepCache, recipe_fingerprints, database_fingerprint
+from futura.checkpoint import RecipeCheckpoint
+from futura.wrappers import FuturaDatabase
+
+from copy import deepcopy
+from types import SimpleNamespace
+import os
+import pytest
+
+
+def make_market(n):
+    return SimpleNamespace(add_alternative_exchanges=lambda: n, set_pv=lambda: n, transfer_pv=lambda: n,
+                           relink=lambda: n)
+
+
+def test_actions_are_built_once():
+    loader = SimpleNamespace(database=FuturaDatabase())
+    executor = FuturaRecipeExecutor(loader)
+
+    actions = executor.actions
+    assert executor.actions is actions
+    assert actions['alter_market']['set_pv'] is None
+    assert actions['load']['extract_excel_data'] == loader.database.extract_excel_data
+
+    executor.market = make_market(1)
+    assert executor.actions['alter_market']['set_pv']() == 1
+
+    executor.market = make_market(2)
+    assert executor.actions['alter_market']['relink']() == 2
+
+    loader.database = FuturaDatabase()
+    assert executor.actions['load']['extract_excel_data'] == loader.database.extract_excel_data
+    assert executor.actions is actions
+
+
+def test_plugins_are_loaded_once_per_process():
+    FuturaRecipeExecutor(None).actions
+    hits = loaded_plugins.cache_info().hits
+
+    FuturaRecipeExecutor(None).actions
+
+    assert loaded_plugins.cache_info().hits == hits + 1
+
+
+def run_with_cache(recipe, step_cache, calls):
+    loader = SimpleNamespace(database=FuturaDatabase(), recipe=recipe)
+    executor = FuturaRecipeExecutor(loader, step_cache=step_cache)
+
+    def add(code):
+        calls.append(code)
+        loader.database.db.append({'database': 'test_db', 'code': code, 'location': 'GLO'})
+
+    executor.actions['test'] = {'add': add}
+    messages = [x['message'] for x in executor.recipe_generator()]
+
+    return loader, messages
+
+
+def test_step_cache_resumes_from_longest_prefix(tmpdir, make_recipe):
+    step_cache = RecipeStepCache(str(tmpdir), min_seconds=0)
+
+    calls = []
+    run_with_cache(make_recipe('a', 'b'), step_cache, calls)
+    assert calls == ['a', 'b']
+
+    calls = []
+    loader, messages = run_with_cache(make_recipe('a', 'c'), step_cache, calls)
+
+    assert calls == ['c']
+    assert messages[:2] == ['test loaded from cache', 'test finished']
+    assert [x['code'] for x in loader.database.db] == ['a', 'c']
+
+
+def test_step_cache_fingerprints_files(tmpdir, make_recipe):
+    technology_file = tmpdir.join('technology.xlsx')
+    technology_file.write('v1')
+    recipe = make_recipe(str(technology_file))
+
+    first = recipe_fingerprints(FuturaDatabase(), recipe)
+    technology_file.write('v2')
+
+    assert recipe_fingerprints(FuturaDatabase(), recipe)[0] == first[0]
+    assert recipe_fingerprints(FuturaDatabase(), recipe)[1] != first[1]
+
+
+class BrightwayTestDatabase(FuturaDatabase):
+
+    def extract_bw2_database(self, project_name, database_name, use_store=False):
+        self.database_names.append(database_name)
+        self.used_store = use_store
+
+
+def test_step_cache_misses_after_brightway_write(tmpdir, make_recipe):
+    brightway = {'ecoinvent': ['2020-01-01T00:00:00', 10]}
+    step_cache = RecipeStepCache(str(tmpdir), min_seconds=0,
+                                 state=lambda project_name, database_names: [[x] + brightway[x] for x in database_names])
+
+    recipe = make_recipe('a')
+    recipe['actions'].insert(0, {'action': 'load', 'tasks': [{'function': 'extract_bw2_database',
+                                                              'kwargs': {'project_name': 'test',
+                                                                         'database_name': 'ecoinvent'}}]})
+
+    def run():
+        loader = SimpleNamespace(database=BrightwayTestDatabase(), recipe=deepcopy(recipe))
+        executor = FuturaRecipeExecutor(loader, step_cache=step_cache)
+        executor.actions['test'] = {'add': lambda code: None}
+        return [x['action'] for x in executor.recipe_generator() if x['status'] == 'started']
+
+    assert run() == ['load', 'test']
+    assert run() == []
+
+    brightway['ecoinvent'] = ['2020-02-01T00:00:00', 10]
+    assert run() == ['load', 'test']
+
+
+def test_step_cache_fingerprints_saved_databases_by_content(tmpdir, make_recipe, make_dataset):
+    database = FuturaDatabase()
+    database.database_names = ['test_db']
+    database.db.extend(make_dataset(n) for n in range(3))
+    database.save(str(tmpdir), 'input.fdb')
+    recipe = make_recipe(str(tmpdir.join('input.fdb')))
+
+    first = recipe_fingerprints(FuturaDatabase(), recipe)
+    database.save(str(tmpdir), 'input.fdb')
+    assert recipe_fingerprints(FuturaDatabase(), recipe) == first
+
+    database.db[1]['location'] = 'GB'
+    database.save(str(tmpdir), 'input.fdb')
+    assert recipe_fingerprints(FuturaDatabase(), recipe)[1] != first[1]
+
+
+def test_database_fingerprint_covers_exchanges(make_dataset):
+    database = FuturaDatabase()
+    database.db.append(make_dataset(0))
+    first = database_fingerprint(database)
+
+    database.db[0]['exchanges'][0]['amount'] = 2
+
+    assert database_fingerprint(database) != first
+
+
+def test_checkpoint_resumes_after_failure(tmpdir, make_recipe):
+    recipe = make_recipe('a', 'b', 'c')
+    calls = []
+
+    def run(fail_on=None, resume=False):
+        loader = SimpleNamespace(database=FuturaDatabase(), recipe=recipe)
+        executor = FuturaRecipeExecutor(loader, checkpoint=RecipeCheckpoint(str(tmpdir)))
+
+        def add(code):
+            if code == fail_on:
+                raise RuntimeError(code)
+            calls.append(code)
+            loader.database.db.append({'database': 'test_db', 'code': code, 'location': 'GLO'})
+
+        executor.actions['test'] = {'add': add}
+        messages = [x['message'] for x in executor.recipe_generator(resume=resume)]
+        return loader, executor, messages
+
+    with pytest.raises(RuntimeError):
+        run(fail_on='c')
+    assert calls == ['a', 'b']
+
+    calls.clear()
+    loader, executor, messages = run(resume=True)
+
+    assert calls == ['c']
+    assert messages[:2] == ['test loaded from checkpoint', 'test finished']
+    assert [x['code'] for x in loader.database.db] == ['a', 'b', 'c']
+    assert not os.path.exists(executor.checkpoint.path)
+    assert executor.checkpoint._writer is None
+
+
+def test_checkpoint_killed_before_state_update_keeps_last_snapshot(tmpdir, monkeypatch, make_dataset):
+    checkpoint = RecipeCheckpoint(str(tmpdir))
+    checkpoint.attach(['start', 'a', 'b', 'c'])
+
+    database = FuturaDatabase()
+    database.db.append(make_dataset(1))
+    checkpoint.save(1, database)
+    checkpoint.wait()
+
+    replace = os.replace
+
+    def killed_before_state(src, dst):
+        if dst == checkpoint.state_file:
+            raise KeyboardInterrupt
+        replace(src, dst)
+
+    # the second snapshot is on disk, but the run dies before the state file says so
+    monkeypatch.setattr(os, 'replace', killed_before_state)
+    database.db.append(make_dataset(2))
+    checkpoint.save(2, database)
+    with pytest.raises(KeyboardInterrupt):
+        checkpoint.close()
+    monkeypatch.undo()
+
+    resumed = RecipeCheckpoint(str(tmpdir))
+    resumed.attach(['start', 'a', 'b', 'c'])
+    completed, loaded = resumed.load()
+
+    assert completed == 1
+    assert [x['code'] for x in loaded.db] == ['code_1']
+
+
+class BrokenCheckpoint(RecipeCheckpoint):
+
+    def _write(self, completed, data):
+        raise OSError("disk full")
+
+
+def test_checkpoint_error_does_not_hide_action_error(tmpdir, make_recipe):
+    loader = SimpleNamespace(database=FuturaDatabase(), recipe=make_recipe('a', 'b'))
+    checkpoint = BrokenCheckpoint(str(tmpdir))
+    executor = FuturaRecipeExecutor(loader, checkpoint=checkpoint)
+
+    def add(code):
+        if code == 'b':
+            raise RuntimeError(code)
+
+    executor.actions['test'] = {'add': add}
+
+    with pytest.raises(RuntimeError):
+        list(executor.recipe_generator())
+    assert checkpoint._writer is None
+
+
+def test_generator_reports_steps_and_task_timings(make_recipe):
+    loader = SimpleNamespace(database=FuturaDatabase(), recipe=make_recipe('a', 'b'))
+    timings = []
+    executor = FuturaRecipeExecutor(loader, task_callback=lambda action, task, seconds: timings.append(
+        (task['kwargs']['code'], seconds)))
+    executor.actions['test'] = {'add': lambda code: None}
+
+    items = list(executor.recipe_generator())
+
+    assert [(x['step'], x['status']) for x in items] == [(1, 'started'), (1, 'finished'), (2, 'started'),
+                                                         (2, 'finished')]
+    assert [code for code, _ in timings] == ['a', 'b']
+    assert all(x['seconds'] >= 0 for x in items if x['status'] == 'finished')
+
+
+@pytest.mark.parametrize('base_store', [False, True])
+def test_base_store_is_opt_in(base_store, monkeypatch):
+    monkeypatch.setattr('futura.recipe.check_database', lambda project_name, database_name: True)
+    recipe = {'metadata': {}, 'actions': [{'action': 'load', 'tasks': [
+        {'function': 'extract_bw2_database', 'kwargs': {'project_name': 'test', 'database_name': 'ecoinvent'}}]}]}
+    loader = SimpleNamespace(database=BrightwayTestDatabase(), recipe=recipe)
+
+    executor = FuturaRecipeExecutor(loader, base_store=base_store)
+    executor.execute_recipe_action(recipe['actions'][0])
+
+    assert loader.database.used_store is base_store
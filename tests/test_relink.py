@@ -0,0 +1,366 @@
+from futura import w
+from futura.proxy import WurstDatabase
+from futura.wurst_monkeypatch import get_possibles, relink_technosphere_exchanges, relink_many, TechnosphereRelinker, \
+    new_exchange
+from futura.technology import regionalise_multiple_processes
+from futura.regionalisation import create_regional_activities
+from futura.wrappers import FuturaDatabase
+from futura.geo import LocationResolver, Topology
+from futura.journal import ChangeJournal, ListSink, journal
+from wurst.errors import InvalidLink
+from wurst.geo import geomatcher
+from wurst.transformations.uncertainty import rescale_exchange
+from constructive_geometries import resolved_row
+
+from copy import deepcopy
+import logging
+import os
+import pytest
+
+
+@pytest.fixture
+def make_consumer(make_dataset):
+
+    def make_consumer(location):
+        return make_dataset('consumer_{}'.format(location), 'aluminium production', location, product='aluminium',
+                            unit='kilogram',
+                            inputs=[{'name': 'market for electricity', 'product': 'electricity', 'unit': 'kilowatt hour',
+                                     'location': 'GLO', 'amount': 10, 'uncertainty type': 2, 'loc': 2.3,
+                                     'scale': 0.1}])
+
+    return make_consumer
+
+
+def baseline_get_possibles(exchange, data):
+    # get_possibles as it was before the index, kept here as the reference for the relinking tests
+    market_name = exchange['name']
+    if market_name.startswith('market group'):
+        market_name = 'market' + market_name[len('market group'):]
+
+    if market_name != exchange['name']:
+        key = (market_name, exchange['product'], exchange['unit'])
+        for ds in data:
+            if (ds['name'], ds['reference product'], ds['unit']) == key:
+                yield ds
+
+    key = (exchange['name'], exchange['product'], exchange['unit'])
+    for ds in data:
+        if (ds['name'], ds.get('reference product'), ds['unit']) == key:
+            yield ds
+
+
+def baseline_allocate_inputs(exc, lst):
+    has_row = any((x['location'] in ('RoW', 'GLO') for x in lst))
+    pvs = [w.reference_product(o).get('production volume') or 0 for o in lst]
+    if all((x > 0 for x in pvs)) and not has_row:
+        total = sum(pvs)
+    else:
+        total = len(lst)
+        pvs = [1 for _ in range(total)]
+
+    def new_exchange(exc, obj, factor):
+        cp = deepcopy(exc)
+        cp['name'] = obj['name']
+        cp['location'] = obj['location']
+        return rescale_exchange(cp, factor)
+
+    return [new_exchange(exc, obj, factor / total) for obj, factor in zip(lst, pvs)]
+
+
+def baseline_relink(ds, data, exclusive=True, drop_invalid=False, keep_invalid=False, biggest_first=False,
+                    contained=True, exclude=None):
+    """
+    relink_technosphere_exchanges as it was before the relinker (without the logging), the reference the new code
+    has to match
+    """
+    new_exchanges = []
+
+    for exc in filter(lambda x: x['type'] == 'technosphere', ds['exchanges']):
+        possible_datasets = list(baseline_get_possibles(exc, data))
+        possible_locations = [obj['location'] for obj in possible_datasets]
+        if exclude:
+            possible_locations = [x for x in possible_locations if x not in exclude]
+        with resolved_row(possible_locations, geomatcher) as g:
+            func = g.contained if contained else g.intersects
+            gis_match = func(ds['location'], include_self=True, exclusive=exclusive,
+                             biggest_first=biggest_first, only=possible_locations)
+
+        kept = [obj for loc in gis_match for obj in possible_datasets if obj['location'] == loc]
+
+        if kept:
+            with resolved_row(possible_locations, geomatcher) as g:
+                missing_faces = geomatcher[ds['location']].difference(
+                    set.union(*[geomatcher[obj['location']] for obj in kept])
+                )
+            if missing_faces and "RoW" in possible_locations:
+                kept.extend([obj for obj in possible_datasets if obj['location'] == 'RoW'])
+        elif 'RoW' in possible_locations:
+            kept = [obj for obj in possible_datasets if obj['location'] == 'RoW']
+
+        if not kept and "GLO" in possible_locations:
+            kept = [obj for obj in possible_datasets if obj['location'] == 'GLO']
+
+        if not kept:
+            if drop_invalid:
+                continue
+            elif keep_invalid:
+                # the original passed [exc] through allocate_inputs, which fails as an exchange has no production
+                # exchange of its own, so the exchange is kept as it is
+                new_exchanges.append(exc)
+                continue
+            else:
+                raise InvalidLink
+
+        new_exchanges.extend(baseline_allocate_inputs(exc, kept))
+
+    ds['exchanges'] = [exc for exc in ds['exchanges'] if exc['type'] != 'technosphere'] + new_exchanges
+    return ds
+
+
+@pytest.fixture
+def providers(make_provider):
+    return [make_provider(0, 'market for electricity', 'GB'),
+            make_provider(1, 'market for electricity', 'DE'),
+            make_provider(2, 'market for electricity', 'RoW'),
+            make_provider(3, 'market group for electricity', 'RER'),
+            make_provider(4, 'heat production', 'GB')]
+
+
+def test_get_possibles_uses_index(providers, make_consumer, make_provider):
+    db = WurstDatabase(providers)
+    exchange = make_consumer('GB')['exchanges'][1]
+
+    assert list(get_possibles(exchange, db)) == list(get_possibles(exchange, providers))
+
+    db.append(make_provider(5, 'market for electricity', 'FR'))
+
+    assert [x['location'] for x in get_possibles(exchange, db)] == ['GB', 'DE', 'RoW', 'FR']
+
+
+def test_market_group_providers(providers):
+    db = WurstDatabase(providers)
+    exchange = {'name': 'market group for electricity', 'product': 'electricity', 'unit': 'kilowatt hour'}
+
+    assert [x['location'] for x in get_possibles(exchange, db)] == ['GB', 'DE', 'RoW', 'RER']
+
+
+@pytest.mark.parametrize('location', ['GB', 'FR', 'RER', 'GLO', 'CH'])
+@pytest.mark.parametrize('exclusive', [True, False])
+@pytest.mark.parametrize('contained', [True, False])
+@pytest.mark.parametrize('biggest_first', [True, False])
+def test_relink_matches_baseline(providers, make_consumer, make_provider, location, exclusive, contained,
+                                 biggest_first):
+    providers = providers + [make_provider(5, 'market for electricity', 'FR', pv=30),
+                             make_provider(6, 'market for electricity', 'RER', pv=5)]
+    options = dict(exclusive=exclusive, contained=contained, biggest_first=biggest_first)
+    expected = baseline_relink(make_consumer(location), deepcopy(providers), **options)
+
+    indexed = relink_technosphere_exchanges(make_consumer(location), WurstDatabase(deepcopy(providers)), **options)
+    scanned = relink_technosphere_exchanges(make_consumer(location), deepcopy(providers), **options)
+
+    assert indexed['exchanges'] == expected['exchanges']
+    assert scanned['exchanges'] == expected['exchanges']
+
+
+@pytest.mark.parametrize('options', [{'drop_invalid': True}, {'keep_invalid': True}, {}])
+def test_invalid_links_match_baseline(options, make_consumer, make_provider):
+    providers = [make_provider(0, 'market for electricity', 'GB'), make_provider(1, 'market for electricity', 'DE')]
+    consumer = make_consumer('CN')
+
+    if not options:
+        with pytest.raises(InvalidLink):
+            baseline_relink(deepcopy(consumer), providers)
+        with pytest.raises(InvalidLink):
+            relink_technosphere_exchanges(deepcopy(consumer), WurstDatabase(providers), verbose=False)
+        return
+
+    expected = baseline_relink(deepcopy(consumer), providers, **options)
+    relinked = relink_technosphere_exchanges(deepcopy(consumer), WurstDatabase(providers), verbose=False, **options)
+
+    assert relinked['exchanges'] == expected['exchanges']
+
+
+def test_location_resolver_memoises():
+    resolver = LocationResolver()
+    possible_locations = ['GB', 'DE', 'RoW', 'GB', 'RER']
+
+    first = resolver.resolve('RER', possible_locations, exclusive=True, contained=False)
+    second = resolver.resolve('RER', list(possible_locations), exclusive=True, contained=False)
+
+    assert first == second
+    assert (resolver.hits, resolver.misses) == (1, 1)
+    assert resolver.hit_rate == 0.5
+
+    matched, missing = resolver.resolve('GB', ['DE', 'FR'], contained=True)
+    assert matched == ()
+    assert missing is None
+
+
+def test_topology_round_trip(tmpdir):
+    topology = Topology.cached(directory=str(tmpdir))
+    loaded = Topology.cached(directory=str(tmpdir))
+
+    assert os.path.exists(Topology.cache_path(str(tmpdir)))
+    assert loaded.names == topology.names
+    assert loaded['RER'] == topology['RER']
+    assert loaded.faces_of(loaded['GB']) == frozenset(geomatcher['GB'])
+
+    assert topology.contains('RER', 'GB')
+    assert not topology.contains('GB', 'RER')
+    assert not topology.contains('GLO', 'RoW')
+    assert topology.intersects('RER', 'GB')
+
+
+@pytest.mark.parametrize('location, possible_locations', [('RER', ['GB', 'DE', 'RoW', 'RER']),
+                                                          ('RoW', ['GB', 'US', 'RoW']),
+                                                          ('GLO', ['RER', 'GB', 'FR', 'RoW']),
+                                                          ('CH', ['RER', 'RoW'])])
+@pytest.mark.parametrize('contained', [True, False])
+@pytest.mark.parametrize('biggest_first', [True, False])
+def test_topology_matches_geomatcher(location, possible_locations, contained, biggest_first):
+    with resolved_row(possible_locations, geomatcher) as g:
+        func = g.contained if contained else g.intersects
+        gis_match = func(location, include_self=True, exclusive=True, biggest_first=biggest_first,
+                         only=list(possible_locations))
+        missing_faces = None
+        if gis_match:
+            missing_faces = frozenset(g[location].difference(set.union(*[g[loc] for loc in gis_match])))
+
+    resolved = LocationResolver().resolve(location, possible_locations, contained=contained, biggest_first=biggest_first)
+
+    assert resolved == (tuple(gis_match), missing_faces)
+
+
+def test_relink_many_matches_relink(providers, make_consumer):
+    consumers = [make_consumer(location) for location in ['GB', 'FR', 'RER', 'GB', 'DE']]
+    expected = [baseline_relink(deepcopy(ds), providers, contained=False) for ds in consumers]
+
+    relinker = TechnosphereRelinker(WurstDatabase(deepcopy(providers)), contained=False)
+    relinked = [relinker.relink(ds) for ds in deepcopy(consumers)]
+
+    assert [ds['exchanges'] for ds in relinked] == [ds['exchanges'] for ds in expected]
+    assert len(relinker.groups) == 4
+
+    markets = relink_many(deepcopy(consumers), providers, exclusive=lambda ds: ds['location'] != 'RER', contained=False)
+    assert markets[2]['exchanges'] == baseline_relink(deepcopy(consumers[2]), providers,
+                                                      exclusive=False, contained=False)['exchanges']
+
+
+def test_regionalise_multiple_processes_relinks_database(providers, make_consumer):
+    database = FuturaDatabase()
+    database.db.extend(deepcopy(providers) + [make_consumer('GLO')])
+
+    regionalise_multiple_processes(database, ['GB', 'DE'], [{'filter': 'equals', 'args': ['name', 'aluminium production']}])
+
+    new_datasets = [x for x in database.db if x['name'] == 'aluminium production' and x['location'] != 'GLO']
+    assert [x['location'] for x in new_datasets] == ['GB', 'DE']
+    for ds in new_datasets:
+        assert [e['location'] for e in w.technosphere(ds)] == [ds['location']]
+
+
+def test_relink_many_with_workers(providers, make_consumer):
+    consumers = [make_consumer(location) for location in ['GB', 'FR', 'RER', 'DE'] * 3]
+    db = WurstDatabase(deepcopy(providers))
+
+    serial = relink_many(deepcopy(consumers), db, exclusive=lambda ds: ds['location'] != 'RER', contained=False)
+    parallel = relink_many(deepcopy(consumers), db, exclusive=lambda ds: ds['location'] != 'RER', contained=False,
+                           workers=2)
+
+    assert [ds['exchanges'] for ds in parallel] == [ds['exchanges'] for ds in serial]
+
+
+@pytest.fixture
+def make_market(make_dataset):
+
+    def make_market(location):
+        # markets for electricity take some electricity from the market itself to cover losses
+        return make_dataset('market_{}'.format(location), 'market for electricity', location, product='electricity',
+                            production_volume=10,
+                            inputs=[{'name': 'market for electricity', 'product': 'electricity',
+                                     'unit': 'kilowatt hour', 'location': location, 'amount': 0.05}])
+
+    return make_market
+
+
+def test_regional_activities_same_with_workers(providers, make_market):
+    results = []
+    for workers in (None, 2):
+        db = WurstDatabase(deepcopy(providers))
+        base = make_market('GLO')
+        db.append(base)
+        create_regional_activities(base, ['FR', 'RER', 'CH'], db, workers=workers)
+        results.append([[(e['name'], e['location'], e['amount']) for e in ds['exchanges']] for ds in db])
+
+    assert results[0] == results[1]
+    # the new markets are only linked to the markets that were there before them, not to each other
+    for exchanges in results[0][-3:]:
+        assert {location for _, location, _ in exchanges[1:]} <= {'GB', 'DE', 'RoW', 'GLO'}
+
+
+@pytest.mark.parametrize('extra', [{}, dict(minimum=1, maximum=20, properties={'carbon content': {'amount': 0.5}},
+                                            tags=['a', 'b'])])
+def test_new_exchange_matches_deepcopy(make_consumer, make_provider, extra):
+    exchange = dict(make_consumer('GB')['exchanges'][1], **extra)
+    provider = make_provider(0, 'market group for electricity', 'RER')
+
+    expected = rescale_exchange(deepcopy(exchange), 0.25)
+    expected.update(name=provider['name'], location=provider['location'])
+    cloned = new_exchange(exchange, provider, 0.25)
+
+    assert cloned == expected
+    assert exchange['amount'] == 10 and exchange['location'] == 'GLO'
+    if 'properties' in exchange:
+        assert cloned['properties'] is not exchange['properties']
+
+
+def test_entries_are_only_recorded_for_enabled_levels(make_consumer):
+    this_journal = ChangeJournal(buffer_size=2)
+    sink = this_journal.add_sink(ListSink(level=logging.INFO))
+    ds = make_consumer('GB')
+
+    this_journal.record(logging.DEBUG, 'test', "{} to {}", ('a', 'b'), ds)
+    assert this_journal.buffer == []
+
+    this_journal.record(logging.INFO, 'test', "{} to {}", ('a', 'b'), ds)
+    assert sink.records == []
+    assert this_journal.buffer[0][3] == ('a', 'b')
+
+    this_journal.flush()
+    assert sink.records == [{'function': 'test', 'message': 'a to b', 'database': 'test_db', 'code': 'consumer_GB',
+                             'name': 'aluminium production', 'reference product': 'aluminium', 'unit': 'kilogram',
+                             'location': 'GB'}]
+
+
+def test_relink_journal(make_consumer, make_provider):
+    providers = [make_provider(0, 'market for electricity', 'GB'), make_provider(1, 'market for electricity', 'DE')]
+    sink = journal.add_sink(ListSink())
+
+    try:
+        relink_technosphere_exchanges(make_consumer('GB'), deepcopy(providers), contained=False)
+        relink_technosphere_exchanges(make_consumer('FR'), deepcopy(providers), contained=False, keep_invalid=True,
+                                      verbose=False)
+        journal.flush()
+    finally:
+        journal.remove_sink(sink)
+
+    messages = [x['message'] for x in sink.records]
+    assert messages == ["Relinked technosphere exchange of market for electricity/electricity/kilowatt hour from 10/GB "
+                        "to 10.0/GB.",
+                        "Retained potentially invalid technosphere exchange of market for electricity/electricity/"
+                        "kilowatt hour; no valid providers."]
+
+
+def test_relinks_follow_journal_detail_level(make_consumer, make_provider):
+    providers = [make_provider(0, 'market for electricity', 'GB')]
+    sink = journal.add_sink(ListSink(level=logging.INFO))
+
+    try:
+        relink_technosphere_exchanges(make_consumer('GB'), deepcopy(providers), contained=False)
+        journal.detail_level = logging.DEBUG
+        relink_technosphere_exchanges(make_consumer('GB'), deepcopy(providers), contained=False)
+        journal.flush()
+    finally:
+        journal.detail_level = logging.INFO
+        journal.remove_sink(sink)
+
+    assert len(sink.records) == 1
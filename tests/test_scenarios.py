@@ -0,0 +1,136 @@
+from futura.scenarios import ScenarioSweep, ParameterSweep, vary_task, parameter_grid, latin_hypercube, CAN_FORK
+from futura.wrappers import FuturaDatabase
+
+from types import SimpleNamespace
+import json
+import pytest
+import threading
+
+
+def make_sweep(tmpdir, variants, fork):
+    loader = SimpleNamespace(database=FuturaDatabase(), recipe={}, recipe_filepath=None, load_path=None)
+    log = tmpdir.join('calls.txt')
+
+    def add(code):
+        if code == 'fail':
+            raise RuntimeError(code)
+        with open(str(log), 'a') as f:
+            f.write(code + "\n")
+        loader.database.db.append({'database': 'test_db', 'code': code, 'location': 'GLO'})
+
+    def finish(name, loader):
+        return [x['code'] for x in loader.database.db]
+
+    sweep = ScenarioSweep(loader, variants, finish=finish, workers=2, fork=fork)
+    sweep.executor.actions['test'] = {'add': add}
+
+    return sweep, log
+
+
+@pytest.mark.parametrize('fork', [pytest.param(True, marks=pytest.mark.skipif(not CAN_FORK, reason="no os.fork")),
+                                  False])
+def test_sweep_runs_shared_actions_once(tmpdir, fork, make_recipe):
+    variants = {'low': make_recipe('base', 'low'),
+                'high': make_recipe('base', 'high', 'extra'),
+                'base': make_recipe('base'),
+                'broken': make_recipe('base', 'fail', 'never')}
+    sweep, log = make_sweep(tmpdir, variants, fork)
+
+    assert sweep.action_count() == 6
+
+    results = sweep.run()
+
+    assert results['low'] == {'status': 'finished', 'output': ['base', 'low']}
+    assert results['high'] == {'status': 'finished', 'output': ['base', 'high', 'extra']}
+    assert results['base'] == {'status': 'finished', 'output': ['base']}
+    assert results['broken']['status'] == 'failed'
+    assert 'RuntimeError' in results['broken']['error']
+
+    assert sorted(log.read().split()) == ['base', 'extra', 'high', 'low']
+
+
+def test_sweep_copies_branches_while_threads_run(tmpdir, monkeypatch, make_recipe):
+    variants = {'low': make_recipe('base', 'low'), 'high': make_recipe('base', 'high')}
+    sweep, log = make_sweep(tmpdir, variants, fork=True)
+
+    def no_fork():
+        raise AssertionError("forked with another thread running")
+
+    monkeypatch.setattr('futura.scenarios.os.fork', no_fork, raising=False)
+
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait)
+    thread.start()
+    try:
+        results = sweep.run()
+    finally:
+        stop.set()
+        thread.join()
+
+    assert results['low'] == {'status': 'finished', 'output': ['base', 'low']}
+    assert results['high'] == {'status': 'finished', 'output': ['base', 'high']}
+
+
+def test_sweep_falls_back_on_the_variant_ecoinvent(tmpdir, monkeypatch):
+    # the loader of a sweep has an empty recipe, the ecoinvent version has to come from the variant being run
+    monkeypatch.setattr('futura.recipe.check_database', lambda project_name, database_name: project_name != 'missing')
+
+    def extract(database_name):
+        return {'action': 'load', 'tasks': [{'function': 'extract_bw2_database',
+                                             'kwargs': {'project_name': 'missing', 'database_name': database_name}}]}
+
+    variants = {'old': {'metadata': {'ecoinvent_version': '3.5', 'ecoinvent_system_model': 'cutoff'},
+                        'actions': [extract('ecoinvent 3.5')]},
+                'new': {'metadata': {'ecoinvent_version': '3.6', 'ecoinvent_system_model': 'cutoff'},
+                        'actions': [extract('ecoinvent 3.6')]}}
+    sweep, log = make_sweep(tmpdir, variants, fork=False)
+
+    extracted = []
+    monkeypatch.setattr(FuturaDatabase, 'extract_bw2_database',
+                        lambda self, project_name, database_name, use_store=False: extracted.append(database_name))
+
+    results = sweep.run()
+
+    assert all(x['status'] == 'finished' for x in results.values())
+    assert sorted(extracted) == ['ecoinvent_cutoff35', 'ecoinvent_cutoff36']
+
+
+def test_vary_task(make_recipe):
+    recipe = make_recipe('a', 'b')
+    variant = vary_task(recipe, 'add', match={'code': 'b'}, code='c')
+
+    assert [x['tasks'][0]['kwargs']['code'] for x in variant['actions']] == ['a', 'c']
+    assert recipe['actions'][1]['tasks'][0]['kwargs']['code'] == 'b'
+
+    with pytest.raises(AssertionError):
+        vary_task(recipe, 'transfer_pv', factor=0.5)
+
+
+def recipe_metadata(name, loader):
+    return loader.recipe['metadata']
+
+
+def test_parameter_sweep(tmpdir):
+    recipe = tmpdir.join('sweep.yml')
+    recipe.write("metadata:\n  factor: {{ factor }}\n  year: {{ year }}\nactions: []\n")
+
+    points = parameter_grid({'factor': [0.25, 0.5], 'year': [2030, 2050]})
+    sweep = ParameterSweep(str(recipe), points, str(tmpdir.join('out')), save_fdb=False, finish=recipe_metadata,
+                           workers=2)
+    manifest = sweep.run()
+
+    assert [x['name'] for x in manifest['runs']] == ['sweep_000', 'sweep_001', 'sweep_002', 'sweep_003']
+    assert [x['output'] for x in manifest['runs']] == points
+    assert all(x['status'] == 'finished' for x in manifest['runs'])
+    assert json.loads(tmpdir.join('out', 'manifest.json').read())['runs'] == manifest['runs']
+
+    with pytest.raises(AssertionError):
+        ParameterSweep(str(recipe), [{'factr': 0.5}], str(tmpdir))
+
+
+def test_latin_hypercube():
+    points = latin_hypercube({'factor': (0, 1), 'share': (10, 20)}, 5, seed=1)
+
+    assert points == latin_hypercube({'factor': (0, 1), 'share': (10, 20)}, 5, seed=1)
+    assert sorted(int(x['factor'] * 5) for x in points) == [0, 1, 2, 3, 4]
+    assert sorted(int((x['share'] - 10) / 2) for x in points) == [0, 1, 2, 3, 4]
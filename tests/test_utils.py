@@ -0,0 +1,46 @@
+from futura.proxy import WurstDatabase
+from futura.utils import fix_unset_technosphere_and_production_exchange_locations, fix_products_and_locations_external
+
+import pytest
+
+
+def make_dataset(name, location, exchanges=()):
+    return {'name': name, 'unit': 'kilogram', 'location': location, 'database': 'test_db',
+            'exchanges': [{'name': name, 'unit': 'kilogram', 'type': 'production', 'amount': 1}] + list(exchanges)}
+
+
+def test_fix_unset_locations():
+    exchanges = [{'name': 'steel', 'unit': 'kilogram', 'type': 'technosphere', 'amount': 1},
+                 {'name': 'aluminium', 'unit': 'kilogram', 'type': 'technosphere', 'amount': 1},
+                 {'name': 'aluminium', 'unit': 'kilogram', 'type': 'technosphere', 'amount': 2},
+                 {'name': 'copper', 'unit': 'kilogram', 'type': 'technosphere', 'amount': 1}]
+    db = [make_dataset('steel', 'GB'),
+          make_dataset('aluminium', 'GB'),
+          make_dataset('aluminium', 'DE'),
+          make_dataset('car', 'FR', exchanges)]
+
+    ambiguous = fix_unset_technosphere_and_production_exchange_locations(db, verbose=False)
+
+    assert [e.get('location') for e in db[3]['exchanges']] == ['FR', 'GB', None, None, None]
+    assert ambiguous == {('aluminium', 'kilogram'): {'locations': ['GB', 'DE'], 'exchanges': 2},
+                         ('copper', 'kilogram'): {'locations': [], 'exchanges': 1}}
+
+
+def test_fix_products_and_locations_external():
+    existing = WurstDatabase([dict(make_dataset('steel', 'GB'), code='steel', **{'reference product': 'steel'})])
+    external = [{'name': 'car', 'unit': 'unit', 'database': 'cars', 'code': 'car', 'reference product': 'car',
+                 'exchanges': [{'name': 'car', 'unit': 'unit', 'type': 'production', 'amount': 1,
+                                'input': ('cars', 'car')},
+                               {'name': 'steel', 'unit': 'kilogram', 'type': 'technosphere', 'amount': 1000,
+                                'input': ('test_db', 'steel')}]}]
+
+    fix_products_and_locations_external(external, existing)
+
+    production, steel = external[0]['exchanges']
+    assert external[0]['location'] == 'GLO'
+    assert (production['product'], production['location'], production['production volume']) == ('car', 'GLO', 0)
+    assert (steel['product'], steel['location']) == ('steel', 'GB')
+
+    external[0]['exchanges'][1]['input'] = ('test_db', 'aluminium')
+    with pytest.raises(AssertionError):
+        fix_products_and_locations_external(external, existing)